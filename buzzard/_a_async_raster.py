@@ -1,6 +1,8 @@
+import sys
 import uuid
 import queue
 import weakref
+import asyncio
 
 from buzzard._a_source_raster import ASourceRaster, ABackSourceRaster
 from buzzard._footprint import Footprint
@@ -10,6 +12,13 @@ from buzzard._debug_observers_manager import DebugObserversManager
 
 QUEUE_POLL_DISTANCE = 0.1
 
+if sys.version_info >= (3, 7):
+    _running_loop = asyncio.get_running_loop
+else: # pragma: no cover
+    # `asyncio.get_running_loop` is new in python 3.7, from a coroutine `get_event_loop` returns the
+    # running loop
+    _running_loop = asyncio.get_event_loop
+
 class AAsyncRaster(ASourceRaster):
     """Base abstract class defining the common behavior of all rasters that are managed by the
     Dataset's scheduler.
@@ -18,10 +27,12 @@ class AAsyncRaster(ASourceRaster):
     ----------------
     - Has a `queue_data`, a low level method that can be used to query several arrays at once.
     - Has an `iter_data`, a higher level wrapper of `queue_data`.
+    - Has an `aiter_data` and an `aget_data`, the `asyncio` counterparts of `iter_data` and
+      `get_data`.
     """
 
     def queue_data(self, fps, channels=None, dst_nodata=None, interpolation='cv_area',
-                   max_queue_size=5, **kwargs):
+                   max_queue_size=5, ordered=True, **kwargs):
         """Read several rectangles of data on several channels from the source raster.
 
         Using `queue_data` instead of multiple calls to `get_data` allows more parallelism.
@@ -40,6 +51,10 @@ class AAsyncRaster(ASourceRaster):
         If you wish to cancel your request, loose the reference to the queue and the scheduler will
         gracefuly cancel the query.
 
+        If a pool used by the raster fails (e.g. an executor shut down by its owner), the query is
+        dropped and the `failure` attribute of the queue is set to the exception, it is `None`
+        otherwise.
+
         In general you should use the `iter_data` method instead of the `queue_data` one, it is much
         safer to use. However you will need to pass the `queue_data` method of a raster, to create
         another raster (a recipe) that depends on the first raster.
@@ -58,10 +73,15 @@ class AAsyncRaster(ASourceRaster):
             see `get_data` method
         max_queue_size: int
             Maximum number of arrays to prepare in advance in the underlying queue.
+        ordered: bool
+            If `True` the arrays are delivered in the same order as in the `fps` parameter.
+            If `False` each array is delivered as soon as it is ready, as a
+            `(index in fps, Footprint, ndarray)` tuple. A slow array does not delay the others.
+            In both cases at most `max_queue_size` arrays are prepared in advance.
 
         Returns
         -------
-        queue: queue.Queue of ndarray
+        queue: queue.Queue of ndarray (or of (int, Footprint, ndarray) if not `ordered`)
             The arrays are put into the queue in the same order as in the `fps` parameter.
 
         """
@@ -72,6 +92,7 @@ class AAsyncRaster(ASourceRaster):
 
         return self._back.queue_data(
             fps=fps,
+            ordered=bool(ordered),
             parent_uid=None,
             key_in_parent=None,
             **_tools.parse_queue_data_parameters(
@@ -80,7 +101,7 @@ class AAsyncRaster(ASourceRaster):
         )
 
     def iter_data(self, fps, channels=None, dst_nodata=None, interpolation='cv_area',
-                  max_queue_size=5, **kwargs):
+                  max_queue_size=5, ordered=True, **kwargs):
         """Read several rectangles of data on several channels from the source raster.
 
         The `iter_data` method is a higher level wrapper around the `queue_data` method. It
@@ -105,10 +126,15 @@ class AAsyncRaster(ASourceRaster):
             see `get_data` method
         max_queue_size: int
             Maximum number of arrays to prepare in advance in the underlying queue.
+        ordered: bool
+            If `True` the arrays are delivered in the same order as in the `fps` parameter.
+            If `False` each array is delivered as soon as it is ready, as a
+            `(index in fps, Footprint, ndarray)` tuple. A slow array does not delay the others.
+            In both cases at most `max_queue_size` arrays are prepared in advance.
 
         Returns
         -------
-        iterable: iterable of ndarray
+        iterable: iterable of ndarray (or of (int, Footprint, ndarray) if not `ordered`)
             The arrays are yielded into the generator in the same order as in the `fps` parameter.
 
         """
@@ -120,11 +146,105 @@ class AAsyncRaster(ASourceRaster):
 
         return self._back.iter_data(
             fps=fps,
+            ordered=bool(ordered),
             **_tools.parse_queue_data_parameters(
                 'iter_data', self, channels, dst_nodata, interpolation, max_queue_size, **kwargs
             )
         )
 
+    def aiter_data(self, fps, channels=None, dst_nodata=None, interpolation='cv_area',
+                   max_queue_size=5, ordered=True, **kwargs):
+        """Read several rectangles of data on several channels from the source raster.
+
+        The `aiter_data` method is the `asyncio` counterpart of the `iter_data` method. It returns
+        an asynchronous generator, to be used in an `async for` loop. While waiting for data, no
+        thread is blocked, the scheduler wakes up the event loop each time an array is ready.
+
+        The query is sent to the scheduler on the first iteration. If you wish to cancel your
+        request, cancel the task iterating, close the asynchronous generator or loose the
+        reference to it and the scheduler will gracefully cancel the query.
+
+        see rasters' `get_data` documentation, it shares most of the concepts
+        see `iter_data` documentation, it shares most of the concepts
+
+        Parameters
+        ----------
+        fps: sequence of Footprint
+            The Footprints at which the raster should be sampled.
+        channels:
+            see `get_data` method
+        dst_nodata:
+            see `get_data` method
+        interpolation:
+            see `get_data` method
+        max_queue_size: int
+            Maximum number of arrays to prepare in advance in the underlying queue.
+        ordered: bool
+            If `True` the arrays are delivered in the same order as in the `fps` parameter.
+            If `False` each array is delivered as soon as it is ready, as a
+            `(index in fps, Footprint, ndarray)` tuple. A slow array does not delay the others.
+            In both cases at most `max_queue_size` arrays are prepared in advance.
+
+        Returns
+        -------
+        iterable: async iterable of ndarray (or of (int, Footprint, ndarray) if not `ordered`)
+            The arrays are yielded into the generator in the same order as in the `fps` parameter.
+
+        Example
+        -------
+        >>> async for arr in r.aiter_data(fps):
+        ...     await send(arr)
+
+        """
+        for fp in fps:
+            if not isinstance(fp, Footprint):
+                raise ValueError('element of `fps` parameter should be a Footprint (not {})'.format(
+                    fp
+                )) # pragma: no cover
+
+        return self._back.aiter_data(
+            fps=fps,
+            ordered=bool(ordered),
+            **_tools.parse_queue_data_parameters(
+                'aiter_data', self, channels, dst_nodata, interpolation, max_queue_size, **kwargs
+            )
+        )
+
+    async def aget_data(self, fp=None, channels=None, dst_nodata=None, interpolation='cv_area',
+                        **kwargs):
+        """Read a rectangle of data on several channels from the source raster.
+
+        The `aget_data` method is the `asyncio` counterpart of the `get_data` method. Cancelling
+        the task awaiting it cancels the query.
+
+        see rasters' `get_data` documentation, it shares all the parameters
+
+        Returns
+        -------
+        ndarray
+
+        Example
+        -------
+        >>> arr = await r.aget_data(fp)
+
+        """
+        if fp is None:
+            fp = self.fp
+        elif not isinstance(fp, Footprint): # pragma: no cover
+            raise ValueError(f'`fp` parameter should be a Footprint (not {fp})')
+
+        it = self._back.aiter_data(
+            fps=[fp],
+            ordered=True,
+            **_tools.parse_queue_data_parameters(
+                'aget_data', self, channels, dst_nodata, interpolation, 1, **kwargs
+            )
+        )
+        try:
+            return await it.__anext__()
+        finally:
+            await it.aclose()
+
 class ABackAsyncRaster(ABackSourceRaster):
     """Implementation of AAsyncRaster's specifications"""
 
@@ -142,26 +262,36 @@ class ABackAsyncRaster(ABackSourceRaster):
         super().__init__(**kwargs)
 
     def queue_data(self, fps, channel_ids, dst_nodata, interpolation, max_queue_size, is_flat,
+                   ordered, parent_uid, key_in_parent):
+        q = _OutputQueue(max_queue_size, self.back_ds.wakeup_scheduler)
+        self._put_query(q, fps, channel_ids, dst_nodata, interpolation, is_flat, ordered,
+                        parent_uid, key_in_parent)
+        return q
+
+    def _put_query(self, q, fps, channel_ids, dst_nodata, interpolation, is_flat, ordered,
                    parent_uid, key_in_parent):
-        q = queue.Queue(max_queue_size)
+        # The scheduler is woken up when the queue is consumed or collected, since both events may
+        # allow it to make progress.
+        max_queue_size = q.maxsize
         self.back_ds.put_message(Msg(
             f'/Raster{self.uid}/QueriesHandler',
             'new_query',
-            weakref.ref(q),
+            weakref.ref(q, self.back_ds.wakeup_scheduler),
             max_queue_size,
             fps,
             channel_ids,
             is_flat,
             dst_nodata,
             interpolation,
+            ordered,
             parent_uid,
             key_in_parent
         ))
-        return q
 
-    def iter_data(self, fps, channel_ids, dst_nodata, interpolation, max_queue_size, is_flat):
+    def iter_data(self, fps, channel_ids, dst_nodata, interpolation, max_queue_size, is_flat,
+                  ordered):
         q = self.queue_data(fps, channel_ids, dst_nodata, interpolation, max_queue_size, is_flat,
-                            None, None)
+                            ordered, None, None)
         def _iter_data_generator():
             i = 0
             while True:
@@ -176,13 +306,53 @@ class ABackAsyncRaster(ABackSourceRaster):
                 else:
                     timeout = False
                 if timeout:
+                    if q.failure is not None:
+                        raise q.failure
                     self.back_ds.ensure_scheduler_still_alive()
         return _iter_data_generator()
 
+    def aiter_data(self, fps, channel_ids, dst_nodata, interpolation, max_queue_size, is_flat,
+                   ordered):
+        async def _aiter_data_generator():
+            q = _AsyncOutputQueue(
+                max_queue_size, self.back_ds.wakeup_scheduler, _running_loop(),
+            )
+            # The event is also set if the scheduler exits, instead of polling its status
+            self.back_ds.notify_on_scheduler_exit(q)
+            self._put_query(q, fps, channel_ids, dst_nodata, interpolation, is_flat, ordered,
+                            None, None)
+            try:
+                for _ in range(len(fps)):
+                    while True:
+                        q.new_data.clear()
+                        try:
+                            arr = q.get_nowait()
+                        except queue.Empty:
+                            pass
+                        else:
+                            break
+                        if q.failure is not None:
+                            raise q.failure
+                        if q.scheduler_exited_flag:
+                            self.back_ds.ensure_scheduler_still_alive()
+                        await q.new_data.wait()
+                    yield arr
+                    arr = None
+            except asyncio.CancelledError:
+                # The consumer task was cancelled while waiting, drop the query right away
+                q = None
+                raise
+            finally:
+                # Loosing the reference to the queue cancels the query (if not done), even if the
+                # frame of this generator is kept alive by an exception's traceback.
+                q = None
+        return _aiter_data_generator()
+
     def get_data(self, fp, channel_ids, dst_nodata, interpolation):
         it = self.iter_data(
             [fp], channel_ids, dst_nodata, interpolation, 1,
             False, # `is_flat` is not important since caller reshapes output
+            True,
         )
         return next(it)
 
@@ -202,3 +372,51 @@ class ABackAsyncRaster(ABackSourceRaster):
         # TODO: just sending a kill_raster message may not be enough. Need synchro?
         self.back_ds.deactivate_many(self.async_dict_path_of_cache_fp.values())
         super().close()
+
+class _OutputQueue(queue.Queue):
+    """Output queue of a query. Notifies the Dataset's scheduler each time an array is pulled."""
+
+    def __init__(self, maxsize, on_get):
+        super().__init__(maxsize)
+        self._on_get = on_get
+        self.failure = None
+
+    def get(self, block=True, timeout=None):
+        obj = super().get(block, timeout)
+        self._on_get()
+        return obj
+
+    def fail(self, exn):
+        """Called from the scheduler's thread when the query can't be completed"""
+        self.failure = exn
+
+class _AsyncOutputQueue(_OutputQueue):
+    """Output queue of a query issued from an `asyncio` event loop. Sets the `new_data` event in
+    the event loop each time an array is put, when the query fails and when the scheduler exits.
+    """
+
+    def __init__(self, maxsize, on_get, loop):
+        super().__init__(maxsize, on_get)
+        self._loop = loop
+        self.new_data = asyncio.Event()
+        self.scheduler_exited_flag = False
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self._notify()
+
+    def fail(self, exn):
+        super().fail(exn)
+        self._notify()
+
+    def scheduler_exited(self):
+        """Called from the scheduler's thread when it exits"""
+        self.scheduler_exited_flag = True
+        self._notify()
+
+    def _notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self.new_data.set)
+        except RuntimeError:
+            # The event loop is closed, nobody will ever read this queue
+            pass
@@ -5,15 +5,21 @@ import collections
 from buzzard._actors.message import Msg
 from buzzard._footprint import Footprint
 from buzzard._actors.cached.query_infos import CachedQueryInfos
+from buzzard._actors.cached.fill_marker import is_fill_marker, tile_of_fill_marker
 
 class ActorCacheExtractor:
-    """Actor that takes care of delaying reading operations according to cache state"""
+    """Actor that takes care of delaying reading operations according to cache state
+
+    The cache tiles found in the Dataset's tile cache and the uniform cache tiles are sent to the
+    `Reader` without reading their file.
+    """
 
     def __init__(self, raster):
         self._raster = raster
         self._alive = True
 
         self._path_of_cache_files_ready = {} # type: Mapping[Footprint, str]
+        self._path_of_cache_files_evicted = {} # type: Mapping[Footprint, str]
         self._reads_waiting_for_cache_fp = (
             collections.defaultdict(lambda: collections.defaultdict(set))
         ) # type: Mapping[Footprint, Mapping[CachedQueryInfos, Set[int]]]
@@ -35,12 +41,16 @@ class ActorCacheExtractor:
         missing_cache_fps = cache_fps - available_cache_fps
 
         for cache_fp in available_cache_fps:
-            msgs += [Msg(
-                'Reader', 'sample_cache_file_to_unique_array',
-                qi, prod_idx, cache_fp, self._path_of_cache_files_ready[cache_fp],
-            )]
+            msgs += self._sample(qi, prod_idx, cache_fp, self._path_of_cache_files_ready[cache_fp])
         for cache_fp in missing_cache_fps:
-            self._reads_waiting_for_cache_fp[cache_fp][qi].add(prod_idx)
+            if cache_fp in self._path_of_cache_files_evicted and not _is_computed_by(cache_fp, qi):
+                # This query was told that this cache file was ready before it was found corrupted,
+                # it will not be computed for this query.
+                msgs += self._sample(
+                    qi, prod_idx, cache_fp, self._path_of_cache_files_evicted[cache_fp],
+                )
+            else:
+                self._reads_waiting_for_cache_fp[cache_fp][qi].add(prod_idx)
 
         return msgs
 
@@ -54,18 +64,18 @@ class ActorCacheExtractor:
 
         new_cache_fps = path_of_cache_files_ready.keys() - self._path_of_cache_files_ready.keys()
         self._path_of_cache_files_ready.update(path_of_cache_files_ready)
+        for cache_fp in new_cache_fps:
+            self._path_of_cache_files_evicted.pop(cache_fp, None)
 
         for cache_fp in new_cache_fps:
             # TODO Idea: Send a external message to the facade to expose the set of path to cache files with a mutex
             for qi, prod_idxs in self._reads_waiting_for_cache_fp[cache_fp].items():
                 for prod_idx in prod_idxs:
-                    msgs += [Msg(
-                        'Reader', 'sample_cache_file_to_unique_array',
-                        qi, prod_idx, cache_fp, self._path_of_cache_files_ready[cache_fp]
-                    )]
+                    msgs += self._sample(
+                        qi, prod_idx, cache_fp, self._path_of_cache_files_ready[cache_fp],
+                    )
             del self._reads_waiting_for_cache_fp[cache_fp]
 
-
         return msgs
 
     def receive_sampled_a_cache_file_to_the_array(self, qi, prod_idx, cache_fp, array):
@@ -74,6 +84,22 @@ class ActorCacheExtractor:
             'Producer', 'sampled_a_cache_file_to_the_array', qi, prod_idx, cache_fp, array,
         )]
 
+    def receive_cache_file_evicted(self, cache_fp):
+        """Receive message: A cache file that was ready was found corrupted, the next queries will
+        compute it again.
+        """
+        self._path_of_cache_files_evicted[cache_fp] = self._path_of_cache_files_ready.pop(cache_fp)
+        self._raster.back_ds.tile_cache_discard(self._raster.uid, cache_fp)
+        return []
+
+    def receive_cache_file_removed(self, cache_fp):
+        """Receive message: A cache file that was ready was removed to free some disk space, no
+        ongoing query needs it.
+        """
+        del self._path_of_cache_files_ready[cache_fp]
+        self._raster.back_ds.tile_cache_discard(self._raster.uid, cache_fp)
+        return []
+
     def receive_cancel_this_query(self, qi):
         """Receive message: One query was dropped
 
@@ -94,7 +120,29 @@ class ActorCacheExtractor:
         assert self._alive
         self._alive = False
         self._reads_waiting_for_cache_fp.clear()
+        self._path_of_cache_files_evicted.clear()
+        self._raster.back_ds.tile_cache_discard_raster(self._raster.uid)
         self._raster = None
         return []
 
     # ******************************************************************************************* **
+    def _sample(self, qi, prod_idx, cache_fp, path):
+        """Send a cache tile synthesized from a fill marker or from the Dataset's tile cache to the
+        `Reader`, or ask it to read the cache file.
+        """
+        if is_fill_marker(path):
+            arr = tile_of_fill_marker(path, cache_fp, len(self._raster), self._raster.dtype)
+        else:
+            arr = self._raster.back_ds.tile_cache_get(self._raster.uid, cache_fp)
+        if arr is not None:
+            return [Msg(
+                'Reader', 'sample_cached_tile_to_unique_array', qi, prod_idx, cache_fp, arr,
+            )]
+        return [Msg(
+            'Reader', 'sample_cache_file_to_unique_array', qi, prod_idx, cache_fp, path,
+        )]
+
+    # ******************************************************************************************* **
+
+def _is_computed_by(cache_fp, qi):
+    return qi.cache_computation is not None and cache_fp in qi.cache_computation.list_of_cache_fp
@@ -0,0 +1,325 @@
+"""Formats of the cache files of a cached raster recipe
+
+The instances of those classes are sent to the `io_pool` along with the jobs, they should be
+picklable.
+"""
+
+import contextlib
+import os
+import uuid
+
+import numpy as np
+from osgeo import gdal
+
+from buzzard._gdal_file_raster import BackGDALFileRaster
+from buzzard._footprint import Footprint
+from buzzard._tools import conv, GDALErrorCatcher
+from buzzard._actors.cached.checksum import new_hasher, check_algorithm, HashingWriter
+
+create_raster = None # lazy import
+
+class ACacheFormat:
+    """Base abstract class of the formats of the cache files"""
+
+    # Extension of the cache files
+    suffix = None
+
+    # Whether `read` can return a view of the cache file instead of a copy
+    zero_copy = False
+
+    # Algorithm of the checksums of the new cache files, see `checksum.new_hasher`
+    checksum = 'blake2b'
+
+    def write(self, path, array, cache_fp, channels_schema, sr): # pragma: no cover
+        """Create a cache file at `path` containing `array` and return its checksum.
+
+        The checksum is computed while writing, see `checksum.new_hasher`.
+        """
+        raise NotImplementedError('ACacheFormat.write is virtual pure')
+
+    def check(self, path, cache_fp, channel_count, dtype, back_ds_opt): # pragma: no cover
+        """Raise an exception if the cache file at `path` does not match the other parameters"""
+        raise NotImplementedError('ACacheFormat.check is virtual pure')
+
+    def read(self, path, cache_fp, dtype, channel_ids, sample_fp, dst_opt, back_ds_opt): # pragma: no cover
+        """Read the rectangle `sample_fp` of the cache file at `path` to `dst_opt`, or to a new
+        array that is returned if `dst_opt` is None.
+        """
+        raise NotImplementedError('ACacheFormat.read is virtual pure')
+
+class GDALCacheFormat(ACacheFormat):
+    """Cache files written with a GDAL driver, tiled GeoTIFFs by default"""
+
+    DEFAULT_GTIFF_OPTIONS = (
+        "TILED=YES",
+        "BLOCKXSIZE=256", "BLOCKYSIZE=256",
+        "SPARSE_OK=TRUE",
+    )
+
+    def __init__(self, driver='GTiff', options=None, checksum='blake2b'):
+        success, payload = GDALErrorCatcher(gdal.GetDriverByName, none_is_error=True)(driver)
+        if not success:
+            raise ValueError('Could not find a driver named `{}` (gdal error: `{}`)'.format(
+                driver, payload[1]
+            ))
+        dr = payload
+        if dr.ShortName == 'MEM' or dr.GetMetadataItem(gdal.DCAP_RASTER) != 'YES' or \
+           dr.GetMetadataItem(gdal.DCAP_CREATE) != 'YES':
+            raise ValueError('The `{}` driver can\'t create raster files'.format(dr.ShortName))
+        if options is None:
+            options = self.DEFAULT_GTIFF_OPTIONS if dr.ShortName == 'GTiff' else ()
+        options = [str(arg) for arg in options]
+        if _created_file_count(dr, options) > 1:
+            raise ValueError('The `{}` driver creates several files per raster, it can\'t be used '
+                             'for cache files'.format(dr.ShortName))
+
+        self.driver = dr.ShortName
+        self.options = options
+        self.checksum = checksum
+        ext = dr.GetMetadataItem(gdal.DMD_EXTENSION)
+        self.suffix = '.' + (ext if ext else dr.ShortName.lower())
+
+    def write(self, path, array, cache_fp, channels_schema, sr):
+        # Lazily import buzzard to avoid circular dependencies
+        global create_raster
+        if create_raster is None:
+            from buzzard import create_raster
+
+        # Encode the file in memory, then dump it to disk in one sequential write while hashing it
+        assert array.ndim == 3
+        mem_dir = '/vsimem/buzzard_cache_{}'.format(uuid.uuid4())
+        mem_path = mem_dir + '/' + os.path.basename(path)
+        try:
+            with _no_pam():
+                with create_raster(mem_path, cache_fp, array.dtype, array.shape[-1],
+                                   channels_schema, driver=self.driver, sr=sr,
+                                   options=self.options).close as r:
+                    r.set_data(array, channels=None)
+
+            # Only the main file is renamed and removed later, a side-car file would be lost
+            names = gdal.ReadDir(mem_dir) or []
+            if names != [os.path.basename(path)]: # pragma: no cover
+                raise RuntimeError('The `{}` driver created {} instead of a single file'.format(
+                    self.driver, names,
+                ))
+            return _vsimem_dump(mem_path, path, new_hasher(self.checksum))
+        finally:
+            gdal.RmdirRecursive(mem_dir)
+
+    def check(self, path, cache_fp, channel_count, dtype, back_ds_opt):
+        with self._open(path, back_ds_opt) as gdal_ds:
+            file_fp = Footprint(
+                gt=gdal_ds.GetGeoTransform(),
+                rsize=(gdal_ds.RasterXSize, gdal_ds.RasterYSize),
+            )
+            file_dtype = conv.dtype_of_gdt_downcast(gdal_ds.GetRasterBand(1).DataType)
+            file_len = gdal_ds.RasterCount
+        if file_fp != cache_fp: # pragma: no cover
+            raise RuntimeError('invalid Footprint of {}({} instead of {})'.format(
+                path, file_fp, cache_fp
+            ))
+        if file_dtype != dtype: # pragma: no cover
+            raise RuntimeError('invalid dtype of {}({} instead of {})'.format(
+                path, file_dtype, dtype
+            ))
+        if file_len != channel_count: # pragma: no cover
+            raise RuntimeError('invalid channel_count of {}({} instead of {})'.format(
+                path, file_len, channel_count
+            ))
+
+    def read(self, path, cache_fp, dtype, channel_ids, sample_fp, dst_opt, back_ds_opt):
+        with self._open(path, back_ds_opt) as gdal_ds:
+            # Check raster
+            if gdal_ds is None: # pragma: no cover
+                raise RuntimeError("Could not open {}, what happend to it?".format(
+                    path
+                ))
+            if (gdal_ds.RasterXSize, gdal_ds.RasterYSize) != tuple(cache_fp.rsize): # pragma: no cover
+                raise RuntimeError('{} was expected to have rsize {}, not {}'.format(
+                    path,
+                    tuple(cache_fp.rsize),
+                    (gdal_ds.RasterXSize, gdal_ds.RasterYSize),
+                ))
+            stored_dtype = conv.dtype_of_gdt_downcast(gdal_ds.GetRasterBand(1).DataType)
+            if dtype != stored_dtype: # pragma: no cover
+                raise RuntimeError('{} was expected to have dtype {}, not {}'.format(
+                    path,
+                    dtype,
+                    stored_dtype,
+                ))
+
+            # Allocate if ProcessPool
+            if dst_opt is None:
+                dst = np.empty(np.r_[sample_fp.shape, len(channel_ids)], dtype)
+                ret = dst
+            else:
+                dst = dst_opt
+                ret = None
+
+            # Perform read
+            rtlx, rtly = cache_fp.spatial_to_raster(sample_fp.tl)
+            for i, ci in enumerate(channel_ids):
+                b = gdal_ds.GetRasterBand(ci + 1)
+                a = b.ReadAsArray(
+                    int(rtlx),
+                    int(rtly),
+                    int(sample_fp.rsizex),
+                    int(sample_fp.rsizey),
+                    buf_obj=dst[..., i],
+                )
+                del b
+                if a is None: # pragma: no cover
+                    raise RuntimeError(f'Could not read channel_id {ci}')
+        return ret
+
+    def _open(self, path, back_ds_opt):
+        allocator = lambda: BackGDALFileRaster.open_file(path, self.driver, [], 'r')
+        return _acquire(path, allocator, back_ds_opt)
+
+class NpyCacheFormat(ACacheFormat):
+    """Cache files written as raw `.npy` files of shape (Y, X, C), read through `np.memmap`.
+
+    No decoding is needed to read such files and the pixels are read straight from the OS's page
+    cache. When a whole cache file is read in the scheduler's address space, the array returned is
+    a copy-on-write memory map of the file.
+    """
+
+    suffix = '.npy'
+    zero_copy = True
+
+    def __init__(self, options=None, checksum='blake2b'):
+        if options:
+            raise ValueError('The `npy` cache driver does not take any option')
+        self.checksum = checksum
+
+    def write(self, path, array, cache_fp, channels_schema, sr):
+        assert array.ndim == 3
+        with open(path, 'wb') as stream:
+            stream = HashingWriter(stream, new_hasher(self.checksum))
+            np.save(stream, array, allow_pickle=False)
+        return stream.hexdigest()
+
+    def check(self, path, cache_fp, channel_count, dtype, back_ds_opt):
+        with self._open(path, back_ds_opt) as arr:
+            file_shape = arr.shape
+            file_dtype = arr.dtype
+        shape = tuple(cache_fp.shape) + (channel_count,)
+        if file_shape != shape: # pragma: no cover
+            raise RuntimeError('invalid shape of {}({} instead of {})'.format(
+                path, file_shape, shape
+            ))
+        if file_dtype != dtype: # pragma: no cover
+            raise RuntimeError('invalid dtype of {}({} instead of {})'.format(
+                path, file_dtype, dtype
+            ))
+
+    def read(self, path, cache_fp, dtype, channel_ids, sample_fp, dst_opt, back_ds_opt):
+        if dst_opt is None and sample_fp == cache_fp:
+            arr = _channels_view(np.load(path, mmap_mode='c'), channel_ids)
+            if arr is not None:
+                if arr.dtype != dtype: # pragma: no cover
+                    raise RuntimeError('{} was expected to have dtype {}, not {}'.format(
+                        path, dtype, arr.dtype,
+                    ))
+                # Hide the `np.memmap` subclass, the mapping stays alive through `arr.base`
+                return arr.view(np.ndarray)
+
+        with self._open(path, back_ds_opt) as arr:
+            if arr.shape[:2] != tuple(cache_fp.shape): # pragma: no cover
+                raise RuntimeError('{} was expected to have shape {}, not {}'.format(
+                    path, tuple(cache_fp.shape), arr.shape[:2],
+                ))
+            if arr.dtype != dtype: # pragma: no cover
+                raise RuntimeError('{} was expected to have dtype {}, not {}'.format(
+                    path, dtype, arr.dtype,
+                ))
+
+            # Allocate if ProcessPool
+            if dst_opt is None:
+                dst = np.empty(np.r_[sample_fp.shape, len(channel_ids)], dtype)
+                ret = dst
+            else:
+                dst = dst_opt
+                ret = None
+
+            # Perform read
+            np.take(arr[sample_fp.slice_in(cache_fp)], channel_ids, axis=2, out=dst)
+        return ret
+
+    def _open(self, path, back_ds_opt):
+        allocator = lambda: np.load(path, mmap_mode='r')
+        return _acquire(path, allocator, back_ds_opt)
+
+def create_cache_format(driver, options, checksum):
+    """Instanciate the format of the cache files from the `cache_driver`, `cache_options` and
+    `cache_checksum` parameters of `Dataset.create_cached_raster_recipe`. Raises a ValueError if
+    they are invalid.
+    """
+    check_algorithm(checksum)
+    if driver == 'npy':
+        return NpyCacheFormat(options, checksum)
+    return GDALCacheFormat(driver, options, checksum)
+
+def _created_file_count(dr, options):
+    """Number of files created by the driver `dr` for a small raster, or 1 if it could not be
+    created with those options
+    """
+    mem_dir = '/vsimem/buzzard_cache_{}'.format(uuid.uuid4())
+    try:
+        with _no_pam():
+            _, payload = GDALErrorCatcher(dr.Create, none_is_error=True)(
+                mem_dir + '/probe', 16, 16, 1, gdal.GDT_Float32, options
+            )
+            del payload # Closes the dataset
+        return max(1, len(gdal.ReadDir(mem_dir) or []))
+    finally:
+        gdal.RmdirRecursive(mem_dir)
+
+@contextlib.contextmanager
+def _no_pam():
+    """Prevent GDAL from writing `.aux.xml` side-car files on this thread"""
+    previous = gdal.GetThreadLocalConfigOption('GDAL_PAM_ENABLED', None)
+    gdal.SetThreadLocalConfigOption('GDAL_PAM_ENABLED', 'NO')
+    try:
+        yield
+    finally:
+        gdal.SetThreadLocalConfigOption('GDAL_PAM_ENABLED', previous)
+
+def _vsimem_dump(mem_path, path, hasher_opt):
+    """Move the file `mem_path` from GDAL's memory file system to `path`, return its checksum if
+    `hasher_opt` is provided.
+    """
+    stat = gdal.VSIStatL(mem_path)
+    if stat is None: # pragma: no cover
+        raise RuntimeError('Could not find {} in memory'.format(mem_path))
+    f = gdal.VSIFOpenL(mem_path, 'rb')
+    try:
+        data = gdal.VSIFReadL(1, stat.size, f)
+    finally:
+        gdal.VSIFCloseL(f)
+    gdal.Unlink(mem_path)
+    with open(path, 'wb') as stream:
+        stream.write(data)
+    if hasher_opt is not None:
+        hasher_opt.update(data)
+        return hasher_opt.hexdigest()
+    return None
+
+def _channels_view(arr, channel_ids):
+    """View of the channels `channel_ids` of `arr`, or None if it requires a copy"""
+    channel_ids = list(channel_ids)
+    if not channel_ids:
+        return None # pragma: no cover
+    start = channel_ids[0]
+    if channel_ids != list(range(start, start + len(channel_ids))):
+        return None
+    return arr[..., start:start + len(channel_ids)]
+
+@contextlib.contextmanager
+def _acquire(path, allocator, back_ds_opt):
+    """Use the Dataset's activation pool if available"""
+    if back_ds_opt is None:
+        yield allocator()
+    else:
+        with back_ds_opt.acquire_driver_object(path, allocator) as obj:
+            yield obj
@@ -0,0 +1,232 @@
+"""Index of the cache files of a cache directory"""
+
+import collections
+import logging
+import os
+import re
+import threading
+import uuid
+
+LOGGER = logging.getLogger(__name__)
+
+_FNAME_REGEX = re.compile(
+    r'^(?P<prefix>buzz_x\d+-y\d+_x\d+-y\d+)_(?P<checksum>[0-9a-f]+)(?P<suffix>\.[^_]+)$'
+)
+
+def fname_prefix_of_path(path):
+    """Extract the first part of the name of a cache file, the part that identifies its cache
+    tile, or None if `path` is not a cache file.
+    """
+    match = _FNAME_REGEX.match(os.path.basename(path))
+    if match is None:
+        return None
+    return match.group('prefix')
+
+class CacheManifest:
+    """Index of the cache files of a cache directory, to avoid listing the directory each time a
+    cache tile is looked up.
+
+    It is stored in the cache directory as an append-only log of lines:
+    - `+ <file name> <size> <mtime_ns>` when a cache file is written,
+    - `- <file name>` when a cache file is removed.
+
+    The lines are appended by batches from a background thread, each batch with a single `write`
+    call so that it is atomic. The log is compacted when loaded if it contains too many removed
+    files, the lines appended in the meantime by other processes are preserved. If the log is
+    missing, it is rebuilt from a single scan of the cache directory.
+
+    The log is only read when loaded, the cache files written in the meantime by other processes
+    sharing the cache directory are not seen.
+    """
+
+    FNAME = 'buzz_manifest.log'
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+        self._path = os.path.join(cache_dir, self.FNAME)
+        self._appender = _appender_of_path(self._path)
+        self._stat_of_fname = {} # type: Mapping[str, Tuple[int, int]]
+        self._fnames_of_prefix = collections.defaultdict(set) # type: Mapping[str, Set[str]]
+        self._total_size = 0
+        self._loaded = False
+
+    def load(self):
+        """Read the log, or rebuild it if missing"""
+        assert not self._loaded
+        self._loaded = True
+        # The lines of the other manifests of this process are read too
+        self.flush()
+        if not os.path.isfile(self._path):
+            self._rebuild()
+            return
+
+        line_count = 0
+        truncated = False
+        with open(self._path, 'rb') as stream:
+            data = stream.read()
+        for line in data.decode('utf-8', 'replace').splitlines(keepends=True):
+            line_count += 1
+            truncated = not line.endswith('\n')
+            words = line.split()
+            if len(words) == 4 and words[0] == '+':
+                try:
+                    stat = (int(words[2]), int(words[3]))
+                except ValueError: # pragma: no cover
+                    continue
+                self._register(words[1], stat)
+            elif len(words) == 2 and words[0] == '-':
+                self._unregister(words[1])
+            else: # pragma: no cover
+                # A truncated line, the process that wrote it probably crashed
+                LOGGER.warning('Ignoring an invalid line in {}'.format(self._path))
+        if truncated or line_count > 2 * len(self._stat_of_fname) + 64:
+            # Start from a clean log, the next lines shouldn't be appended to a truncated one
+            self._dump(len(data), truncated)
+
+    def paths(self, prefix=None, suffix=None):
+        """List the paths to the cache files with the given file name prefix and suffix"""
+        assert self._loaded
+        if prefix is None:
+            fnames = self._stat_of_fname.keys()
+        else:
+            fnames = self._fnames_of_prefix.get(prefix, ())
+        return [
+            os.path.join(self._cache_dir, fname)
+            for fname in fnames
+            if suffix is None or fname.endswith(suffix)
+        ]
+
+    def stat_of_path(self, path):
+        """Size and modification time recorded when the cache file at `path` was written, or None
+        if unknown.
+        """
+        return self._stat_of_fname.get(os.path.basename(path))
+
+    def total_size(self):
+        """Sum of the sizes of the cache files"""
+        return self._total_size
+
+    def add(self, path, size, mtime_ns):
+        """Record that a cache file was written"""
+        fname = os.path.basename(path)
+        self._register(fname, (size, mtime_ns))
+        self._append('+ {} {:d} {:d}\n'.format(fname, size, mtime_ns))
+
+    def remove(self, path):
+        """Record that a cache file was removed"""
+        fname = os.path.basename(path)
+        if fname in self._stat_of_fname:
+            self._unregister(fname)
+            self._append('- {}\n'.format(fname))
+
+    def flush(self):
+        """Wait until the lines of the log are written"""
+        self._appender.flush()
+
+    # ******************************************************************************************* **
+    def _register(self, fname, stat):
+        match = _FNAME_REGEX.match(fname)
+        if match is None: # pragma: no cover
+            return
+        if fname in self._stat_of_fname: # pragma: no cover
+            self._total_size -= self._stat_of_fname[fname][0]
+        self._stat_of_fname[fname] = stat
+        self._total_size += stat[0]
+        self._fnames_of_prefix[match.group('prefix')].add(fname)
+
+    def _unregister(self, fname):
+        if fname not in self._stat_of_fname:
+            return
+        self._total_size -= self._stat_of_fname.pop(fname)[0]
+        prefix = _FNAME_REGEX.match(fname).group('prefix')
+        self._fnames_of_prefix[prefix].remove(fname)
+        if not self._fnames_of_prefix[prefix]:
+            del self._fnames_of_prefix[prefix]
+
+    def _append(self, line):
+        self._appender.append(line)
+
+    def _rebuild(self):
+        LOGGER.info('Building {}'.format(self._path))
+        with os.scandir(self._cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and _FNAME_REGEX.match(entry.name) is not None:
+                    stat = entry.stat()
+                    self._register(entry.name, (stat.st_size, stat.st_mtime_ns))
+        self._dump()
+
+    def _dump(self, read_size=None, truncated=False):
+        """Write the whole log to a temporary file and replace the current one with it
+
+        If the current log was read, the lines appended to it after its first `read_size` bytes
+        (i.e. by another process since it was read) are copied to the new log.
+        """
+        tmp_path = os.path.join(self._cache_dir, 'tmp_' + str(uuid.uuid4()) + '_' + self.FNAME)
+        with open(tmp_path, 'wb') as stream:
+            for fname, (size, mtime_ns) in self._stat_of_fname.items():
+                stream.write('+ {} {:d} {:d}\n'.format(fname, size, mtime_ns).encode('utf-8'))
+            if read_size is not None:
+                with open(self._path, 'rb') as src:
+                    src.seek(read_size)
+                    tail = src.read()
+                if truncated:
+                    # The first new line was appended to the truncated one, it is lost
+                    tail = tail[tail.find(b'\n') + 1:] if b'\n' in tail else b''
+                stream.write(tail)
+        os.replace(tmp_path, self._path)
+
+class _LogAppender:
+    """Append lines to a file by batches, from a short-lived background thread"""
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._lines = []
+        self._thread = None
+
+    def append(self, line):
+        with self._lock:
+            self._lines.append(line)
+            if self._thread is not None:
+                # The running thread will write it
+                return
+            # Not a daemon thread, the lines are written before the interpreter exits
+            self._thread = threading.Thread(
+                target=self._write_lines, name='buzzard-cache-manifest', daemon=False,
+            )
+            thread = self._thread
+        thread.start()
+
+    def flush(self):
+        """Wait until the lines appended are written"""
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _write_lines(self):
+        while True:
+            with self._lock:
+                lines = self._lines
+                self._lines = []
+                if not lines:
+                    self._thread = None
+                    return
+            try:
+                with open(self._path, 'a') as stream:
+                    stream.write(''.join(lines))
+            except OSError as e: # pragma: no cover
+                LOGGER.warning('Could not append {} lines to {} ({})'.format(
+                    len(lines), self._path, e,
+                ))
+
+_APPENDERS_LOCK = threading.Lock()
+_APPENDER_OF_PATH = {} # type: Mapping[str, _LogAppender]
+
+def _appender_of_path(path):
+    """The manifests of a cache directory share an appender, so that their lines are ordered"""
+    path = os.path.abspath(path)
+    with _APPENDERS_LOCK:
+        if path not in _APPENDER_OF_PATH:
+            _APPENDER_OF_PATH[path] = _LogAppender(path)
+        return _APPENDER_OF_PATH[path]
@@ -1,14 +1,31 @@
+import collections
 import enum
+import heapq
+import itertools
 import logging
 import os
 
 from buzzard._actors.message import Msg
-from buzzard._actors.cached.query_infos import CacheComputationInfos
+from buzzard._actors.cached.query_infos import CacheComputationInfos, WarmQueryInfos
+from buzzard._actors.cached.checksum import can_verify
+from buzzard._actors.cached.fill_marker import is_fill_marker
 
 LOGGER = logging.getLogger(__name__)
 
 class ActorCacheSupervisor:
-    """Actor that takes care of tracking, checking and scheduling computation of cache files"""
+    """Actor that takes care of tracking, checking and scheduling computation of cache files
+
+    If the raster has a `cache_max_bytes`, it also removes the coldest cache files of this raster
+    when a new one makes them exceed it. The cache files of the ongoing queries are pinned, they
+    are never removed. The files of the other rasters sharing the cache directory, and the ones
+    that can't be verified in this environment, are neither counted nor removed.
+
+    The cache tiles invalidated by the user are computed again by the next queries, their old
+    cache files are removed once no ongoing query pins them.
+
+    The warm-ups of the cache are treated as the other queries, the QueriesHandler is notified
+    when their cache tiles become available.
+    """
 
     def __init__(self, raster):
         """
@@ -32,6 +49,35 @@ class ActorCacheSupervisor:
         # - _CacheTileStatus.ready
         self._path_of_cache_fp = raster.async_dict_path_of_cache_fp
 
+        # Corrupted cache files found by the background checks of the `'lazy'` cache verification.
+        # Those files might still be read by the queries that were already using them, they are
+        # removed when the raster dies.
+        self._corrupted_paths = []
+
+        # Usage of the cache tiles, to choose the cache files to remove when `cache_max_bytes` is
+        # exceeded
+        self._pinned_queries = set()
+        self._pin_count = collections.Counter() # type: Mapping[Footprint, int]
+        self._access_tick = 0
+        self._last_access = {} # type: Mapping[Footprint, int]
+        self._access_count = collections.Counter() # type: Mapping[Footprint, int]
+        self._lazy_checked_paths = set()
+        self._warm_pin_count = collections.Counter() # type: Mapping[Footprint, int]
+
+        # Cache files of this raster that count in `cache_max_bytes`, and heap of their cache tiles
+        # in eviction order. A cache tile is pushed again each time its key changes, the outdated
+        # entries are skipped when popped.
+        self._own_size_of_path = {} # type: Mapping[str, int]
+        self._own_bytes = 0
+        self._eviction_key_of_cache_fp = {} # type: Mapping[Footprint, tuple]
+        self._eviction_heap = [] # type: List[Tuple[tuple, int, Footprint]]
+        self._eviction_seq = itertools.count()
+
+        # Invalidated cache tiles
+        self._stale_paths = collections.defaultdict(list) # type: Mapping[Footprint, List[str]]
+        self._invalidated_while_checking = set()
+        self._invalidated_while_computing = set()
+
     @property
     def alive(self):
         return self._alive
@@ -47,19 +93,11 @@ class ActorCacheSupervisor:
         qi: _actors.cached.query_infos.QueryInfos
         """
 
-        if not self._directory_primed:
-            self._directory_primed = True
-            os.makedirs(self._raster.cache_dir, exist_ok=True)
-            if self._raster.overwrite:
-                file_list = self._raster.list_cache_path_candidates()
-                LOGGER.info('Removing {} cache files'.format(
-                    len(file_list)
-                ))
-                for path in file_list:
-                    os.remove(path)
+        self._prime_directory()
 
         msgs = []
         cache_fps = qi.list_of_cache_fp
+        self._pin(qi)
 
         query = _Query()
         self._queries[qi] = query
@@ -77,8 +115,30 @@ class ActorCacheSupervisor:
                 query.cache_fps_to_compute.add(cache_fp)
 
             elif status == _CacheTileStatus.unknown:
-                path_candidates = self._raster.list_cache_path_candidates(cache_fp)
-                if len(path_candidates) == 1:
+                # The files that can't be verified in this environment might be valid and used by
+                # another environment, they are neither served nor removed
+                path_candidates = [
+                    path
+                    for path in self._raster.list_cache_path_candidates(cache_fp)
+                    if is_fill_marker(path) or can_verify(path)
+                ]
+                if (len(path_candidates) == 1 and self._raster.cache_verification == 'lazy' and
+                        not os.path.isfile(path_candidates[0])):
+                    # The file was removed behind the manifest's back
+                    self._forget_cache_file(path_candidates[0])
+                    path_candidates = []
+
+                if len(path_candidates) == 1 and self._raster.cache_verification == 'lazy':
+                    # Serve this cache tile right away, check it in the background
+                    self._cache_fps_status[cache_fp] = _CacheTileStatus.ready
+                    self._path_of_cache_fp[cache_fp] = path_candidates[0]
+                    self._raster.debug_mngr.event('cache_file_update', self._raster.facade_proxy, cache_fp, 'ready')
+                    query.cache_fps_ensured.add(cache_fp)
+                    self._lazy_checked_paths.add(path_candidates[0])
+                    msgs += [
+                        Msg('FileChecker', 'verify_cache_file_later', cache_fp, path_candidates[0])
+                    ]
+                elif len(path_candidates) == 1:
                     self._cache_fps_status[cache_fp] = _CacheTileStatus.checking
                     self._path_of_cache_fp[cache_fp] = path_candidates[0]
                     self._raster.debug_mngr.event('cache_file_update', self._raster.facade_proxy, cache_fp, 'unknown')
@@ -93,19 +153,17 @@ class ActorCacheSupervisor:
                         LOGGER.warning(
                             f'Removing {path} because {len(path_candidates)} tiles with the same prefix'
                         )
-                        os.remove(path)
+                        self._remove_cache_file(path)
                     query.cache_fps_to_compute.add(cache_fp)
             else: # pragma: no cover
                 assert False
 
         if len(query.cache_fps_ensured) != 0:
             # Notify the production pipeline that those cache tiles are already ready
-            msgs += [
-                Msg('CacheExtractor', 'cache_files_ready', {
-                    fp: self._path_of_cache_fp[fp]
-                    for fp in query.cache_fps_ensured
-                })
-            ]
+            msgs += self._cache_files_ready({
+                fp: self._path_of_cache_fp[fp]
+                for fp in query.cache_fps_ensured
+            })
         if len(query.cache_fps_checking) == 0:
             # CacheSupervisor is now done working on this query
             del self._queries[qi]
@@ -124,12 +182,20 @@ class ActorCacheSupervisor:
         ----------
         cache_fp: Footprint
         path: str
-        status: bool
+        status: None or bool
+            None if the file can't be verified in this environment
         """
         msgs = []
 
         # assertions
         assert self._cache_fps_status[cache_fp] == _CacheTileStatus.checking
+
+        if cache_fp in self._invalidated_while_checking:
+            self._invalidated_while_checking.remove(cache_fp)
+            if status:
+                self._raster.back_ds.deactivate(path)
+                self._remove_cache_file(path)
+                status = False
         for query in self._queries.values():
             assert cache_fp not in query.cache_fps_ensured
             assert cache_fp not in query.cache_fps_to_compute
@@ -140,13 +206,13 @@ class ActorCacheSupervisor:
             self._path_of_cache_fp[cache_fp] = path
             self._cache_fps_status[cache_fp] = _CacheTileStatus.ready
             self._raster.debug_mngr.event('cache_file_update', self._raster.facade_proxy, cache_fp, 'ready')
-            msgs += [
-                Msg('CacheExtractor', 'cache_files_ready', {cache_fp: path})
-            ]
+            msgs += self._cache_files_ready({cache_fp: path})
         else:
-            # This cache tile was corrupted and removed
+            # This cache tile was corrupted and removed, or can't be verified and is left untouched
             self._cache_fps_status[cache_fp] = _CacheTileStatus.absent
             del self._path_of_cache_fp[cache_fp]
+            if status is not None:
+                self._forget_cache_file(path)
             self._raster.debug_mngr.event('cache_file_update', self._raster.facade_proxy, cache_fp, 'absent')
 
         queries_treated = []
@@ -172,6 +238,41 @@ class ActorCacheSupervisor:
 
         return msgs
 
+    def receive_verified_cache_file(self, cache_fp, path, status):
+        """Receive message: One cache tile that was already being served was checked in the
+        background
+
+        Parameters
+        ----------
+        cache_fp: Footprint
+        path: str
+        status: None or bool
+            None if the file can't be verified in this environment
+        """
+        self._lazy_checked_paths.discard(path)
+        if cache_fp in self._stale_paths:
+            # This cache tile was invalidated while being checked
+            self._remove_stale_paths(cache_fp)
+            return []
+        if status:
+            return []
+        assert self._cache_fps_status[cache_fp] == _CacheTileStatus.ready
+        assert self._path_of_cache_fp[cache_fp] == path
+
+        # Evict this cache tile, the next queries will compute it again
+        self._cache_fps_status[cache_fp] = _CacheTileStatus.absent
+        del self._path_of_cache_fp[cache_fp]
+        if status is None:
+            # This file may be valid, it is left untouched
+            LOGGER.warning('Evicting {} because it can\'t be verified'.format(path))
+        else:
+            LOGGER.warning('Evicting {} because corrupted'.format(path))
+            self._corrupted_paths.append(path)
+        self._raster.debug_mngr.event('cache_file_update', self._raster.facade_proxy, cache_fp, 'absent')
+        return [
+            Msg('CacheExtractor', 'cache_file_evicted', cache_fp)
+        ]
+
     def receive_cache_file_written(self, cache_fp, path):
         """Receive message: One cache file was just written to disk
 
@@ -186,9 +287,52 @@ class ActorCacheSupervisor:
         self._path_of_cache_fp[cache_fp] = path
         self._cache_fps_status[cache_fp] = _CacheTileStatus.ready
         self._raster.debug_mngr.event('cache_file_update', self._raster.facade_proxy, cache_fp, 'ready')
-        msgs += [
-            Msg('CacheExtractor', 'cache_files_ready', {cache_fp: path})
-        ]
+        if self._raster.cache_max_bytes is not None and not is_fill_marker(path):
+            mtime_ns = self._track_cache_file(path)
+            self._push_eviction_key(cache_fp, mtime_ns)
+        msgs += self._cache_files_ready({cache_fp: path})
+        if cache_fp in self._invalidated_while_computing:
+            # The queries waiting for this cache tile use it, the next ones will compute it again
+            self._invalidated_while_computing.remove(cache_fp)
+            msgs += self._invalidate_ready(cache_fp)
+        msgs += self._enforce_max_bytes()
+        return msgs
+
+    def ext_receive_invalidate_cache_files(self, cache_fps):
+        """Receive message sent by something else than an actor, still treated synchronously: Those
+        cache tiles are outdated, remove their cache files.
+
+        Parameters
+        ----------
+        cache_fps: sequence of Footprint
+        """
+        self._prime_directory()
+        msgs = []
+
+        for cache_fp in cache_fps:
+            status = self._cache_fps_status[cache_fp]
+
+            if status == _CacheTileStatus.unknown:
+                for path in self._raster.list_cache_path_candidates(cache_fp):
+                    self._remove_cache_file(path)
+                self._cache_fps_status[cache_fp] = _CacheTileStatus.absent
+                self._raster.debug_mngr.event('cache_file_update', self._raster.facade_proxy, cache_fp, 'absent')
+
+            elif status == _CacheTileStatus.checking:
+                # The file is removed when the check is done
+                self._invalidated_while_checking.add(cache_fp)
+
+            elif status == _CacheTileStatus.ready:
+                msgs += self._invalidate_ready(cache_fp)
+
+            elif status == _CacheTileStatus.absent:
+                if self._is_being_computed(cache_fp):
+                    # The computation might have used outdated inputs
+                    self._invalidated_while_computing.add(cache_fp)
+
+            else: # pragma: no cover
+                assert False
+
         return msgs
 
     def receive_cancel_this_query(self, qi):
@@ -200,6 +344,17 @@ class ActorCacheSupervisor:
         """
         if qi in self._queries:
             del self._queries[qi]
+        self._unpin(qi)
+        return []
+
+    def receive_query_done(self, qi):
+        """Receive message: One query produced all its arrays
+
+        Parameters
+        ----------
+        qi: _actors.cached.query_infos.QueryInfos
+        """
+        self._unpin(qi)
         return []
 
     def receive_die(self):
@@ -210,10 +365,239 @@ class ActorCacheSupervisor:
         self._queries.clear()
         self._path_of_cache_fp = None
         self._cache_fps_status.clear()
+        self._pinned_queries.clear()
+        self._pin_count.clear()
+        self._last_access.clear()
+        self._access_count.clear()
+        self._own_size_of_path.clear()
+        self._eviction_key_of_cache_fp.clear()
+        self._eviction_heap.clear()
+        self._lazy_checked_paths.clear()
+        self._warm_pin_count.clear()
+        self._invalidated_while_checking.clear()
+        self._invalidated_while_computing.clear()
+
+        if self._corrupted_paths:
+            self._raster.back_ds.deactivate_many(self._corrupted_paths)
+            for path in self._corrupted_paths:
+                LOGGER.warning('Removing {} because corrupted'.format(path))
+                self._remove_cache_file(path)
+            self._corrupted_paths.clear()
+
+        stale_paths = [path for paths in self._stale_paths.values() for path in paths]
+        if stale_paths:
+            self._raster.back_ds.deactivate_many(stale_paths)
+            for path in stale_paths:
+                self._remove_cache_file(path)
+            self._stale_paths.clear()
+
         self._raster = None
         return []
 
     # ******************************************************************************************* **
+    def _prime_directory(self):
+        if self._directory_primed:
+            return
+        self._directory_primed = True
+        os.makedirs(self._raster.cache_dir, exist_ok=True)
+        self._raster.cache_manifest.load()
+        if self._raster.overwrite:
+            file_list = self._raster.list_cache_path_candidates()
+            LOGGER.info('Removing {} cache files'.format(
+                len(file_list)
+            ))
+            for path in file_list:
+                self._remove_cache_file(path)
+        if self._raster.cache_max_bytes is not None:
+            # The cache files written before this raster was created
+            for path in self._raster.cache_manifest.paths(None, self._raster.cache_format.suffix):
+                cache_fp = self._raster.cache_fp_of_path(path)
+                if cache_fp is None or not can_verify(path):
+                    continue
+                mtime_ns = self._track_cache_file(path)
+                self._push_eviction_key(cache_fp, mtime_ns)
+
+    def _cache_files_ready(self, path_of_cache_fp):
+        """Notify the production pipeline, and the warm-ups waiting for them, that those cache
+        tiles can be read
+        """
+        msgs = [
+            Msg('CacheExtractor', 'cache_files_ready', path_of_cache_fp)
+        ]
+        warmed_cache_fps = [
+            cache_fp
+            for cache_fp in path_of_cache_fp.keys()
+            if cache_fp in self._warm_pin_count
+        ]
+        if warmed_cache_fps:
+            msgs += [
+                Msg('QueriesHandler', 'warmed_those_cache_files', warmed_cache_fps)
+            ]
+        return msgs
+
+    def _remove_cache_file(self, path):
+        self._forget_cache_file(path)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def _track_cache_file(self, path):
+        """Count the cache file at `path` in `cache_max_bytes`, returns its modification time"""
+        size, mtime_ns = self._raster.cache_manifest.stat_of_path(path)
+        self._own_bytes += size - self._own_size_of_path.get(path, 0)
+        self._own_size_of_path[path] = size
+        return mtime_ns
+
+    def _forget_cache_file(self, path):
+        self._raster.cache_manifest.remove(path)
+        self._own_bytes -= self._own_size_of_path.pop(path, 0)
+
+    def _invalidate_ready(self, cache_fp):
+        path = self._path_of_cache_fp.pop(cache_fp)
+        self._cache_fps_status[cache_fp] = _CacheTileStatus.absent
+        self._raster.debug_mngr.event('cache_file_update', self._raster.facade_proxy, cache_fp, 'absent')
+        self._stale_paths[cache_fp].append(path)
+        self._remove_stale_paths(cache_fp)
+        return [
+            # The ongoing queries that are not computing this cache tile still read the old file
+            Msg('CacheExtractor', 'cache_file_evicted', cache_fp)
+        ]
+
+    def _remove_stale_paths(self, cache_fp):
+        """Remove the old cache files of an invalidated cache tile that are not in use anymore"""
+        if cache_fp in self._pin_count:
+            return
+        remaining = []
+        for path in self._stale_paths.pop(cache_fp):
+            if path in self._lazy_checked_paths:
+                remaining.append(path)
+                continue
+            try:
+                self._raster.back_ds.deactivate(path)
+            except RuntimeError:
+                # Still read by a job of a cancelled query
+                remaining.append(path)
+                continue
+            self._remove_cache_file(path)
+        if remaining:
+            self._stale_paths[cache_fp] = remaining
+
+    def _is_being_computed(self, cache_fp):
+        return any(
+            qi.cache_computation is not None and cache_fp in qi.cache_computation.list_of_cache_fp
+            for qi in self._pinned_queries
+        )
+
+    def _pin(self, qi):
+        self._pinned_queries.add(qi)
+        self._access_tick += 1
+        for cache_fp in qi.list_of_cache_fp:
+            self._pin_count[cache_fp] += 1
+            self._last_access[cache_fp] = self._access_tick
+            self._access_count[cache_fp] += 1
+            if cache_fp in self._eviction_key_of_cache_fp:
+                self._push_eviction_key(cache_fp, self._eviction_key_of_cache_fp[cache_fp][-1])
+        if isinstance(qi, WarmQueryInfos):
+            self._warm_pin_count.update(qi.list_of_cache_fp)
+
+    def _unpin(self, qi):
+        if qi not in self._pinned_queries:
+            return
+        self._pinned_queries.remove(qi)
+        if isinstance(qi, WarmQueryInfos):
+            for cache_fp in qi.list_of_cache_fp:
+                self._warm_pin_count[cache_fp] -= 1
+                if self._warm_pin_count[cache_fp] == 0:
+                    del self._warm_pin_count[cache_fp]
+        for cache_fp in qi.list_of_cache_fp:
+            self._pin_count[cache_fp] -= 1
+            if self._pin_count[cache_fp] == 0:
+                del self._pin_count[cache_fp]
+                # No ongoing query will write it anymore
+                self._invalidated_while_computing.discard(cache_fp)
+                if cache_fp in self._stale_paths:
+                    self._remove_stale_paths(cache_fp)
+
+    def _enforce_max_bytes(self):
+        """Remove the coldest cache files of this raster that are not pinned until they fit in
+        `cache_max_bytes`
+        """
+        max_bytes = self._raster.cache_max_bytes
+        if max_bytes is None or self._own_bytes <= max_bytes:
+            return []
+
+        msgs = []
+        skipped = []
+        while self._eviction_heap and self._own_bytes > max_bytes:
+            entry = heapq.heappop(self._eviction_heap)
+            key, _, cache_fp = entry
+            if self._eviction_key_of_cache_fp.get(cache_fp) != key:
+                # Outdated entry
+                continue
+            paths = [
+                path
+                for path in self._raster.list_cache_path_candidates(cache_fp)
+                if path in self._own_size_of_path and path not in self._corrupted_paths
+            ]
+            if (cache_fp in self._pin_count or
+                    cache_fp in self._stale_paths or
+                    self._cache_fps_status[cache_fp] == _CacheTileStatus.checking or
+                    any(path in self._lazy_checked_paths for path in paths)):
+                skipped.append(entry)
+                continue
+            for path in paths:
+                msgs += self._evict(path, cache_fp)
+            if any(path in self._own_size_of_path for path in paths):
+                # Still read by a job of a cancelled query, the next calls to `_enforce_max_bytes`
+                # will try again
+                skipped.append(entry)
+            else:
+                del self._eviction_key_of_cache_fp[cache_fp]
+        for entry in skipped:
+            heapq.heappush(self._eviction_heap, entry)
+
+        if self._own_bytes > max_bytes:
+            LOGGER.warning('The cache files of {} exceed `cache_max_bytes` by {} bytes, the remaining ones are in use'.format(
+                self._raster.cache_dir, self._own_bytes - max_bytes,
+            ))
+        return msgs
+
+    def _push_eviction_key(self, cache_fp, mtime_ns):
+        key = self._eviction_key(cache_fp, mtime_ns)
+        self._eviction_key_of_cache_fp[cache_fp] = key
+        heapq.heappush(self._eviction_heap, (key, next(self._eviction_seq), cache_fp))
+        if len(self._eviction_heap) > 2 * len(self._eviction_key_of_cache_fp) + 64:
+            # Drop the outdated entries
+            self._eviction_heap = [
+                (key, next(self._eviction_seq), cache_fp)
+                for cache_fp, key in self._eviction_key_of_cache_fp.items()
+            ]
+            heapq.heapify(self._eviction_heap)
+
+    def _eviction_key(self, cache_fp, mtime_ns):
+        # The cache files that were not used by this raster go first, the oldest first
+        last_access = self._last_access.get(cache_fp, 0)
+        if self._raster.cache_eviction == 'lru':
+            return (last_access, mtime_ns)
+        return (self._access_count[cache_fp], last_access, mtime_ns)
+
+    def _evict(self, path, cache_fp):
+        try:
+            self._raster.back_ds.deactivate(path)
+        except RuntimeError:
+            LOGGER.debug('Not removing {} because it is in use'.format(path))
+            return []
+
+        msgs = []
+        if (self._cache_fps_status[cache_fp] == _CacheTileStatus.ready and
+                self._path_of_cache_fp[cache_fp] == path):
+            self._cache_fps_status[cache_fp] = _CacheTileStatus.absent
+            del self._path_of_cache_fp[cache_fp]
+            self._raster.debug_mngr.event('cache_file_update', self._raster.facade_proxy, cache_fp, 'absent')
+            msgs += [Msg('CacheExtractor', 'cache_file_removed', cache_fp)]
+        LOGGER.debug('Removing {} because `cache_max_bytes` is exceeded'.format(path))
+        self._remove_cache_file(path)
+        return msgs
+
     def _query_start_collection(self, qi, query):
         assert len(query.cache_fps_checking) == 0
         assert len(query.cache_fps_to_compute) > 0
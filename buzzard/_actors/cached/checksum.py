@@ -0,0 +1,129 @@
+"""Checksums of the cache files, stored in their names
+
+The checksum of a cache file is computed while the file is written, and recomputed from the file
+by the file checker. The algorithm that produced a checksum is identified by its length:
+- 16 hex digits: sum of the file as uint64 words, written by older versions of buzzard,
+- 24 hex digits: blake2b from `hashlib`,
+- 32 hex digits: xxh3_128 from the optional `xxhash` package, much faster than blake2b.
+
+New cache files use blake2b, or xxh3_128 if the recipe opts in with `cache_checksum='xxh3'`. The
+algorithm does not depend on the environment, so that several environments can share a cache
+directory. A cache file whose checksum can't be computed in this environment is never served nor
+removed, its cache tile is computed again.
+"""
+
+import hashlib
+import logging
+import warnings
+
+import numpy as np
+
+try:
+    import xxhash
+except ImportError: # pragma: no cover
+    xxhash = None
+
+XXHASH_AVAILABLE = xxhash is not None
+
+LOGGER = logging.getLogger(__name__)
+
+_BLAKE2B_DIGEST_SIZE = 12
+
+ALGORITHMS = ('blake2b', 'xxh3')
+
+def new_hasher(algorithm):
+    """Create the hasher object of the new cache files, it has the `update` and `hexdigest`
+    methods of the `hashlib` objects.
+
+    Parameters
+    ----------
+    algorithm: str
+        One of `ALGORITHMS`
+    """
+    if algorithm == 'xxh3':
+        return xxhash.xxh3_128()
+    assert algorithm == 'blake2b'
+    return hashlib.blake2b(digest_size=_BLAKE2B_DIGEST_SIZE)
+
+def check_algorithm(algorithm):
+    """Raise a ValueError if `algorithm` can't be used to write new cache files"""
+    if algorithm not in ALGORITHMS:
+        raise ValueError('`cache_checksum` should be one of {}'.format(
+            ', '.join('`{}`'.format(a) for a in ALGORITHMS)
+        ))
+    if algorithm == 'xxh3' and not XXHASH_AVAILABLE:
+        raise ValueError('`cache_checksum=\'xxh3\'` requires the `xxhash` package')
+
+def checksum_of_path(path):
+    """Checksum stored in the name of a cache file"""
+    return path.split('.')[-2].split('_')[-1]
+
+def can_verify(path):
+    """Can the checksum of the cache file at `path` be computed in this environment"""
+    checksum_length = len(checksum_of_path(path))
+    if checksum_length in (16, _BLAKE2B_DIGEST_SIZE * 2):
+        return True
+    return checksum_length == 32 and XXHASH_AVAILABLE
+
+def checksum_of_file(path, checksum_length, buffer_size=512 * 1024):
+    """Compute the checksum of the file at `path` with the algorithm that produces checksums of
+    `checksum_length` hex digits.
+
+    Returns None if this algorithm is unknown or unavailable, such a file can't be verified.
+    """
+    if checksum_length == 16:
+        return _legacy_checksum(path, buffer_size)
+    if checksum_length == _BLAKE2B_DIGEST_SIZE * 2:
+        hasher = hashlib.blake2b(digest_size=_BLAKE2B_DIGEST_SIZE)
+    elif checksum_length == 32:
+        if not XXHASH_AVAILABLE:
+            LOGGER.warning('The `xxhash` package is required to check {}'.format(path))
+            return None
+        hasher = xxhash.xxh3_128()
+    else:
+        LOGGER.warning('Unknown checksum length of {}'.format(path))
+        return None
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(buffer_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class HashingWriter:
+    """Write-only file object that hashes the bytes written to `stream`"""
+
+    def __init__(self, stream, hasher):
+        self._stream = stream
+        self._hasher = hasher
+
+    def write(self, b):
+        self._hasher.update(b)
+        return self._stream.write(b)
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+def _legacy_checksum(fname, buffer_size, dtype='uint64'):
+    # https://github.com/earthcube-lab/buzzard/pull/39/#discussion_r239071556
+    dtype = np.dtype(dtype)
+    dtypesize = dtype.itemsize
+    assert buffer_size % dtypesize == 0
+    assert np.issubdtype(dtype, np.unsignedinteger)
+
+    acc = dtype.type(0)
+    with open(fname, "rb") as f:
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', r'overflow encountered')
+
+            for chunk in iter(lambda: f.read(buffer_size), b""):
+                head = np.frombuffer(chunk, dtype, count=len(chunk) // dtypesize)
+                head = np.add.reduce(head, dtype=dtype, initial=acc)
+                acc += head
+
+                tailsize = len(chunk) % dtypesize
+                if tailsize > 0:
+                    # This should only be needed for file's tail
+                    tail = chunk[-tailsize:] + b'\0' * (dtypesize - tailsize)
+                    tail = np.frombuffer(tail, dtype)
+                    acc += tail
+        return f'{acc.item():016x}'
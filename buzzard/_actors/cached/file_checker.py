@@ -1,22 +1,26 @@
 import logging
 import functools
+import collections
 import os
-import contextlib
-import multiprocessing as mp
-import multiprocessing.pool
-
-import numpy as np
 
 from buzzard._actors.message import Msg
-from buzzard._actors.pool_job import MaxPrioJobWaiting, PoolJobWorking
-from buzzard._gdal_file_raster import BackGDALFileRaster
-from buzzard._tools import conv
-from buzzard._footprint import Footprint
+from buzzard._actors.pool_job import (
+    MaxPrioJobWaiting, MinPrioJobWaiting, PoolJobWorking, array_nbytes,
+)
+from buzzard._dataset_pools_container import shares_address_space
+from buzzard._actors.cached.checksum import checksum_of_file, checksum_of_path
+from buzzard._actors.cached.fill_marker import is_fill_marker, value_of_fill_marker
 
 LOGGER = logging.getLogger(__name__)
 
 class ActorFileChecker:
-    """Actor that takes care of performing various checks on a cache file from a pool"""
+    """Actor that takes care of performing various checks on a cache file from a pool
+
+    With the `'lazy'` cache verification, the cache files are served before being checked, the
+    checks are performed in the background:
+    - by low priority jobs if there is an `io_pool`,
+    - one at a time when the scheduler is idle otherwise.
+    """
 
     def __init__(self, raster):
         self._raster = raster
@@ -24,16 +28,12 @@ class ActorFileChecker:
         self._alive = True
         io_pool = raster.io_pool
         if io_pool is not None:
-            if isinstance(io_pool, mp.pool.ThreadPool):
-                self._same_address_space = True
-            elif isinstance(io_pool, mp.pool.Pool):
-                self._same_address_space = False
-            else: # pragma: no cover
-                assert False, 'Type should be checked in facade'
+            self._same_address_space = shares_address_space(io_pool)
             self._waiting_room_address = f'/Pool{id(io_pool)}/WaitingRoom'
             self._working_room_address = f'/Pool{id(io_pool)}/WorkingRoom'
         self._waiting_jobs = set()
         self._working_jobs = set()
+        self._lazy_checks = collections.deque() # type: Deque[Tuple[Footprint, str]]
         self.address = f'/Raster{self._raster.uid}/FileChecker'
 
     @property
@@ -45,7 +45,7 @@ class ActorFileChecker:
         msgs = []
 
         if self._raster.io_pool is None:
-            work = Work(self, cache_fp, path)
+            work = Work(self, cache_fp, path, self._raster.cache_verification)
             status = work.func()
             msgs += [Msg(
                 'CacheSupervisor', 'inferred_cache_file_status', cache_fp, path, status
@@ -57,9 +57,25 @@ class ActorFileChecker:
 
         return msgs
 
+    def receive_verify_cache_file_later(self, cache_fp, path):
+        """Receive message: This cache file is already being served, check it in the background"""
+        msgs = []
+
+        if self._raster.io_pool is None:
+            self._lazy_checks.append((cache_fp, path))
+        else:
+            wait = LazyWait(self, cache_fp, path)
+            self._waiting_jobs.add(wait)
+            msgs += [Msg(self._waiting_room_address, 'schedule_job', wait)]
+
+        return msgs
+
     def receive_token_to_working_room(self, job, token):
         self._waiting_jobs.remove(job)
-        work = Work(self, job.cache_fp, job.path)
+        if isinstance(job, LazyWait):
+            work = Work(self, job.cache_fp, job.path, 'lazy')
+        else:
+            work = Work(self, job.cache_fp, job.path, self._raster.cache_verification)
         self._working_jobs.add(work)
         return [
             Msg(self._working_room_address, 'launch_job_with_token', work, token)
@@ -67,10 +83,28 @@ class ActorFileChecker:
 
     def receive_job_done(self, job, status):
         self._working_jobs.remove(job)
+        if job.verification == 'lazy':
+            return [
+                Msg('CacheSupervisor', 'verified_cache_file', job.cache_fp, job.path, status)
+            ]
         return [
             Msg('CacheSupervisor', 'inferred_cache_file_status', job.cache_fp, job.path, status)
         ]
 
+    def ext_receive_nothing(self):
+        """Receive message sent by something else than an actor, still treated synchronously: What's
+        up?
+        The scheduler has nothing else to do, it is the right time to perform a background check.
+        """
+        if not self._lazy_checks:
+            return []
+        cache_fp, path = self._lazy_checks.popleft()
+        work = Work(self, cache_fp, path, 'lazy')
+        status = work.func()
+        return [
+            Msg('CacheSupervisor', 'verified_cache_file', cache_fp, path, status)
+        ]
+
     def receive_die(self):
         assert self._alive
         self._alive = False
@@ -81,6 +115,7 @@ class ActorFileChecker:
             msgs += [Msg(self._working_room_address, 'cancel_job', job)]
         self._waiting_jobs.clear()
         self._working_jobs.clear()
+        self._lazy_checks.clear()
         self._raster = None
         self._back_ds = None
         return msgs
@@ -91,99 +126,128 @@ class Wait(MaxPrioJobWaiting):
     def __init__(self, actor, cache_fp, path):
         self.cache_fp = cache_fp
         self.path = path
-        super().__init__(actor.address)
+        super().__init__(
+            actor.address, array_nbytes(cache_fp, len(actor._raster), actor._raster.dtype),
+        )
 
-class Work(PoolJobWorking):
+class LazyWait(MinPrioJobWaiting):
     def __init__(self, actor, cache_fp, path):
         self.cache_fp = cache_fp
         self.path = path
+        # The checksum is computed on a stream, there is no big allocation
+        super().__init__(actor.address, 0)
+
+class Work(PoolJobWorking):
+    def __init__(self, actor, cache_fp, path, verification):
+        self.cache_fp = cache_fp
+        self.path = path
+        self.verification = verification
+        expected_stat = actor._raster.cache_manifest.stat_of_path(path)
         if actor._raster.io_pool is None or actor._same_address_space:
             func = functools.partial(
                 _cache_file_check,
-                cache_fp, path, len(actor._raster), actor._raster.dtype,
-                actor._back_ds
+                actor._raster.cache_format, cache_fp, path, len(actor._raster), actor._raster.dtype,
+                verification, expected_stat, actor._back_ds
             )
         else:
             func = functools.partial(
                 _cache_file_check,
-                cache_fp, path, len(actor._raster), actor._raster.dtype,
-                None,
+                actor._raster.cache_format, cache_fp, path, len(actor._raster), actor._raster.dtype,
+                verification, expected_stat, None,
             )
         actor._raster.debug_mngr.event('object_allocated', func)
         super().__init__(actor.address, func)
 
-def _checksum(fname, buffer_size=512 * 1024, dtype='uint64'):
-    # https://github.com/earthcube-lab/buzzard/pull/39/#discussion_r239071556
-    dtype = np.dtype(dtype)
-    dtypesize = dtype.itemsize
-    assert buffer_size % dtypesize == 0
-    assert np.issubdtype(dtype, np.unsignedinteger)
-
-    acc = dtype.type(0)
-    with open(fname, "rb") as f:
-        with np.warnings.catch_warnings():
-            np.warnings.filterwarnings('ignore', r'overflow encountered')
-
-            for chunk in iter(lambda: f.read(buffer_size), b""):
-                head = np.frombuffer(chunk, dtype, count=len(chunk) // dtypesize)
-                head = np.add.reduce(head, dtype=dtype, initial=acc)
-                acc += head
-
-                tailsize = len(chunk) % dtypesize
-                if tailsize > 0:
-                    # This should only be needed for file's tail
-                    tail = chunk[-tailsize:] + b'\0' * (dtypesize - tailsize)
-                    tail = np.frombuffer(tail, dtype)
-                    acc += tail
-        return f'{acc.item():016x}'
-
-def _cache_file_check(cache_fp, path, channel_count, dtype, back_ds_opt):
-    checksum = path
-    checksum = checksum.split('.')[-2]
-    checksum = checksum.split('_')[-1]
-    new_checksum = _checksum(path)
-    if new_checksum != checksum:
-        if back_ds_opt is not None:
-            back_ds_opt.deactivate(path)
-        LOGGER.warning('Removing {} because invalid checksum ({} instead of {})'.format(
-            path, new_checksum, checksum,
-        ))
-        os.remove(path)
+def _cache_file_check(cache_format, cache_fp, path, channel_count, dtype, verification,
+                      expected_stat_opt, back_ds_opt):
+    """Check a cache file
+
+    Parameters
+    ----------
+    cache_format: ACacheFormat
+    cache_fp: Footprint
+    path: str
+    channel_count: int
+    dtype: np.dtype
+    verification: str
+        - 'full': Check the checksum and the header of the file, remove it if corrupted
+        - 'metadata': Check the size and the header of the file, remove it if corrupted. The
+          checksum is also checked if the file was modified since it was written.
+        - 'lazy': Check the checksum and the header of the file, the file is not removed if
+          corrupted since it might be in use. The `CacheSupervisor` takes care of it.
+    expected_stat_opt: None or (int, int)
+        Size and modification time of the file recorded in the cache manifest
+    back_ds_opt: None or BackDataset
+
+    Returns
+    -------
+    None or bool
+        False if the file is corrupted or missing, None if its checksum can't be computed in this
+        environment (the file is left untouched)
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        LOGGER.warning('{} is listed in the cache manifest but does not exist'.format(path))
         return False
 
-    allocator = lambda: BackGDALFileRaster.open_file(path, 'GTiff', [], 'r') # This may raise
-    with contextlib.ExitStack() as stack:
+    if is_fill_marker(path):
+        # This file is never opened, only its name matters
         try:
-            if back_ds_opt is None:
-                gdal_ds = allocator()
-            else:
-                gdal_ds = stack.enter_context(back_ds_opt.acquire_driver_object(path, allocator))
-
-            file_fp = Footprint(
-                gt=gdal_ds.GetGeoTransform(),
-                rsize=(gdal_ds.RasterXSize, gdal_ds.RasterYSize),
-            )
-            file_dtype = conv.dtype_of_gdt_downcast(gdal_ds.GetRasterBand(1).DataType)
-            file_len = gdal_ds.RasterCount
-            if file_fp != cache_fp: # pragma: no cover
-                raise RuntimeError('invalid Footprint of {}({} instead of {})'.format(
-                    path, file_fp, cache_fp
+            if stat.st_size != 0:
+                raise ValueError('{} should be empty'.format(path))
+            value_of_fill_marker(path, dtype)
+        except ValueError:
+            if verification != 'lazy':
+                LOGGER.warning('Removing {} because invalid'.format(path))
+                os.remove(path)
+            return False
+        return True
+
+    check_checksum = True
+    if verification == 'metadata':
+        if stat.st_size == 0 or (expected_stat_opt is not None and
+                                 stat.st_size != expected_stat_opt[0]):
+            if back_ds_opt is not None:
+                back_ds_opt.deactivate(path)
+            LOGGER.warning('Removing {} because invalid size ({})'.format(path, stat.st_size))
+            os.remove(path)
+            return False
+        # If the file was modified since it was written, fall back to the checksum
+        check_checksum = (
+            expected_stat_opt is None or stat.st_mtime_ns != expected_stat_opt[1]
+        )
+
+    if check_checksum:
+        checksum = checksum_of_path(path)
+        new_checksum = checksum_of_file(path, len(checksum))
+        if new_checksum is None:
+            # This file can't be verified in this environment, it might be valid and used by
+            # another environment. It is treated as a cache miss and never removed.
+            return None
+        if new_checksum != checksum:
+            if verification == 'lazy':
+                LOGGER.warning('{} has an invalid checksum ({} instead of {})'.format(
+                    path, new_checksum, checksum,
                 ))
-            if file_dtype != dtype: # pragma: no cover
-                raise RuntimeError('invalid dtype of {}({} instead of {})'.format(
-                    path, file_dtype, dtype
-                ))
-            if file_len != channel_count: # pragma: no cover
-                raise RuntimeError('invalid channel_count of {}({} instead of {})'.format(
-                    path, file_len, channel_count
-                ))
-            del gdal_ds
-        except Exception:
-            # Those exceptions should not trigger a cache file removal, because it might originate
-            # from a mistake in the code that does not mean that those files are corrupted. For exemple:
-            # - Maximum number of file descriptors reach
-            # - Mismatch in cache directories path
+                return False
+            if back_ds_opt is not None:
+                back_ds_opt.deactivate(path)
+            LOGGER.warning('Removing {} because invalid checksum ({} instead of {})'.format(
+                path, new_checksum, checksum,
+            ))
+            os.remove(path)
+            return False
+
+    try:
+        cache_format.check(path, cache_fp, channel_count, dtype, back_ds_opt)
+    except Exception:
+        # Those exceptions should not trigger a cache file removal, because it might originate
+        # from a mistake in the code that does not mean that those files are corrupted. For exemple:
+        # - Maximum number of file descriptors reach
+        # - Mismatch in cache directories path
+        if back_ds_opt is not None:
             back_ds_opt.deactivate(path)
-            raise
+        raise
 
     return True
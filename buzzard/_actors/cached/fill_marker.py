@@ -0,0 +1,67 @@
+"""Cache files of the uniform cache tiles
+
+A cache tile whose pixels all have the same value (e.g. a tile entirely nodata) is not written in
+the format of the cache files, it is recorded as an empty file whose name holds the value in place
+of the checksum: `<prefix>_<hex of the value's bytes>.fill`. Those files are never opened, the
+tiles are synthesized when read.
+
+The value is stored with the byte order of the machine that wrote it.
+"""
+
+import os
+
+import numpy as np
+
+SUFFIX = '.fill'
+
+def uniform_value(array):
+    """Get the value of all the pixels of `array`, or None if it is not uniform"""
+    if array.size == 0: # pragma: no cover
+        return None
+    value = array.flat[0]
+    if np.issubdtype(array.dtype, np.inexact) and np.isnan(value):
+        is_value = np.isnan
+    else:
+        is_value = lambda arr: arr == value
+
+    # Reject the common cases before comparing the whole array
+    if not is_value(array.flat[-1]) or not is_value(array[0]).all():
+        return None
+    if not is_value(array).all():
+        return None
+    return value
+
+def is_fill_marker(path):
+    return path.endswith(SUFFIX)
+
+def value_of_fill_marker(path, dtype):
+    """Decode the value of the tile of a fill marker, raises a ValueError if the name of the file
+    is invalid for `dtype`
+    """
+    fname = os.path.basename(path)[:-len(SUFFIX)]
+    value_hex = fname.split('_')[-1]
+    dtype = np.dtype(dtype)
+    if len(value_hex) != dtype.itemsize * 2:
+        raise ValueError('{} does not contain a value of type {}'.format(path, dtype))
+    return np.frombuffer(bytes.fromhex(value_hex), dtype)[0]
+
+def tile_of_fill_marker(path, cache_fp, channel_count, dtype):
+    """Synthesize the read-only cache tile of a fill marker, it does not allocate the pixels"""
+    value = np.asarray(value_of_fill_marker(path, dtype), dtype)
+    return np.broadcast_to(value, (*cache_fp.shape, channel_count))
+
+def write_fill_marker(dir_path, filename_prefix, value, dtype):
+    """Create the fill marker of a uniform cache tile
+
+    Returns
+    -------
+    (str, int, int)
+        Path, size and modification time of the written file, to be recorded in the cache
+        manifest
+    """
+    value_hex = np.asarray(value, dtype).tobytes().hex()
+    path = os.path.join(dir_path, filename_prefix + '_' + value_hex + SUFFIX)
+    with open(path, 'wb'):
+        pass
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime_ns
@@ -1,11 +1,11 @@
 import functools
-import multiprocessing as mp
-import multiprocessing.pool
 
 import numpy as np
 
 from buzzard._actors.message import Msg
-from buzzard._actors.pool_job import CacheJobWaiting, PoolJobWorking
+from buzzard._actors.pool_job import CacheJobWaiting, PoolJobWorking, array_nbytes
+from buzzard._actors.shared_array import JobSegments, share_result
+from buzzard._dataset_pools_container import shares_address_space
 
 class ActorMerger:
     """Actor that takes care of merging several arrays into one fp"""
@@ -17,12 +17,7 @@ class ActorMerger:
         if merge_pool is not None:
             self._waiting_room_address = f'/Pool{id(merge_pool)}/WaitingRoom'
             self._working_room_address = f'/Pool{id(merge_pool)}/WorkingRoom'
-            if isinstance(merge_pool, mp.pool.ThreadPool):
-                self._same_address_space = True
-            elif isinstance(merge_pool, mp.pool.Pool):
-                self._same_address_space = False
-            else: # pragma: no cover
-                assert False, 'Type should be checked in facade'
+            self._same_address_space = shares_address_space(merge_pool)
         self._waiting_jobs = set()
         self._working_jobs = set()
 
@@ -122,13 +117,17 @@ class Wait(CacheJobWaiting):
     def __init__(self, actor, cache_fp, array_per_fp):
         self.cache_fp = cache_fp
         self.array_per_fp = array_per_fp
-        super().__init__(actor.address, actor._raster.uid, self.cache_fp, 3, self.cache_fp)
+        super().__init__(
+            actor.address, actor._raster.uid, self.cache_fp, 3, self.cache_fp,
+            array_nbytes(cache_fp, len(actor._raster), actor._raster.dtype),
+        )
 
 class Work(PoolJobWorking):
     def __init__(self, actor, cache_fp, array_per_fp):
         self.cache_fp = cache_fp
 
         if actor._raster.merge_pool is None or actor._same_address_space:
+            segments = None
             func = functools.partial(
                 actor._raster.merge_arrays,
                 cache_fp,
@@ -136,12 +135,15 @@ class Work(PoolJobWorking):
                 actor._raster.facade_proxy,
             )
         else:
+            segments = JobSegments()
             func = functools.partial(
+                share_result,
                 actor._raster.merge_arrays,
                 cache_fp,
-                array_per_fp,
-                None
+                {fp: segments.share_array(arr) for fp, arr in array_per_fp.items()},
+                None,
+                result_name=segments.result_name,
             )
         actor._raster.debug_mngr.event('object_allocated', func)
 
-        super().__init__(actor.address, func)
+        super().__init__(actor.address, func, segments)
@@ -1,12 +1,16 @@
 import logging
 
 from buzzard._actors.message import Msg, DroppableMsg, AgingMsg
-from buzzard._actors.cached.query_infos import CachedQueryInfos
+from buzzard._actors.cached.query_infos import CachedQueryInfos, WarmQueryInfos
 
 LOGGER = logging.getLogger(__name__)
 
 class ActorQueriesHandler:
-    """Actor that takes care of a raster's queries lifetime"""
+    """Actor that takes care of a raster's queries lifetime
+
+    It also takes care of the warm-ups of the cache, the queries that produce nothing and only
+    wait for their cache files to be available.
+    """
 
     def __init__(self, raster):
         """
@@ -16,6 +20,8 @@ class ActorQueriesHandler:
         """
         self._raster = raster
         self._queries = {}
+        self._warm_queries = {}
+        self._failure = None
         self._alive = True
         self.address = f'/Raster{self._raster.uid}/QueriesHandler'
 
@@ -25,8 +31,8 @@ class ActorQueriesHandler:
 
     # ******************************************************************************************* **
     def ext_receive_new_query(self, queue_wref, max_queue_size, produce_fps,
-                              channel_ids, is_flat, dst_nodata, interpolation, parent_uid,
-                              key_in_parent):
+                              channel_ids, is_flat, dst_nodata, interpolation, ordered,
+                              parent_uid, key_in_parent):
         """Receive message sent by something else than an actor, still treated synchronously: There
         is a new query.
 
@@ -47,6 +53,8 @@ class ActorQueriesHandler:
            Parameter of the underlying `(get|iter|queue)_data`
         interpolation: str
            Parameter of the underlying `(get|iter|queue)_data`
+        ordered: bool
+           Parameter of the underlying `(iter|queue)_data`
         parent_uid: None or uuid.UUID4
            uuid of parent raster
            if None: This query comes directly from the user
@@ -58,13 +66,20 @@ class ActorQueriesHandler:
         """
         msgs = []
 
+        if self._failure is not None:
+            queue = queue_wref()
+            if queue is not None:
+                queue.fail(self._failure)
+            return msgs
+
         qi = CachedQueryInfos(
             self._raster, produce_fps,
             channel_ids, is_flat, dst_nodata, interpolation,
-            max_queue_size,
+            max_queue_size, ordered,
             parent_uid, key_in_parent,
         )
         self._raster.debug_mngr.event('object_allocated', qi)
+        self._raster.debug_mngr.event('query_started', self._raster.facade_proxy, qi)
 
         q = _Query(queue_wref)
         self._queries[qi] = q
@@ -76,6 +91,48 @@ class ActorQueriesHandler:
 
         return msgs
 
+    def ext_receive_new_warm_query(self, cache_fps, priority, max_queue_size, progress):
+        """Receive message sent by something else than an actor, still treated synchronously: There
+        is a new warm-up of the cache.
+
+        Parameters
+        ----------
+        cache_fps: sequence of Footprint
+           The cache tiles to make available, ordered by priority
+        priority: int
+           Parameter of the underlying `warm`
+        max_queue_size: int
+           Parameter of the underlying `warm`
+        progress: _actors.cached.warm_up.WarmUpProgress
+           Object returned by the underlying `warm`
+        """
+        if self._failure is not None:
+            progress._fail(self._failure)
+            return []
+
+        qi = WarmQueryInfos(self._raster, cache_fps, priority, max_queue_size, progress)
+        self._raster.debug_mngr.event('object_allocated', qi)
+        self._raster.debug_mngr.event('query_started', self._raster.facade_proxy, qi)
+
+        self._warm_queries[qi] = _WarmQuery(qi.list_of_cache_fp)
+        return [
+            Msg('CacheSupervisor', 'make_those_cache_files_available', qi),
+        ]
+
+    def ext_receive_cancel_warm_query(self, progress):
+        """Receive message sent by something else than an actor, still treated synchronously: The
+        user cancelled a warm-up of the cache.
+
+        Parameters
+        ----------
+        progress: _actors.cached.warm_up.WarmUpProgress
+        """
+        for qi in self._warm_queries.keys():
+            if qi.progress is progress:
+                return self._cancel_warm_query(qi)
+        # The warm-up finished in the meantime
+        return []
+
     def ext_receive_nothing(self):
         """Receive message sent by something else than an actor, still treated synchronously: What's
         up?
@@ -111,7 +168,7 @@ class ActorQueriesHandler:
 
     def receive_made_this_array(self, qi, prod_idx, array):
         """Receive message: This array is ready to be sent to the output queue. Just do it in the
-        right order.
+        right order (or straight away if the query is not `ordered`).
 
         Parameters
         ----------
@@ -122,7 +179,7 @@ class ActorQueriesHandler:
         msgs = []
         q = self._queries[qi]
         assert prod_idx not in q.produce_arrays_dict, 'This array was already computed'
-        assert prod_idx >= q.produced_count, 'This array was already sent'
+        assert not qi.ordered or prod_idx >= q.produced_count, 'This array was already sent'
         q.produce_arrays_dict[prod_idx] = array
 
         # Send arrays ready ****************************************************
@@ -137,7 +194,11 @@ class ActorQueriesHandler:
 
             # Put arrays in queue in the right order
             while True:
-                if prod_idx not in q.produce_arrays_dict:
+                if not qi.ordered:
+                    if not q.produce_arrays_dict:
+                        break
+                    prod_idx = next(iter(q.produce_arrays_dict))
+                elif prod_idx not in q.produce_arrays_dict:
                     # Next array is not ready yet
                     break
                 array = q.produce_arrays_dict.pop(prod_idx)
@@ -145,10 +206,14 @@ class ActorQueriesHandler:
                 y, x, c = array.shape
                 if qi.is_flat and c == 1:
                     array = array.reshape(y, x)
+                if not qi.ordered:
+                    array = (prod_idx, qi.prod[prod_idx].fp, array)
 
                 # The way this is all designed, the system does not start to work on a `prod_idx` if
                 # it cannot be inserted in the output queue. It means that the `queue.Full`
                 # exception cannot be raised by the following `put_nowait`.
+                # In an unordered query the same holds: the gates allow at most `max_queue_size`
+                # arrays to be started but not yet pulled.
                 queue.put_nowait(array)
 
                 q.queue_size += 1
@@ -177,10 +242,80 @@ class ActorQueriesHandler:
 
             if q.produced_count == qi.produce_count:
                 del self._queries[qi]
+                self._raster.debug_mngr.event('query_stopped', self._raster.facade_proxy, qi, 'done')
+                if len(qi.list_of_cache_fp) > 0:
+                    msgs += [Msg('CacheSupervisor', 'query_done', qi)]
         del queue
 
         return msgs
 
+    def receive_warmed_those_cache_files(self, cache_fps):
+        """Receive message: Those cache tiles, needed by at least one warm-up, are now available
+
+        Parameters
+        ----------
+        cache_fps: sequence of Footprint
+        """
+        msgs = []
+
+        finished_queries = []
+        for qi, q in self._warm_queries.items():
+            remaining_count = len(q.cache_fps_remaining)
+            q.cache_fps_remaining.difference_update(cache_fps)
+            if len(q.cache_fps_remaining) == remaining_count:
+                continue
+            done_count = qi.produce_count - len(q.cache_fps_remaining)
+            qi.progress._update(done_count)
+
+            # A warm-up behaves as a query whose arrays are pulled as soon as produced
+            msgs += [
+                AgingMsg('/Global/GlobalPrioritiesWatcher', 'output_queue_update',
+                         (self._raster.uid, qi), (done_count, 0)),
+                AgingMsg('ComputationGate1', 'output_queue_update',
+                         (qi,), (done_count, 0)),
+            ]
+            if done_count == qi.produce_count:
+                finished_queries.append(qi)
+
+        for qi in finished_queries:
+            del self._warm_queries[qi]
+            self._raster.debug_mngr.event('query_stopped', self._raster.facade_proxy, qi, 'done')
+            msgs += [Msg('CacheSupervisor', 'query_done', qi)]
+
+        return msgs
+
+    def receive_pool_failed(self, exn):
+        """Receive message: A pool used by this raster, or by a raster it depends on, failed. The
+        ongoing and future queries can't be completed, fail them all.
+
+        Parameters
+        ----------
+        exn: Exception
+        """
+        msgs = []
+        if self._failure is not None:
+            return msgs
+        LOGGER.error('Failing the queries of a raster: {}'.format(exn))
+        self._failure = exn
+
+        for qi, q in list(self._queries.items()):
+            queue = q.queue_wref()
+            if queue is not None:
+                queue.fail(exn)
+            del queue
+            if qi.key_in_parent is not None:
+                # The parent raster is waiting for this query
+                msgs += [DroppableMsg(
+                    f'/Raster{qi.parent_uid}/QueriesHandler', 'pool_failed', exn,
+                )]
+            msgs += self._cancel_query(qi)
+
+        for qi in list(self._warm_queries.keys()):
+            msgs += self._cancel_warm_query(qi)
+            qi.progress._fail(exn)
+
+        return msgs
+
     def receive_die(self):
         """Receive message: The raster was killed"""
         assert self._alive
@@ -189,6 +324,8 @@ class ActorQueriesHandler:
         msgs = []
         for qi in list(self._queries.keys()):
             msgs += self._cancel_query(qi)
+        for qi in list(self._warm_queries.keys()):
+            msgs += self._cancel_warm_query(qi)
 
         self._queries.clear()
         self._raster = None
@@ -202,6 +339,7 @@ class ActorQueriesHandler:
             q.produced_count,
             qi.produce_count,
         ))
+        self._raster.debug_mngr.event('query_stopped', self._raster.facade_proxy, qi, 'cancelled')
         return [
             Msg('/Global/GlobalPrioritiesWatcher', 'cancel_this_query', self._raster.uid, qi),
 
@@ -217,6 +355,23 @@ class ActorQueriesHandler:
             Msg('Computer', 'cancel_this_query', qi),
         ]
 
+    def _cancel_warm_query(self, qi):
+        q = self._warm_queries.pop(qi)
+        LOGGER.info('Dropping a warm-up with {}/{} cache tiles available.'.format(
+            qi.produce_count - len(q.cache_fps_remaining),
+            qi.produce_count,
+        ))
+        self._raster.debug_mngr.event('query_stopped', self._raster.facade_proxy, qi, 'cancelled')
+        qi.progress._cancel()
+        return [
+            Msg('/Global/GlobalPrioritiesWatcher', 'cancel_this_query', self._raster.uid, qi),
+
+            Msg('CacheSupervisor', 'cancel_this_query', qi),
+            Msg('ComputationGate1', 'cancel_this_query', qi),
+            Msg('ComputationGate2', 'cancel_this_query', qi),
+            Msg('Computer', 'cancel_this_query', qi),
+        ]
+
     # ******************************************************************************************* **
 
 class _Query:
@@ -225,3 +380,7 @@ class _Query:
         self.produce_arrays_dict = {}
         self.produced_count = 0
         self.queue_size = 0
+
+class _WarmQuery:
+    def __init__(self, cache_fps):
+        self.cache_fps_remaining = set(cache_fps)
@@ -71,7 +71,7 @@ class CachedQueryInfos:
 
     def __init__(self, raster, list_of_prod_fp,
                  channel_ids, is_flat, dst_nodata, interpolation,
-                 max_queue_size,
+                 max_queue_size, ordered,
                  parent_uid, key_in_parent):
         # Mutable attributes ******************************************************************** **
         # Attributes that relates a query to a single optional computation phase
@@ -81,6 +81,9 @@ class CachedQueryInfos:
         self.parent_uid = parent_uid
         self.key_in_parent = key_in_parent
 
+        # Offset of the priorities of the arrays of this query, 0 unless this is a warm-up
+        self.priority = 0 # type: int
+
         # The parameters given by user in invocation
         self.channel_ids = channel_ids # type: Sequence[int]
         self.is_flat = is_flat # type: bool
@@ -96,6 +99,10 @@ class CachedQueryInfos:
         # Output max queue size (Parameter given to queue.Queue)
         self.max_queue_size = max_queue_size # type: int
 
+        # If `False` the arrays are put in the output queue as soon as ready, along with their index
+        # and Footprint
+        self.ordered = ordered # type: bool
+
         # How many arrays are requested
         self.produce_count = len(list_of_prod_fp) # type: int
 
@@ -256,6 +263,37 @@ class CachedQueryInfos:
     def __eq__(self, other):
         return self is other
 
+class WarmQueryInfos(CachedQueryInfos):
+    """Object that stores many informations about a warm-up of the cache. A warm-up is a query
+    that produces nothing, it only makes the cache files of `list_of_cache_fp` available.
+
+    It is built as a query whose `production footprints` are the cache footprints themselves, so
+    that the priorities and the computation phase work as for any other query.
+    """
+
+    def __init__(self, raster, list_of_cache_fp, priority, max_queue_size, progress):
+        """
+        Parameters
+        ----------
+        raster: _a_recipe_raster.ABackRecipeRaster
+        list_of_cache_fp: sequence of CacheFootprint
+            The cache tiles to make available, ordered by priority
+        priority: int
+            Offset added to the priorities of the cache tiles
+        max_queue_size: int
+            How many cache tiles can be computed ahead of the ones already available
+        progress: _actors.cached.warm_up.WarmUpProgress
+            The object updated when cache tiles become available
+        """
+        super().__init__(
+            raster, list_of_cache_fp,
+            tuple(range(len(raster))), False, raster.nodata, 'cv_area',
+            max_queue_size, True,
+            None, None,
+        )
+        self.priority = priority # type: int
+        self.progress = progress # type: WarmUpProgress
+
 class CacheComputationInfos:
     """Object that store informations about a computation phase of a query.
     Instanciating this object also starts the primitives collection from the list of the cache
@@ -315,6 +353,7 @@ class CacheComputationInfos:
                 self.primitive_fps_per_primitive[name],
                 parent_uid=raster.uid,
                 key_in_parent=(qi, name),
+                ordered=True,
                 **raster.primitives_kwargs[name]
             )
             for name, prim_back in raster.primitives_back.items()
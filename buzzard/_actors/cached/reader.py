@@ -1,18 +1,21 @@
 import functools
 import collections
-import multiprocessing as mp
-import multiprocessing.pool
-import contextlib
 
 import numpy as np
 
 from buzzard._actors.message import Msg
-from buzzard._actors.pool_job import ProductionJobWaiting, PoolJobWorking
-from buzzard import _tools
-from buzzard._gdal_file_raster import BackGDALFileRaster
+from buzzard._actors.pool_job import ProductionJobWaiting, PoolJobWorking, array_nbytes
+from buzzard._actors.shared_array import JobSegments, share_result
+from buzzard._dataset_pools_container import shares_address_space
 
 class ActorReader:
-    """Actor that takes care of reading cache tiles"""
+    """Actor that takes care of reading cache tiles
+
+    When the Dataset has a tile cache, the whole cache tiles are read to be inserted in it (except
+    for the zero-copy formats, whose files are already shared through the OS page cache). The
+    tiles found in the tile cache are sampled by the `io_pool` if it shares the scheduler's address
+    space.
+    """
 
     def __init__(self, raster):
         self._raster = raster
@@ -22,12 +25,7 @@ class ActorReader:
         if io_pool is not None:
             self._waiting_room_address = f'/Pool{id(io_pool)}/WaitingRoom'
             self._working_room_address = f'/Pool{id(io_pool)}/WorkingRoom'
-            if isinstance(io_pool, mp.pool.ThreadPool):
-                self._same_address_space = True
-            elif isinstance(io_pool, mp.pool.Pool):
-                self._same_address_space = False
-            else: # pragma: no cover
-                assert False, 'Type should be checked in facade'
+            self._same_address_space = shares_address_space(io_pool)
         self._waiting_jobs = set()
         self._working_jobs = set()
 
@@ -46,13 +44,40 @@ class ActorReader:
     # ******************************************************************************************* **
     def receive_sample_cache_file_to_unique_array(self, qi, prod_idx, cache_fp, path):
         msgs = []
+        full_read = self._is_full_read(cache_fp)
 
         if self._raster.io_pool is None:
-            work = self._create_work_job(qi, prod_idx, cache_fp, path)
-            work.func()
-            msgs += self._commit_work_result(work, None)
+            work = self._create_work_job(qi, prod_idx, cache_fp, path, full_read)
+            res = work.func()
+            msgs += self._commit_work_result(work, res)
+        else:
+            wait = Wait(self, qi, prod_idx, cache_fp, path, full_read)
+            self._waiting_jobs.add(wait)
+            msgs += [Msg(self._waiting_room_address, 'schedule_job', wait)]
+
+        return msgs
+
+    def receive_sample_cached_tile_to_unique_array(self, qi, prod_idx, cache_fp, tile):
+        """Receive message: This cache tile was found in the Dataset's tile cache or synthesized
+        from a fill marker, sample it without reading its file.
+
+        Parameters
+        ----------
+        qi: _actors.cached.query_infos.CachedQueryInfos
+        prod_idx: int
+        cache_fp: Footprint
+        tile: np.ndarray
+            Read-only, the full cache tile with all the channels
+        """
+        msgs = []
+
+        if self._raster.io_pool is None or not self._same_address_space:
+            # Sending the tile to another process would require a copy on this thread anyway
+            work = self._create_work_job(qi, prod_idx, cache_fp, None, False, tile)
+            res = work.func()
+            msgs += self._commit_work_result(work, res)
         else:
-            wait = Wait(self, qi, prod_idx, cache_fp, path)
+            wait = Wait(self, qi, prod_idx, cache_fp, None, False, tile)
             self._waiting_jobs.add(wait)
             msgs += [Msg(self._waiting_room_address, 'schedule_job', wait)]
 
@@ -60,7 +85,9 @@ class ActorReader:
 
     def receive_token_to_working_room(self, job, token):
         self._waiting_jobs.remove(job)
-        work = self._create_work_job(job.qi, job.prod_idx, job.cache_fp, job.path)
+        work = self._create_work_job(
+            job.qi, job.prod_idx, job.cache_fp, job.path, job.full_read, job.tile,
+        )
         self._working_jobs.add(work)
         return [
             Msg(self._working_room_address, 'launch_job_with_token', work, token)
@@ -119,92 +146,181 @@ class ActorReader:
         return msgs
 
     # ******************************************************************************************* **
-    def _create_work_job(self, qi, prod_idx, cache_fp, path):
+    def _get_sample_array(self, qi, prod_idx, cache_fp):
         if prod_idx not in self._sample_array_per_prod_tile[qi]:
-            # Allocate sample array
-            # If no interpolation or nodata conversion is necessary, this is the array that will be
-            # returned in the output queue
             full_sample_fp = qi.prod[prod_idx].sample_fp
-            self._sample_array_per_prod_tile[qi][prod_idx] = np.empty(
-                np.r_[full_sample_fp.shape, len(qi.unique_channel_ids)],
-                self._raster.dtype,
-            )
-            self._raster.debug_mngr.event(
-                'object_allocated',
-                self._sample_array_per_prod_tile[qi][prod_idx]
-            )
+            if self._is_zero_copy(full_sample_fp, cache_fp):
+                # The sample array will be the one returned by the cache format, no allocation
+                self._sample_array_per_prod_tile[qi][prod_idx] = None
+            else:
+                # Allocate sample array
+                # If no interpolation or nodata conversion is necessary, this is the array that will
+                # be returned in the output queue
+                self._sample_array_per_prod_tile[qi][prod_idx] = np.empty(
+                    np.r_[full_sample_fp.shape, len(qi.unique_channel_ids)],
+                    self._raster.dtype,
+                )
+                self._raster.debug_mngr.event(
+                    'object_allocated',
+                    self._sample_array_per_prod_tile[qi][prod_idx]
+                )
             self._missing_cache_fps_per_prod_tile[qi][prod_idx] = set(qi.prod[prod_idx].cache_fps)
+        return self._sample_array_per_prod_tile[qi][prod_idx]
+
+    def _create_work_job(self, qi, prod_idx, cache_fp, path, full_read, tile=None):
+        dst_array = self._get_sample_array(qi, prod_idx, cache_fp)
+        return Work(self, qi, prod_idx, cache_fp, path, dst_array, full_read, tile)
+
+    def _is_full_read(self, cache_fp):
+        """Should the whole cache tile be read to be inserted in the Dataset's tile cache"""
+        return (
+            not self._raster.cache_format.zero_copy and
+            self._back_ds.tile_cache_accepts(
+                array_nbytes(cache_fp, len(self._raster), self._raster.dtype)
+            )
+        )
 
-        dst_array = self._sample_array_per_prod_tile[qi][prod_idx]
-        return Work(self, qi, prod_idx, cache_fp, path, dst_array)
+    def _is_zero_copy(self, full_sample_fp, cache_fp):
+        """Is the sample array of a production tile a view of a single cache file"""
+        return (
+            self._raster.cache_format.zero_copy and
+            full_sample_fp == cache_fp and
+            (self._raster.io_pool is None or self._same_address_space)
+        )
 
     def _commit_work_result(self, job, result):
-        if self._raster.io_pool is None or self._same_address_space:
+        if job.full_read:
+            if self._raster.async_dict_path_of_cache_fp.get(job.cache_fp) == job.path:
+                self._back_ds.tile_cache_put(self._raster.uid, job.cache_fp, result)
+            # else: This cache file was invalidated or evicted while being read, the tile is
+            # outdated and should not be served to the next queries
+            if not job.same_address_space:
+                # The tile was read in another process, it is sampled here
+                _sample_tile(
+                    result, job.cache_fp, job.qi.unique_channel_ids, job.sample_fp,
+                    job.dst_array_slice,
+                )
+        elif job.dst_array_slice is None:
+            self._sample_array_per_prod_tile[job.qi][job.prod_idx] = result
+        elif job.same_address_space:
             assert result is None
         else:
             job.dst_array_slice[:] = result
+        return self._commit_sample(job.qi, job.prod_idx, job.cache_fp)
 
-        dst_array = self._sample_array_per_prod_tile[job.qi][job.prod_idx]
-        self._missing_cache_fps_per_prod_tile[job.qi][job.prod_idx].remove(job.cache_fp)
+    def _commit_sample(self, qi, prod_idx, cache_fp):
+        dst_array = self._sample_array_per_prod_tile[qi][prod_idx]
+        self._missing_cache_fps_per_prod_tile[qi][prod_idx].remove(cache_fp)
 
         # Perform fine grain garbage collection
-        if len(self._missing_cache_fps_per_prod_tile[job.qi][job.prod_idx]) == 0:
+        if len(self._missing_cache_fps_per_prod_tile[qi][prod_idx]) == 0:
             # Done reading for that `(qi, prod_idx)`
-            del self._missing_cache_fps_per_prod_tile[job.qi][job.prod_idx]
-            del self._sample_array_per_prod_tile[job.qi][job.prod_idx]
+            del self._missing_cache_fps_per_prod_tile[qi][prod_idx]
+            del self._sample_array_per_prod_tile[qi][prod_idx]
 
-        if len(self._missing_cache_fps_per_prod_tile[job.qi]) == 0:
+        if len(self._missing_cache_fps_per_prod_tile[qi]) == 0:
             # Not reading for that `qi`
-            del self._missing_cache_fps_per_prod_tile[job.qi]
-            del self._sample_array_per_prod_tile[job.qi]
+            del self._missing_cache_fps_per_prod_tile[qi]
+            del self._sample_array_per_prod_tile[qi]
 
         return [
             Msg('CacheExtractor', 'sampled_a_cache_file_to_the_array',
-                job.qi, job.prod_idx, job.cache_fp, dst_array,
+                qi, prod_idx, cache_fp, dst_array,
             )
         ]
 
     # ******************************************************************************************* **
 
 class Wait(ProductionJobWaiting):
-    def __init__(self, actor, qi, prod_idx, cache_fp, path):
+    def __init__(self, actor, qi, prod_idx, cache_fp, path, full_read, tile=None):
         self.qi = qi
         self.prod_idx = prod_idx
         self.cache_fp = cache_fp
         self.sample_fp = cache_fp & qi.prod[prod_idx].sample_fp
         self.path = path
-        super().__init__(actor.address, qi, prod_idx, 1, self.sample_fp)
+        self.full_read = full_read
+        self.tile = tile
+        if full_read:
+            nbytes = array_nbytes(cache_fp, len(actor._raster), actor._raster.dtype)
+        else:
+            nbytes = array_nbytes(self.sample_fp, len(qi.unique_channel_ids), actor._raster.dtype)
+        super().__init__(
+            actor.address, qi, prod_idx, 1, self.sample_fp, nbytes,
+        )
 
 class Work(PoolJobWorking):
-    def __init__(self, actor, qi, prod_idx, cache_fp, path, dst_array):
+    def __init__(self, actor, qi, prod_idx, cache_fp, path, dst_array, full_read, tile):
         self.qi = qi
         self.prod_idx = prod_idx
         self.cache_fp = cache_fp
+        self.path = path
+        self.full_read = full_read
         raster = actor._raster
         full_sample_fp = qi.prod[prod_idx].sample_fp
         sample_fp = full_sample_fp & cache_fp
+        self.sample_fp = sample_fp
+
+        # Does `func` run in the scheduler's address space
+        self.same_address_space = (
+            tile is not None or actor._raster.io_pool is None or actor._same_address_space
+        )
+
+        if full_read:
+            # The whole cache tile is read to a new array to be put in the tile cache, it is
+            # sampled by the job (or by the actor if the job runs in another process)
+            assert dst_array is not None
+            channel_ids = tuple(range(len(raster)))
+            read_fp = cache_fp
+        else:
+            channel_ids = qi.unique_channel_ids
+            read_fp = sample_fp
 
-        dst_array_slice = dst_array[sample_fp.slice_in(full_sample_fp)]
+        if dst_array is None:
+            # Zero-copy read, the result of `_cache_file_read` becomes the sample array
+            dst_array_slice = None
+        else:
+            dst_array_slice = dst_array[sample_fp.slice_in(full_sample_fp)]
+        self.dst_array_slice = dst_array_slice
 
-        if actor._raster.io_pool is None or actor._same_address_space:
+        segments = None
+        if tile is not None:
+            # The tile comes from the Dataset's tile cache or from a fill marker
+            func = functools.partial(
+                _sample_tile,
+                tile, cache_fp, channel_ids, read_fp, dst_array_slice,
+            )
+        elif full_read and self.same_address_space:
+            func = functools.partial(
+                _cache_file_read_and_sample,
+                raster.cache_format,
+                path, cache_fp, raster.dtype, channel_ids, sample_fp, qi.unique_channel_ids,
+                dst_array_slice, actor._back_ds,
+            )
+        elif self.same_address_space:
             func = functools.partial(
                 _cache_file_read,
-                path, cache_fp, actor._raster.dtype, qi.unique_channel_ids, sample_fp, dst_array_slice,
+                raster.cache_format,
+                path, cache_fp, raster.dtype, channel_ids, read_fp, dst_array_slice,
                 actor._back_ds,
             )
         else:
-            self.dst_array_slice = dst_array_slice
+            segments = JobSegments()
             func = functools.partial(
+                share_result,
                 _cache_file_read,
-                path, cache_fp, actor._raster.dtype, qi.unique_channel_ids, sample_fp, None, None,
+                raster.cache_format,
+                path, cache_fp, raster.dtype, channel_ids, read_fp, None, None,
+                result_name=segments.result_name,
             )
         actor._raster.debug_mngr.event('object_allocated', func)
-        super().__init__(actor.address, func)
+        super().__init__(actor.address, func, segments)
 
-def _cache_file_read(path, cache_fp, dtype, channel_ids, sample_fp, dst_opt, back_ds_opt):
+def _cache_file_read(cache_format, path, cache_fp, dtype, channel_ids, sample_fp, dst_opt,
+                     back_ds_opt):
     """
     Parameters
     ----------
+    cache_format: ACacheFormat
     path: str
     cache_fp: Footprint
         Should be the Footprint of the cache file
@@ -215,57 +331,35 @@ def _cache_file_read(path, cache_fp, dtype, channel_ids, sample_fp, dst_opt, bac
         Rect of `cache_fp` to read
     dst_opt: None or np.ndarray
         optional destination for read
+    back_ds_opt: None or BackDataset
+        optional Dataset whose activation pool should be used to open the file
+
+    Returns
+    -------
+    None or np.ndarray
+        None if `dst_opt` was provided
     """
+    return cache_format.read(path, cache_fp, dtype, channel_ids, sample_fp, dst_opt, back_ds_opt)
 
-    allocator = lambda: BackGDALFileRaster.open_file(path, 'GTiff', [], 'r')
-    with contextlib.ExitStack() as stack:
-        if back_ds_opt is None:
-            gdal_ds = allocator()
-        else:
-            gdal_ds = stack.enter_context(back_ds_opt.acquire_driver_object(path, allocator))
-
-        # Check raster
-        if gdal_ds is None: # pragma: no cover
-            raise RuntimeError("Could not open {path}, what happend to it?".format(
-                path
-            ))
-        if (gdal_ds.RasterXSize, gdal_ds.RasterYSize) != tuple(cache_fp.rsize): # pragma: no cover
-            raise RuntimeError('{} was expected to have rsize {}, not {}'.format(
-                path,
-                tuple(cache_fp.rsize),
-                (gdal_ds.RasterXSize, gdal_ds.RasterYSize),
-            ))
-        stored_dtype = _tools.conv.dtype_of_gdt_downcast(gdal_ds.GetRasterBand(1).DataType)
-        if dtype != stored_dtype: # pragma: no cover
-            raise RuntimeError('{} was expected to have dtype {}, not {}'.format(
-                path,
-                dtype,
-                stored_dtype,
-            ))
-
-        # Allocate if ProcessPool
-        if dst_opt is None:
-            dst = np.empty(np.r_[sample_fp.shape, len(channel_ids)], dtype)
-            ret = dst
-        else:
-            dst = dst_opt
-            ret = None
-
-        # Perform read
-        rtlx, rtly = cache_fp.spatial_to_raster(sample_fp.tl)
-        for i, ci in enumerate(channel_ids):
-            b = gdal_ds.GetRasterBand(ci + 1)
-            a = b.ReadAsArray(
-                int(rtlx),
-                int(rtly),
-                int(sample_fp.rsizex),
-                int(sample_fp.rsizey),
-                buf_obj=dst[..., i],
-            )
-            del b
-            if a is None: # pragma: no cover
-                raise RuntimeError(f'Could not read channel_id {ci}')
-    del gdal_ds
+def _cache_file_read_and_sample(cache_format, path, cache_fp, dtype, channel_ids, sample_fp,
+                                sample_channel_ids, dst, back_ds_opt):
+    """Read the whole cache tile to a new array to be put in the Dataset's tile cache, and sample
+    it to `dst`
+
+    Returns
+    -------
+    np.ndarray
+        The whole cache tile
+    """
+    tile = cache_format.read(path, cache_fp, dtype, channel_ids, cache_fp, None, back_ds_opt)
+    _sample_tile(tile, cache_fp, sample_channel_ids, sample_fp, dst)
+    return tile
 
-    # Return
-    return ret
+def _sample_tile(tile, cache_fp, channel_ids, sample_fp, dst_opt):
+    """Sample the rectangle `sample_fp` of a whole cache tile to `dst_opt`, or to a new array that
+    is returned if `dst_opt` is None.
+    """
+    if dst_opt is None:
+        return np.take(tile[sample_fp.slice_in(cache_fp)], channel_ids, axis=2)
+    np.take(tile[sample_fp.slice_in(cache_fp)], channel_ids, axis=2, out=dst_opt)
+    return None
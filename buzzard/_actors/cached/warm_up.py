@@ -0,0 +1,117 @@
+"""Progress handle of the warm-ups of the cache of the cached raster recipes"""
+
+import threading
+import time
+
+from buzzard._actors.message import Msg
+from buzzard._a_async_raster import QUEUE_POLL_DISTANCE
+
+class WarmUpProgress:
+    """Progress of a warm-up of the cache of a cached raster recipe, returned by
+    `CachedRasterRecipe.warm`.
+
+    It is updated by the Dataset's scheduler as the cache tiles become available, its methods
+    can be called from any thread.
+    """
+
+    def __init__(self, raster, total):
+        """
+        Parameters
+        ----------
+        raster: _cached_raster_recipe.BackCachedRasterRecipe
+        total: int
+            Number of cache tiles to make available
+        """
+        self._back_ds = raster.back_ds
+        self._address = f'/Raster{raster.uid}/QueriesHandler'
+        self._cond = threading.Condition()
+        self._total = total
+        self._done_count = 0
+        self._status = 'ongoing'
+        self._failure = None
+
+    @property
+    def total(self):
+        """Number of cache tiles of the warm-up"""
+        return self._total
+
+    @property
+    def done_count(self):
+        """Number of cache tiles of the warm-up that are available in the cache directory"""
+        with self._cond:
+            return self._done_count
+
+    @property
+    def done(self):
+        """Are all the cache tiles of the warm-up available in the cache directory"""
+        with self._cond:
+            return self._status == 'done'
+
+    @property
+    def cancelled(self):
+        """Was the warm-up cancelled, by `cancel` or by the closing of the raster"""
+        with self._cond:
+            return self._status == 'cancelled'
+
+    def wait(self, timeout=None):
+        """Block until the warm-up is over. Reraises the exception of the Dataset's scheduler if
+        it crashed, or the failure of a pool used by the raster.
+
+        Parameters
+        ----------
+        timeout: None or float
+            Maximum number of seconds to wait, wait forever if None
+
+        Returns
+        -------
+        bool
+            Whether or not all the cache tiles are available
+        """
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._status == 'ongoing':
+                delay = QUEUE_POLL_DISTANCE
+                if timeout is not None:
+                    delay = min(delay, deadline - time.monotonic())
+                    if delay <= 0:
+                        break
+                if not self._cond.wait(delay):
+                    self._back_ds.ensure_scheduler_still_alive()
+            if self._status == 'failed':
+                raise self._failure
+            return self._status == 'done'
+
+    def cancel(self):
+        """Stop the warm-up, the cache tiles being computed are still written. Returns right
+        away.
+        """
+        with self._cond:
+            if self._status != 'ongoing':
+                return
+        self._back_ds.put_message(Msg(self._address, 'cancel_warm_query', self))
+
+    def __repr__(self):
+        with self._cond:
+            return '<{} {}/{} {}>'.format(
+                type(self).__name__, self._done_count, self._total, self._status,
+            )
+
+    # Called from the scheduler ***************************************************************** **
+    def _update(self, done_count):
+        with self._cond:
+            self._done_count = done_count
+            if done_count == self._total:
+                self._status = 'done'
+            self._cond.notify_all()
+
+    def _cancel(self):
+        with self._cond:
+            self._status = 'cancelled'
+            self._cond.notify_all()
+
+    def _fail(self, exn):
+        with self._cond:
+            self._status = 'failed'
+            self._failure = exn
+            self._cond.notify_all()
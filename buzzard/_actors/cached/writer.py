@@ -2,15 +2,18 @@ import os
 import uuid
 import functools
 
-import numpy as np
-
 from buzzard._actors.message import Msg
-from buzzard._actors.pool_job import CacheJobWaiting, PoolJobWorking
-
-create_raster = None # lazy import
+from buzzard._actors.pool_job import CacheJobWaiting, PoolJobWorking, array_nbytes
+from buzzard._actors.shared_array import JobSegments
+from buzzard._actors.cached.fill_marker import uniform_value, write_fill_marker
+from buzzard._dataset_pools_container import shares_address_space
 
 class ActorWriter:
-    """Actor that takes care of writing to disk a cache tile that has been computed and merged."""
+    """Actor that takes care of writing to disk a cache tile that has been computed and merged.
+
+    The uniform cache tiles (e.g. entirely nodata) are recorded as empty fill markers instead, by
+    the same job.
+    """
 
     def __init__(self, raster):
         self._raster = raster
@@ -19,6 +22,7 @@ class ActorWriter:
         if io_pool is not None:
             self._waiting_room_address = f'/Pool{id(io_pool)}/WaitingRoom'
             self._working_room_address = f'/Pool{id(io_pool)}/WorkingRoom'
+            self._same_address_space = shares_address_space(io_pool)
         self._waiting_jobs = set()
         self._working_jobs = set()
         self.address = f'/Raster{self._raster.uid}/Writer'
@@ -41,8 +45,7 @@ class ActorWriter:
         if self._raster.io_pool is None:
             # No `io_pool` provided by user, perform write operation right now on this thread.
             work = Work(self, cache_fp, array)
-            path = work.func()
-            msgs += [Msg('CacheSupervisor', 'cache_file_written', cache_fp, path)]
+            msgs += self._commit_work_result(cache_fp, work.func())
         else:
             # Enqueue job in the `Pool/WaitingRoom` actor
             wait = Wait(self, cache_fp, array)
@@ -71,11 +74,12 @@ class ActorWriter:
         Parameters
         ----------
         job: Work
-        result: str
-            Path to the written file
+        result: (str, int, int, None or np.ndarray)
+            Path, size and modification time of the written file, and copy of the tile to put
+            in the tile cache
         """
         self._working_jobs.remove(job)
-        return [Msg('CacheSupervisor', 'cache_file_written', job.cache_fp, result)]
+        return self._commit_work_result(job.cache_fp, result)
 
     def receive_die(self):
         """Receive message: The raster was killed (collect by gc or closed by user)"""
@@ -94,116 +98,116 @@ class ActorWriter:
         return msgs
 
     # ******************************************************************************************* **
+    def _commit_work_result(self, cache_fp, result):
+        path, size, mtime_ns, tile = result
+        self._raster.cache_manifest.add(path, size, mtime_ns)
+
+        # The next reads of this tile won't need to reach the file
+        if tile is not None:
+            self._raster.back_ds.tile_cache_put(self._raster.uid, cache_fp, tile)
+        return [Msg('CacheSupervisor', 'cache_file_written', cache_fp, path)]
+
+    # ******************************************************************************************* **
 
 class Wait(CacheJobWaiting):
     """Job to be fed to a PoolWaitingRoom actor"""
     def __init__(self, actor, cache_fp, array):
         self.cache_fp = cache_fp
         self.array = array
-        super().__init__(actor.address, actor._raster.uid, self.cache_fp, 2, self.cache_fp)
+        super().__init__(
+            actor.address, actor._raster.uid, self.cache_fp, 2, self.cache_fp, array.nbytes,
+        )
 
 class Work(PoolJobWorking):
     """Job to be fed to a PoolWorkingRoom actor"""
     def __init__(self, actor, cache_fp, array):
         self.cache_fp = cache_fp
+        self.array = array
+
+        if actor._raster.io_pool is None or actor._same_address_space:
+            # The job returns a copy of the tile to put in the tile cache
+            copy_tile = actor._raster.back_ds.tile_cache_accepts(array.nbytes)
+            segments = None
+        else:
+            # The copy would be pickled back to this process, the tile will enter the tile cache
+            # when first read
+            segments = JobSegments()
+            array = segments.share_array(array)
+            copy_tile = False
 
         func = functools.partial(
             _cache_file_write,
-            array,
+            array, copy_tile,
             actor._raster.cache_dir,
             actor._raster.fname_prefix_of_cache_fp(cache_fp),
-            '.tif',
+            actor._raster.cache_format,
             cache_fp,
             {'nodata': actor._raster.nodata},
             actor._raster.wkt_stored,
         )
         actor._raster.debug_mngr.event('object_allocated', func)
 
-        super().__init__(actor.address, func)
-
-def _checksum(fname, buffer_size=512 * 1024, dtype='uint64'):
-    # https://github.com/earthcube-lab/buzzard/pull/39/#discussion_r239071556
-    dtype = np.dtype(dtype)
-    dtypesize = dtype.itemsize
-    assert buffer_size % dtypesize == 0
-    assert np.issubdtype(dtype, np.unsignedinteger)
-
-    acc = dtype.type(0)
-    with open(fname, "rb") as f:
-        with np.warnings.catch_warnings():
-            np.warnings.filterwarnings('ignore', r'overflow encountered')
-
-            for chunk in iter(lambda: f.read(buffer_size), b""):
-                head = np.frombuffer(chunk, dtype, count=len(chunk) // dtypesize)
-                head = np.add.reduce(head, dtype=dtype, initial=acc)
-                acc += head
-
-                tailsize = len(chunk) % dtypesize
-                if tailsize > 0:
-                    # This should only be needed for file's tail
-                    tail = chunk[-tailsize:] + b'\0' * (dtypesize - tailsize)
-                    tail = np.frombuffer(tail, dtype)
-                    acc += tail
-        return f'{acc.item():016x}'
-
-def _cache_file_write(array,
-                      dir_path, filename_prefix, filename_suffix,
+        super().__init__(actor.address, func, segments)
+
+def _cache_file_write(array, copy_tile,
+                      dir_path, filename_prefix, cache_format,
                       cache_fp, channels_schema, sr):
-    """Write this ndarray to disk.
+    """Write this ndarray to disk, or its fill marker if it is uniform.
 
     It can't use the dataset's activation pool because the file must be closed after
     writing to:
     1. flush to disk
-    2. checksum
-    3. be renamed
+    2. be renamed
+
+    The checksum is computed by `cache_format` while writing, the file is not read back.
 
     Parameters
     ----------
     array: ndarray of shape (Y, X, C)
         What to write in the cache file
+    copy_tile: bool
+        Whether or not to return a copy of `array` to be put in the Dataset's tile cache. It
+        can't be `array` itself because it might be a view of an array owned by the user's
+        `compute_array` or `merge_arrays`.
     dir_path: str
         Directory where to create the file
     filename_prefix: str
         First third of the file name
-    filename_suffix: str
-        Last thirf of the file name
+    cache_format: ACacheFormat
+        Format of the file, also gives the last third of the file name
     cache_fp: Footprint of shape (Y, X)
         Footprint of the file
     channels_schema: dict
         Band schema given by user when creating the cached recipe
     sr: str or None
         Spatial reference given by user when creating the cached recipe
+
+    Returns
+    -------
+    (str, int, int, None or ndarray)
+        Path, size and modification time of the written file, to be recorded in the cache
+        manifest, and the copy of `array` if `copy_tile`
     """
-    # Step 0. Lazily import buzzard to avoid circular dependencies
-    global create_raster
-    if create_raster is None:
-        from buzzard import create_raster
+    value = uniform_value(array)
+    if value is not None:
+        # No need to write the pixels, an empty file is enough. The tiles of the fill markers are
+        # synthesized when read.
+        return write_fill_marker(dir_path, filename_prefix, value, array.dtype) + (None,)
 
     # Step 1. Create/close file with a temporary name
+    filename_suffix = cache_format.suffix
     src_path = os.path.join(
         dir_path, 'tmp_' + filename_prefix + str(uuid.uuid4()) + filename_suffix
     )
+    checksum = cache_format.write(src_path, array, cache_fp, channels_schema, sr)
 
-    # TODO: Allow the user to choose the type and options of cache files
-    # TODO: Use driver-object allocator
-    options = [
-        "TILED=YES",
-        "BLOCKXSIZE=256", "BLOCKYSIZE=256",
-        "SPARSE_OK=TRUE",
-    ]
-    assert array.ndim == 3
-    with create_raster(src_path, cache_fp, array.dtype, array.shape[-1], channels_schema,
-                       sr=sr, options=options).close as r:
-        r.set_data(array, channels=None)
-
-    # Step 2. checksum hash file
-    checksum = _checksum(src_path)
-
-    # Step 3. move file to its final location
+    # Step 2. move file to its final location
     dst_path = os.path.join(dir_path, filename_prefix + '_' + checksum + filename_suffix)
 
     # TODO: Undefined if it exists, but it will most likely work
     # TODO: chmod to remove write access?
     os.rename(src_path, dst_path)
 
-    return dst_path
+    stat = os.stat(dst_path)
+    tile = array.copy() if copy_tile else None
+    return dst_path, stat.st_size, stat.st_mtime_ns, tile
@@ -1,12 +1,12 @@
 import collections
-import multiprocessing as mp
-import multiprocessing.pool
 import functools
 
 import numpy as np
 
 from buzzard._actors.message import Msg
-from buzzard._actors.pool_job import ProductionJobWaiting, PoolJobWorking
+from buzzard._actors.pool_job import ProductionJobWaiting, PoolJobWorking, array_nbytes
+from buzzard._actors.shared_array import JobSegments, share_result
+from buzzard._dataset_pools_container import shares_address_space
 
 class ActorComputer:
     """Actor that takes care of sheduling computations by using user's `compute_array` function"""
@@ -18,12 +18,7 @@ class ActorComputer:
         if computation_pool is not None:
             self._waiting_room_address = f'/Pool{id(computation_pool)}/WaitingRoom'
             self._working_room_address = f'/Pool{id(computation_pool)}/WorkingRoom'
-            if isinstance(computation_pool, mp.pool.ThreadPool):
-                self._same_address_space = True
-            elif isinstance(computation_pool, mp.pool.Pool):
-                self._same_address_space = False
-            else: # pragma: no cover
-                assert False, 'Type should be checked in facade'
+            self._same_address_space = shares_address_space(computation_pool)
         self._waiting_jobs_per_query = collections.defaultdict(set)
         self._working_jobs = set()
 
@@ -156,7 +151,10 @@ class Wait(ProductionJobWaiting):
 
         compute_fp = qicc.list_of_compute_fp[compute_idx]
         prod_idx = qicc.dict_of_min_prod_idx_per_compute_fp[compute_fp]
-        super().__init__(actor.address, qi, prod_idx, 4, compute_fp)
+        super().__init__(
+            actor.address, qi, prod_idx, 4, compute_fp,
+            array_nbytes(compute_fp, len(actor._raster), actor._raster.dtype),
+        )
 
 class Work(PoolJobWorking):
     def __init__(self, actor, qi, compute_idx):
@@ -176,6 +174,7 @@ class Work(PoolJobWorking):
         qicc.collected_count += 1
 
         if actor._raster.computation_pool is None or actor._same_address_space:
+            segments = None
             func = functools.partial(
                 actor._raster.compute_array,
                 compute_fp,
@@ -184,13 +183,16 @@ class Work(PoolJobWorking):
                 actor._raster.facade_proxy
             )
         else:
+            segments = JobSegments()
             func = functools.partial(
+                share_result,
                 actor._raster.compute_array,
                 compute_fp,
                 primitive_footprints,
-                primitive_arrays,
+                {k: segments.share_array(v) for k, v in primitive_arrays.items()},
                 None,
+                result_name=segments.result_name,
             )
         actor._raster.debug_mngr.event('object_allocated', func)
 
-        super().__init__(actor.address, func)
+        super().__init__(actor.address, func, segments)
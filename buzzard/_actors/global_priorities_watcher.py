@@ -200,8 +200,8 @@ class ActorGlobalPrioritiesWatcher:
         else:
             query_pulled_count = ds1[qi]
 
-        # Priority on `produced arrays` needed soon
-        prio = prod_idx - query_pulled_count
+        # Priority on `produced arrays` needed soon, the warm-ups may be delayed
+        prio = prod_idx - query_pulled_count + qi.priority
         # TODO: What if prio is negative? Is it a problem?
         return (prio,)
 
@@ -47,7 +47,7 @@ class Msg:
                 s = f'[{types}]*{len(a)}'
                 t = '[{}]'.format(', '.join(map(_dump_param, a)))
                 return min([t, s], key=len)
-            elif type(a).__name__ == 'CachedQueryInfos':
+            elif type(a).__name__ in {'CachedQueryInfos', 'WarmQueryInfos'}:
                 return f'qi:{id(a):#x}'
             elif type(a).__name__ == 'Footprint':
                 return f'Footprint{hash(a) % ((sys.maxsize + 1) * 2):#18x}'
@@ -70,6 +70,10 @@ class DroppableMsg(Msg):
     pass
 
 class AgingMsg(Msg):
+    """Message that is skipped if, by the time it is popped, a message emitted after it was already
+    delivered to the same method of the same actor with the same `id_args`.
+    """
+
     def __init__(self, address, title, id_args, other_args):
         self.id_args = id_args
         super().__init__(address, title, *(list(id_args) + list(other_args)))
@@ -1,3 +1,5 @@
+import numpy as np
+
 # Waiting *************************************************************************************** **
 class PoolJobWaiting:
     """Base class of all waiting jobs.
@@ -5,38 +7,55 @@ class PoolJobWaiting:
     A waiting job has a priority, it waits for a token in a PoolWaitingRoom with other waiting jobs.
     This token allows a waiting job to become a working job, and go to the PoolWorkingRoom to
     get some computations done.
+
+    A waiting job also has an estimation of the number of bytes it will allocate when working, see
+    `array_nbytes`. It is used by the PoolWaitingRoom to respect the memory budgets.
     """
-    def __init__(self, sender_address):
+    def __init__(self, sender_address, nbytes):
         self.sender_address = sender_address
+        self.nbytes = nbytes
 
 class MaxPrioJobWaiting(PoolJobWaiting):
     pass
 
+class MinPrioJobWaiting(PoolJobWaiting):
+    pass
+
 class ProductionJobWaiting(PoolJobWaiting):
-    def __init__(self, sender_address, qi, prod_idx, action_priority, fp):
-        super().__init__(sender_address)
+    def __init__(self, sender_address, qi, prod_idx, action_priority, fp, nbytes):
+        super().__init__(sender_address, nbytes)
         self.fp = fp
         self.qi = qi
         self.prod_idx = prod_idx
         self.action_priority = action_priority
 
 class CacheJobWaiting(PoolJobWaiting):
-    def __init__(self, sender_address, raster_uid, cache_fp, action_priority, fp):
-        super().__init__(sender_address)
+    def __init__(self, sender_address, raster_uid, cache_fp, action_priority, fp, nbytes):
+        super().__init__(sender_address, nbytes)
         self.fp = fp
         self.raster_uid = raster_uid
         self.cache_fp = cache_fp
         self.action_priority = action_priority
 
+def array_nbytes(fp, channel_count, dtype):
+    """Estimate the number of bytes of an array of `channel_count` channels of type `dtype` on
+    the Footprint `fp`.
+    """
+    return int(fp.rarea) * channel_count * np.dtype(dtype).itemsize
+
 # Working *************************************************************************************** **
 class PoolJobWorking:
     """Base class of all working jobs.
 
     A working job paired with a token from a PoolWaitingRoom can be fed to a PoolWorkingRoom to
     compute things on the wrapped thread/process pool.
+
+    A job that exchanges arrays with a process pool through shared memory lists its segments in
+    `segments`, see `_actors.shared_array.JobSegments`.
     """
-    __slots__ = ['sender_address', 'func']
+    __slots__ = ['sender_address', 'func', 'segments']
 
-    def __init__(self, sender_address, func):
+    def __init__(self, sender_address, func, segments=None):
         self.sender_address = sender_address
         self.func = func
+        self.segments = segments
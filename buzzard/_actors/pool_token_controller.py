@@ -0,0 +1,103 @@
+import time
+
+# Bounds of the number of tokens given out in addition to the number of workers of a pool
+MIN_OVERLOAD = 1
+MAX_OVERLOAD_PER_WORKER = 4
+
+# Above this ratio of idle worker time while jobs were waiting for a token, tokens are added
+IDLE_RATIO_THRESHOLD = 0.1
+
+# Above this ratio of queue wait over job duration, tokens are removed
+QUEUE_WAIT_RATIO_THRESHOLD = 0.5
+
+class PoolTokenController:
+    """Chooses the number of tokens of an `ActorPoolWaitingRoom` from the timings of the jobs that
+    ran on its pool.
+
+    The tokens given out in addition to the number of workers (the overload) hide the latency
+    between the end of a job and the launch of the next one by the scheduler. Short IO bound jobs
+    need a large overload to keep the workers busy, long CPU bound jobs need a small one, since
+    the jobs in excess only wait in the pool's internal queue where they can't be reprioritized.
+
+    The timings are aggregated by windows of jobs. At the end of a window:
+    - if the workers were idle more than `IDLE_RATIO_THRESHOLD` of the time while jobs were waiting
+      for a token, the overload is doubled,
+    - else if the jobs waited in the pool's queue for more than `QUEUE_WAIT_RATIO_THRESHOLD` of
+      their duration, the overload is decremented.
+
+    Timings are measured with `time.monotonic`, a system-wide clock, the jobs running on process
+    pools can thus be timed too.
+    """
+
+    def __init__(self, worker_count, overload):
+        self.worker_count = worker_count
+        self.overload = overload
+        self._max_overload = max(overload, MAX_OVERLOAD_PER_WORKER * worker_count)
+        self._reset_window()
+
+    @property
+    def token_count(self):
+        return self.worker_count + self.overload
+
+    def job_done(self, submit_time, start_time, end_time, starving):
+        """Register the timings of a job that ran on the pool
+
+        Parameters
+        ----------
+        submit_time: float
+            When the job was submitted to the pool
+        start_time: float
+            When the job started on a worker
+        end_time: float
+            When the job ended on a worker
+        starving: bool
+            Whether some jobs were waiting for a token when this job's token came back
+
+        Returns
+        -------
+        None or (float, float, float)
+            None if the window is not over, or its idle ratio, mean queue wait and mean duration
+        """
+        self._count += 1
+        self._starving_count += starving
+        self._queue_wait += start_time - submit_time
+        self._duration += end_time - start_time
+        if self._window_start is None:
+            self._window_start = start_time
+        else:
+            self._window_start = min(self._window_start, start_time)
+        self._window_end = max(self._window_end, end_time)
+        if self._count < 2 * self.token_count:
+            return None
+
+        wall = self._window_end - self._window_start
+        if wall <= 0: # pragma: no cover
+            self._reset_window()
+            return None
+        idle_ratio = max(0., 1 - self._duration / (wall * self.worker_count))
+        queue_wait = self._queue_wait / self._count
+        duration = self._duration / self._count
+        starving = self._starving_count * 2 >= self._count
+        self._reset_window()
+
+        if starving and idle_ratio > IDLE_RATIO_THRESHOLD:
+            self.overload = min(self._max_overload, self.overload * 2)
+        elif queue_wait > QUEUE_WAIT_RATIO_THRESHOLD * duration:
+            self.overload = max(MIN_OVERLOAD, self.overload - 1)
+        return idle_ratio, queue_wait, duration
+
+    def _reset_window(self):
+        self._count = 0
+        self._starving_count = 0
+        self._queue_wait = 0.
+        self._duration = 0.
+        self._window_start = None
+        self._window_end = float('-inf')
+
+def timed_call(func):
+    """Call `func` and return its result along with its start and end times.
+    Meant to be launched on a pool through `functools.partial`.
+    """
+    start = time.monotonic()
+    res = func()
+    return res, start, time.monotonic()
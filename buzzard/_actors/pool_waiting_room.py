@@ -1,4 +1,4 @@
-from typing import Set, Dict, Tuple
+from typing import Set, Dict, Tuple, Optional
 import itertools
 import operator
 import functools
@@ -9,20 +9,26 @@ import sortedcontainers
 
 from buzzard._footprint import Footprint # For mypy
 from buzzard._actors.message import Msg
-from buzzard._actors.pool_job import PoolJobWaiting, MaxPrioJobWaiting, ProductionJobWaiting, CacheJobWaiting
+from buzzard._actors.pool_job import (
+    PoolJobWaiting, MaxPrioJobWaiting, ProductionJobWaiting, CacheJobWaiting, MinPrioJobWaiting,
+)
 from buzzard._actors.priorities import dummy_priorities, Priorities
 from buzzard._actors.cached.query_infos import CachedQueryInfos
+from buzzard._actors.pool_token_controller import PoolTokenController
 
 LOGGER = logging.getLogger(__name__)
 OVERLOAD = 2
 
+# Maximum number of `MinPrioJobWaiting` in the working room at the same time
+MIN_PRIO_TOKEN_COUNT = 1
+
 class ActorPoolWaitingRoom:
     """Actor that takes care of prioritizing jobs waiting for spots in a thread/process pool.
 
     It gives out tokens to allow jobs to enter the `ActorPoolWorkingRoom`. There are as many tokens
     as spots in the underlying thread/process pool.
 
-    It accepts 3 types of `PoolJobWaiting`
+    It accepts 4 types of `PoolJobWaiting`
     - `MaxPrioJobWaiting`
       - Rank 0 job, has priority over the other jobs.
       - Stored in a set
@@ -35,16 +41,59 @@ class ActorPoolWaitingRoom:
       - Rank 1 job
       - Stored in many data structures
       - Used by `cached.Merger`, `cached.Writer`
+    - `MinPrioJobWaiting`
+      - Rank 2 job, only given a token when no other job is waiting, and at most
+        `MIN_PRIO_TOKEN_COUNT` at a time so that the pool stays available for the other jobs.
+      - Stored in a set
+      - Used by `cached.FileChecker` for background verifications
+
+    Memory budgets
+    --------------
+    On top of the tokens, a job may only enter the working room if its estimated size in bytes
+    fits in the memory budget of the pool and in the memory budget of the Dataset (the latter is
+    shared by all the waiting rooms). The most urgent job is always the next one to be allowed, a
+    job that does not fit blocks the less urgent ones until enough bytes are released. When
+    nothing is in flight, a job is allowed even if it is bigger than a budget.
+
+    A job that does not fit reserves the budgets it is waiting for: until it is allowed (or
+    unscheduled) it stays the next job of its waiting room, even if more urgent jobs arrive, and
+    the other waiting rooms can't allow any job on those budgets. The bytes in flight are drained
+    this way and the big jobs are not starved by a flow of small ones. The background jobs
+    (`MinPrioJobWaiting`) don't reserve budgets.
+
+    Adaptive token count
+    --------------------
+    By default there are `OVERLOAD` more tokens than workers in the pool. If the token count is
+    adaptive, a `PoolTokenController` chooses this number from the timings of the jobs, and the
+    `pool_token_count_update` debug event is emitted each time the timings are evaluated.
+
+    When the jobs are launched by batches on the pool (see `ActorPoolWorkingRoom`), the number of
+    tokens is multiplied by the batch size.
 
     """
 
-    def __init__(self, pool):
+    def __init__(self, pool, worker_count, batch_size, pool_budget, dataset_budget, adaptive,
+                 debug_mngr):
         """
         Parameters
         ----------
-        pool: multiprocessing.pool.Pool (or the multiprocessing.pool.ThreadPool subclass)
+        pool: multiprocessing.pool.Pool (or the multiprocessing.pool.ThreadPool subclass) or concurrent.futures.Executor
+        worker_count: int
+            Number of workers of `pool`
+        batch_size: int
+            Maximum number of jobs per pool task
+        pool_budget: ByteBudget
+            Memory budget of `pool`
+        dataset_budget: ByteBudget
+            Memory budget of the Dataset, shared with the other waiting rooms
+        adaptive: bool
+            Whether the token count is chosen by a `PoolTokenController`
+        debug_mngr: DebugObserversManager
+            Dataset's debug observers
         """
         self._alive = True
+        self._pool = pool
+        self._debug_mngr = debug_mngr
 
         # `global_priorities` contains all the methods necessary to establish the priority of a
         # `prod_job` or a `cache_job`. This object is updated by
@@ -54,16 +103,36 @@ class ActorPoolWaitingRoom:
         # Tokens *****************************************************
         pool_id = id(pool)
         self._pool_id = pool_id
-        self._token_count = pool._processes + OVERLOAD
-        short_id = short_id_of_id(pool_id)
+        self._batch_size = batch_size
+        self._token_count = (worker_count + OVERLOAD) * batch_size
+        self._short_id = short_id_of_id(pool_id)
+        self._token_indices = itertools.count()
         self._tokens = {
-            # This has no particular meaning, the only hard requirement is just to have
-            # different tokens in a pool.
-            _PoolToken(short_id * 1000 + i)
-            for i in range(self._token_count)
+            self._create_token()
+            for _ in range(self._token_count)
         }
         self._all_tokens = set(self._tokens)
 
+        # Number of tokens that should be destroyed when they come back
+        self._tokens_to_retire = 0
+
+        if adaptive:
+            self._controller = PoolTokenController(worker_count, OVERLOAD)
+        else:
+            self._controller = None
+
+        # Memory budgets *********************************************
+        self._dataset_budget = dataset_budget
+        self._budgets = tuple(
+            budget
+            for budget in [pool_budget, dataset_budget]
+            if budget.limit is not None
+        )
+        self._nbytes_of_token = {} # type: Dict[_PoolToken, int]
+
+        # Job that reserved some budgets because it did not fit, it is the next job to be allowed
+        self._reserved_job = None # type: Optional[PoolJobWaiting]
+
         # Rank 0 jobs ************************************************
         self._jobs_maxprio = set() # type: Set[MaxPrioJobWaiting]
 
@@ -79,10 +148,15 @@ class ActorPoolWaitingRoom:
         self._prod_jobs_of_query = {} # type: Dict[CachedQueryInfos, Set[ProductionJobWaiting]]
         self._cache_jobs_of_cache_fp = {} # type: Dict[Tuple[uuid.UUID, Footprint], Set[CacheJobWaiting]]
 
+        # Rank 2 jobs ************************************************
+        self._jobs_minprio = set() # type: Set[MinPrioJobWaiting]
+        self._minprio_tokens = set() # type: Set[_PoolToken]
+
         # Shortcuts **************************************************
         # For fast iteration / cleanup
-        self._job_sets = [self._jobs_maxprio, self._jobs_prod, self._jobs_cache]
+        self._job_sets = [self._jobs_maxprio, self._jobs_prod, self._jobs_cache, self._jobs_minprio]
         self._data_structures = self._job_sets + [
+            self._minprio_tokens,
             self._dict_of_prio_per_r1job,
             self._sset_of_prios,
             self._dict_of_r1jobs_per_prio,
@@ -103,16 +177,14 @@ class ActorPoolWaitingRoom:
         ----------
         job: _actors.pool_job.PoolJobWaiting
         """
-        if len(self._tokens) != 0:
+        if (len(self._tokens) != 0 and self._job_count == 0 and self._fits(job) and
+                not isinstance(job, MinPrioJobWaiting)):
             # If job can be started straight away, do so.
-            assert self._job_count == 0
-            return [
-                Msg(job.sender_address, 'token_to_working_room', job, self._tokens.pop())
-            ]
+            return [self._give_token(job)]
         else:
             # Store job for later invocation
             self._store_job(job)
-        return []
+        return self._give_tokens()
 
     def receive_unschedule_job(self, job):
         """Receive message: Forget about this waiting job
@@ -121,8 +193,13 @@ class ActorPoolWaitingRoom:
         ----------
         job: _actors.pool_job.PoolJobWaiting
         """
+        msgs = []
+        if job is self._reserved_job:
+            msgs += self._cancel_reservation()
         self._unstore_job(job)
-        return []
+
+        # The job may have been blocking less urgent jobs
+        return msgs + self._give_tokens()
 
     def receive_global_priorities_update(self, global_priorities, query_updates, cache_tile_updates):
         """Receive message: Update your jobs priorities
@@ -151,32 +228,44 @@ class ActorPoolWaitingRoom:
                 self._unstore_job(job)
                 self._store_job(job)
 
-        return []
+        return self._give_tokens()
 
-    def receive_salvage_token(self, token):
+    def receive_salvage_token(self, token, job_timings=None):
         """Receive message: A Job is done/cancelled, allow some other jobs
 
         Parameters
         ----------
         token: _PoolToken
+        job_timings: None or (float, float, float)
+            If the job ran and the token count is adaptive, the times when it was submitted to
+            the pool, when it started and when it ended.
         """
         assert token in self._all_tokens, 'Received a token that is not owned by this waiting room'
         assert token not in self._tokens, 'Received a token that is already here'
-        self._tokens.add(token)
-
-        job_count = self._job_count
-        if job_count == 0:
-            return []
+        if self._tokens_to_retire:
+            self._tokens_to_retire -= 1
+            self._all_tokens.remove(token)
         else:
-            token_count = len(self._tokens)
-            assert token_count == 1, """The way this class is designed, this point in code should only
-            reached if token_count == 1"""
-
-            job = self._unstore_most_urgent_job()
-
-        return [Msg(
-            job.sender_address, 'token_to_working_room', job, self._tokens.pop()
-        )]
+            self._tokens.add(token)
+        self._minprio_tokens.discard(token)
+        nbytes = self._nbytes_of_token.pop(token)
+        for budget in self._budgets:
+            budget.in_flight -= nbytes
+
+        if job_timings is not None and self._controller is not None:
+            self._update_token_count(job_timings)
+
+        msgs = self._give_tokens()
+        if nbytes and self._dataset_budget in self._budgets:
+            # The waiting rooms of the other pools may be waiting for those bytes
+            msgs += [Msg('/Pool*/WaitingRoom', 'dataset_budget_released')]
+        return msgs
+
+    def receive_dataset_budget_released(self):
+        """Receive message: Some bytes of the Dataset's memory budget were released by a waiting
+        room, allow some other jobs
+        """
+        return self._give_tokens()
 
     def receive_die(self):
         """Receive message: The wrapped pool is no longer used"""
@@ -187,12 +276,19 @@ class ActorPoolWaitingRoom:
                 self._job_count,
             ))
 
+        # Release the bytes of the jobs still in flight and the reserved budgets
+        for budget in self._budgets:
+            budget.in_flight -= sum(self._nbytes_of_token.values())
+        msgs = self._cancel_reservation()
+
         # Clear attributes *****************************************************
+        self._nbytes_of_token.clear()
+        self._pool = None
         self._prios = dummy_priorities
         for ds in self._data_structures:
             ds.clear()
 
-        return []
+        return msgs
 
     # ******************************************************************************************* **
     # Misc *********************************************************************
@@ -200,6 +296,95 @@ class ActorPoolWaitingRoom:
     def _job_count(self):
         return sum(map(len, self._job_sets))
 
+    # Token operations *********************************************************
+    def _create_token(self):
+        # This has no particular meaning, the only hard requirement is just to have
+        # different tokens in a pool.
+        return _PoolToken(self._short_id * 1000 + next(self._token_indices))
+
+    def _update_token_count(self, job_timings):
+        # The background jobs don't count, they can always wait
+        starving = self._job_count != len(self._jobs_minprio)
+        res = self._controller.job_done(*job_timings, starving=starving)
+        if res is None:
+            return
+        token_count = self._controller.token_count * self._batch_size
+        delta = token_count - self._token_count
+        self._token_count = token_count
+
+        # Cancel the retirements first, then create or retire tokens
+        retirements_cancelled = min(max(delta, 0), self._tokens_to_retire)
+        self._tokens_to_retire -= retirements_cancelled
+        delta -= retirements_cancelled
+        for _ in range(delta):
+            token = self._create_token()
+            self._tokens.add(token)
+            self._all_tokens.add(token)
+        for _ in range(-delta):
+            if self._tokens:
+                self._all_tokens.remove(self._tokens.pop())
+            else:
+                self._tokens_to_retire += 1
+
+        idle_ratio, queue_wait, duration = res
+        self._debug_mngr.event(
+            'pool_token_count_update', self._pool, token_count, idle_ratio, queue_wait, duration,
+        )
+
+    def _fits(self, job):
+        return all(budget.fits(job.nbytes, self) for budget in self._budgets)
+
+    def _reserve(self, job):
+        """`job` does not fit, reserve the budgets it is waiting for that are not reserved yet"""
+        if isinstance(job, MinPrioJobWaiting):
+            return
+        for budget in self._budgets:
+            if budget.reserved_by is None and not budget.fits(job.nbytes, self):
+                budget.reserved_by = self
+                self._reserved_job = job
+
+    def _cancel_reservation(self):
+        """Release the budgets reserved by this waiting room"""
+        self._reserved_job = None
+        released = False
+        for budget in self._budgets:
+            if budget.reserved_by is self:
+                budget.reserved_by = None
+                released = released or budget is self._dataset_budget
+        if released:
+            # The waiting rooms of the other pools may be waiting for this budget
+            return [Msg('/Pool*/WaitingRoom', 'dataset_budget_released')]
+        return []
+
+    def _give_token(self, job):
+        token = self._tokens.pop()
+        if isinstance(job, MinPrioJobWaiting):
+            self._minprio_tokens.add(token)
+        self._nbytes_of_token[token] = job.nbytes
+        for budget in self._budgets:
+            budget.in_flight += job.nbytes
+        return Msg(job.sender_address, 'token_to_working_room', job, token)
+
+    def _give_tokens(self):
+        """Give tokens to the most urgent jobs, as long as there are tokens and the next job fits in
+        the memory budgets
+        """
+        msgs = []
+        while len(self._tokens) != 0 and self._job_count != 0:
+            job = self._reserved_job
+            if job is None:
+                job = self._most_urgent_job()
+                if job is None:
+                    break
+            if not self._fits(job):
+                self._reserve(job)
+                break
+            self._unstore_job(job)
+            msgs.append(self._give_token(job))
+            if job is self._reserved_job:
+                msgs += self._cancel_reservation()
+        return msgs
+
     # Job storage operations ***************************************************
     def _store_job(self, job):
         """Compute the priority of a job and register it in the right objects"""
@@ -209,6 +394,8 @@ class ActorPoolWaitingRoom:
         )
         if isinstance(job, MaxPrioJobWaiting):
             self._jobs_maxprio.add(job)
+        elif isinstance(job, MinPrioJobWaiting):
+            self._jobs_minprio.add(job)
         else:
             if isinstance(job, ProductionJobWaiting):
                 self._jobs_prod.add(job)
@@ -243,6 +430,8 @@ class ActorPoolWaitingRoom:
         """Unregister a job from the right objects"""
         if isinstance(job, MaxPrioJobWaiting):
             self._jobs_maxprio.remove(job)
+        elif isinstance(job, MinPrioJobWaiting):
+            self._jobs_minprio.remove(job)
         else:
             if isinstance(job, ProductionJobWaiting):
                 self._jobs_prod.remove(job)
@@ -265,25 +454,54 @@ class ActorPoolWaitingRoom:
                 del self._dict_of_r1jobs_per_prio[prio]
                 self._sset_of_prios.remove(prio)
 
-    def _unstore_most_urgent_job(self):
+    def _most_urgent_job(self):
         assert self._job_count > 0
 
-        # Unstore a rank 0 job
+        # A rank 0 job
         if len(self._jobs_maxprio) > 0:
-            return self._jobs_maxprio.pop() # Pop an arbitrary one
+            return next(iter(self._jobs_maxprio)) # An arbitrary one
 
-        # Unstore a rank 1 job
-        prio = self._sset_of_prios[0]
-        job = next(iter(self._dict_of_r1jobs_per_prio[prio])) # Pop an arbitrary one
+        # A rank 1 job
+        if len(self._sset_of_prios) > 0:
+            prio = self._sset_of_prios[0]
+            return next(iter(self._dict_of_r1jobs_per_prio[prio])) # An arbitrary one
 
-        self._unstore_job(job)
-        return job
+        # A rank 2 job, if there is room for one more
+        if len(self._minprio_tokens) < MIN_PRIO_TOKEN_COUNT:
+            return next(iter(self._jobs_minprio)) # An arbitrary one
+        return None
 
     # ******************************************************************************************* **
 
 class _PoolToken(int):
     pass
 
+class ByteBudget:
+    """Number of bytes allocated by the jobs in flight in one or several pools, and its limit.
+
+    A waiting room whose next job does not fit may reserve the budget, the jobs of the other waiting
+    rooms are then refused until the reservation is cancelled.
+    """
+
+    def __init__(self, limit):
+        """
+        Parameters
+        ----------
+        limit: None or int
+            None for no limit
+        """
+        self.limit = limit
+        self.in_flight = 0
+        self.reserved_by = None # type: Optional[ActorPoolWaitingRoom]
+
+    def fits(self, nbytes, waiting_room):
+        """Can a job of `nbytes` bytes be launched now by `waiting_room`"""
+        if self.limit is None:
+            return True
+        if self.reserved_by is not None and self.reserved_by is not waiting_room:
+            return False
+        return self.in_flight == 0 or self.in_flight + nbytes <= self.limit
+
 def grouper(iterable, n, fillvalue=None):
     """itertools recipe: Collect data into fixed-length chunks or blocks
     grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx
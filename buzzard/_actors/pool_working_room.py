@@ -1,20 +1,80 @@
 import logging
+import collections
+import functools
+import itertools
+import time
+import concurrent.futures as cf
+import concurrent.futures.process
 
-from buzzard._actors.message import Msg
+from buzzard._actors.message import Msg, DroppableMsg
+from buzzard._actors.pool_token_controller import timed_call
 
 LOGGER = logging.getLogger(__name__)
 
 class ActorPoolWorkingRoom:
-    """Actor that takes care of starting/collecting jobs on/off a thread/process pool"""
+    """Actor that takes care of starting/collecting jobs on/off a thread/process pool
 
-    def __init__(self, pool):
+    Finished jobs are pushed by the pool's result handler thread to a thread-safe queue that is
+    drained by the scheduler, this way the cost of collecting jobs does not depend on the number of
+    jobs in flight.
+
+    Jobs are launched with `apply_async` on a `multiprocessing.pool.Pool` and with `submit` on a
+    `concurrent.futures.Executor`, in which case the completion is notified by
+    `Future.add_done_callback`.
+
+    If a `concurrent.futures.Executor` is shut down by its owner while jobs are pending (or is
+    broken), those jobs are dropped and the rasters that launched them are notified so that they
+    fail their queries, the scheduler keeps running.
+
+    The shared memory segments of the jobs that are cancelled, or that are dropped because their
+    pool failed, are unlinked right away.
+
+    If the batch size is greater than 1, the jobs are launched by batches of several jobs in one
+    pool task, to amortize the cost of dispatching a task to the pool. A batch is launched when it
+    is full, when its first job waited for `batch_latency` seconds (checked by the scheduler on each
+    iteration, see `batch_deadline`) or when the scheduler has nothing else to do.
+    """
+
+    def __init__(self, pool, wakeup_scheduler, debug_mngr, timed, batch_size, batch_latency):
         """
-        Parameter
-        ---------
-        pool: multiprocessing.pool.Pool (or the multiprocessing.pool.ThreadPool subclass)
+        Parameters
+        ----------
+        pool: multiprocessing.pool.Pool (or the multiprocessing.pool.ThreadPool subclass) or concurrent.futures.Executor
+        wakeup_scheduler: callable
+            Thread-safe function that interrupts the scheduler's sleep, called from the pool's
+            result handler thread when a job finishes.
+        debug_mngr: DebugObserversManager
+            Dataset's debug observers
+        timed: bool
+            Whether to measure the timings of the jobs and send them to the WaitingRoom along with
+            the tokens (see `PoolTokenController`)
+        batch_size: int
+            Maximum number of jobs in a pool task
+        batch_latency: float
+            Maximum duration in seconds a job waits for its batch to be full
         """
         self._pool = pool
+        self._wakeup_scheduler = wakeup_scheduler
+        self._debug_mngr = debug_mngr
+        self._jobs_observed = (
+            debug_mngr.is_observed('pool_job_started') or
+            debug_mngr.is_observed('pool_job_stopped')
+        )
+        # Identifiers of the pool tasks, the jobs of a batch share the same task
+        self._task_ids = itertools.count()
         self._jobs = {}
+        self._timed = timed
+        self._submit_time_of_job = {}
+        self._batch_size = batch_size
+        self._batch_latency = batch_latency
+        self._batch = [] # type: List[PoolJobWorking]
+        self._batch_start = None
+        self.batching = batch_size > 1
+
+        # Filled from the pool's result handler thread, emptied from the scheduler's thread
+        # A deque is thread-safe: https://docs.python.org/3/library/collections.html#collections.deque
+        self._finished_jobs = collections.deque() # type: Deque[Tuple[PoolJobWorking, bool, object]]
+
         self._alive = True
         self.address = f'/Pool{id(self._pool)}/WorkingRoom'
 
@@ -22,6 +82,15 @@ class ActorPoolWorkingRoom:
     def alive(self):
         return self._alive
 
+    @property
+    def batch_deadline(self):
+        """Time (of `time.monotonic`) at which the pending batch should be launched, None if no
+        batch is pending
+        """
+        if not self._batch:
+            return None
+        return self._batch_start + self._batch_latency
+
     # ******************************************************************************************* **
     def receive_launch_job_with_token(self, job, token):
         """Receive message: Launch this job that has a token from your WaitingRoom
@@ -33,9 +102,24 @@ class ActorPoolWorkingRoom:
         """
         assert job not in self._jobs
 
-        future = self._pool.apply_async(job.func)
-        self._jobs[job] = (future, token)
+        self._jobs[job] = token
+        if self._batch_size == 1:
+            self._launch([job])
+        else:
+            if not self._batch:
+                self._batch_start = time.monotonic()
+            self._batch.append(job)
+            if (len(self._batch) >= self._batch_size or
+                time.monotonic() - self._batch_start >= self._batch_latency):
+                self._launch_batch()
+
+        return []
 
+    def ext_receive_batch_deadline_passed(self):
+        """Receive message sent by something else than an actor, still treated synchronously: The
+        first job of the pending batch waited for `batch_latency` seconds, launch the batch
+        """
+        self._launch_batch()
         return []
 
     def receive_salvage_token(self, token):
@@ -49,33 +133,57 @@ class ActorPoolWorkingRoom:
         return [Msg('WaitingRoom', 'salvage_token', token)]
 
     def receive_cancel_job(self, job):
-        """Receive message: A Job you launched can be discarded. Lose the reference to the future
+        """Receive message: A Job you launched can be discarded. Its result will be ignored
 
         Parameters
         ----------
         job: _actors.pool_job.PoolJobWorking
         """
-        _, token = self._jobs.pop(job)
+        if job not in self._jobs:
+            # This job was already dropped because its executor was shut down
+            return []
+        token = self._jobs.pop(job)
+        self._submit_time_of_job.pop(job, None)
+        if job in self._batch:
+            # This job was not launched yet
+            self._batch.remove(job)
+        if job.segments is not None:
+            job.segments.release()
         return [Msg('WaitingRoom', 'salvage_token', token)]
 
     def ext_receive_nothing(self):
         """Receive message sent by something else than an actor, still treated synchronously: What's
         up?
-        Did a Job finished? Check all futures
+        Did a Job finished? Drain the queue of finished jobs
+
+        The scheduler has nothing else to do, it is also the right time to launch the pending batch.
         """
         msgs = []
 
-        finished_jobs = [
-            job
-            for job, (future, _) in self._jobs.items()
-            if future.ready()
-        ]
-        for job in finished_jobs:
-            future, token = self._jobs.pop(job)
-            res = future.get()
+        if self._batch:
+            self._launch_batch()
+
+        while self._finished_jobs:
+            job, success, res = self._finished_jobs.popleft()
+            if job not in self._jobs:
+                # This job was cancelled while running
+                continue
+            token = self._jobs.pop(job)
+            if not success:
+                if isinstance(res, (_TaskCancelled, _BrokenExecutor)):
+                    msgs += self._drop_job_of_dead_executor(job, token)
+                    continue
+                raise res
+            if job.segments is not None:
+                job.segments.done()
+            if self._timed:
+                res, start_time, end_time = res
+                timings = (self._submit_time_of_job.pop(job), start_time, end_time)
+            else:
+                timings = None
             msgs += [
                 Msg(job.sender_address, 'job_done', job, res),
-                Msg('WaitingRoom', 'salvage_token', token),
+                Msg('WaitingRoom', 'salvage_token', token, timings),
             ]
 
         return msgs
@@ -89,10 +197,134 @@ class ActorPoolWorkingRoom:
                 len(self._jobs)
             ))
 
+        for job in self._jobs:
+            if job.segments is not None:
+                job.segments.release()
+
         # Clear attributes *****************************************************
         self._jobs.clear()
+        self._submit_time_of_job.clear()
+        self._batch.clear()
+        self._finished_jobs.clear()
         self._pool = None
 
         return []
 
     # ******************************************************************************************* **
+    def _launch_batch(self):
+        jobs = self._batch
+        self._batch = []
+        self._launch(jobs)
+
+    def _launch(self, jobs):
+        """Launch a pool task that performs `jobs`"""
+        pool = self._pool
+        task_id = next(self._task_ids)
+        if self._timed:
+            now = time.monotonic()
+        for job in jobs:
+            if self._jobs_observed:
+                self._debug_mngr.event('pool_job_started', pool, job, task_id)
+            if self._timed:
+                self._submit_time_of_job[job] = now
+
+        if len(jobs) == 1:
+            job, = jobs
+            func = job.func
+            if self._timed:
+                func = functools.partial(timed_call, func)
+            finished = functools.partial(self._job_finished, pool, task_id, job)
+        else:
+            func = functools.partial(run_batch, [job.func for job in jobs], self._timed)
+            finished = functools.partial(self._batch_finished, pool, task_id, jobs)
+
+        if isinstance(pool, cf.Executor):
+            try:
+                future = pool.submit(func)
+            except RuntimeError:
+                # The executor was shut down by its owner or is broken
+                finished(False, _TaskCancelled())
+            else:
+                future.add_done_callback(functools.partial(_future_done, finished))
+        else:
+            pool.apply_async(
+                func,
+                callback=functools.partial(finished, True),
+                error_callback=functools.partial(finished, False),
+            )
+
+    def _drop_job_of_dead_executor(self, job, token):
+        """A job could not run because its executor was shut down, fail the queries of the raster
+        that launched it
+        """
+        self._submit_time_of_job.pop(job, None)
+        if job.segments is not None:
+            job.segments.release()
+        exn = RuntimeError(
+            'A job could not run because the executor {} was shut down or is broken'.format(
+                self._pool,
+            )
+        )
+        raster_address = job.sender_address.rsplit('/', 1)[0]
+        return [
+            Msg('WaitingRoom', 'salvage_token', token),
+            DroppableMsg(f'{raster_address}/QueriesHandler', 'pool_failed', exn),
+        ]
+
+    def _batch_finished(self, pool, task_id, jobs, success, res):
+        """Callback of a batch of jobs, called from the pool's result handler thread"""
+        if success:
+            for job, (job_success, job_res) in zip(jobs, res):
+                self._job_finished(pool, task_id, job, job_success, job_res)
+        else:
+            # The batch itself failed (e.g. pickling error)
+            for job in jobs:
+                self._job_finished(pool, task_id, job, False, res)
+
+    def _job_finished(self, pool, task_id, job, success, res):
+        """Callback of a job, called from the pool's result handler thread"""
+        if self._jobs_observed:
+            self._debug_mngr.event('pool_job_stopped', pool, job, success, task_id)
+        self._finished_jobs.append((job, success, res))
+        self._wakeup_scheduler()
+
+    # ******************************************************************************************* **
+
+# `concurrent.futures.BrokenExecutor` is new in python 3.7
+_BrokenExecutor = getattr(cf, 'BrokenExecutor', cf.process.BrokenProcessPool)
+
+class _TaskCancelled(cf.CancelledError):
+    """The task of a job was cancelled, i.e. its executor was shut down before the task started"""
+
+def _future_done(finished, future):
+    """Callback of `Future.add_done_callback`, called from the executor's thread that completed
+    the future
+    """
+    if future.cancelled():
+        # The executor was shut down before the task started
+        finished(False, _TaskCancelled())
+        return
+    exc = future.exception()
+    if exc is None:
+        finished(True, future.result())
+    else:
+        finished(False, exc)
+
+def run_batch(funcs, timed):
+    """Perform a batch of jobs, meant to be launched on a pool through `functools.partial`.
+    The failure of a job does not prevent the others from running.
+
+    Returns
+    -------
+    list of (bool, object)
+        Success and result (or exception) of each job
+    """
+    results = []
+    for func in funcs:
+        try:
+            res = timed_call(func) if timed else func()
+        except Exception as e:
+            results.append((False, e))
+        else:
+            results.append((True, res))
+    return results
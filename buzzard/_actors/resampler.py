@@ -1,13 +1,13 @@
 import functools
 import collections
-import multiprocessing as mp
-import multiprocessing.pool
 
 import numpy as np
 
 from buzzard._actors.message import Msg
-from buzzard._actors.pool_job import ProductionJobWaiting, PoolJobWorking
+from buzzard._actors.pool_job import ProductionJobWaiting, PoolJobWorking, array_nbytes
+from buzzard._actors.shared_array import JobSegments, share_result
 from buzzard._a_source_raster_remap import ABackSourceRasterRemapMixin
+from buzzard._dataset_pools_container import shares_address_space
 
 class ActorResampler:
     """Actor that takes care of resampling sample tiles, and wait for all
@@ -21,12 +21,7 @@ class ActorResampler:
         if resample_pool is not None:
             self._waiting_room_address = f'/Pool{id(resample_pool)}/WaitingRoom'
             self._working_room_address = f'/Pool{id(resample_pool)}/WorkingRoom'
-            if isinstance(resample_pool, mp.pool.ThreadPool):
-                self._same_address_space = True
-            elif isinstance(resample_pool, mp.pool.Pool):
-                self._same_address_space = False
-            else: # pragma: no cover
-                assert False, 'Type should be checked in facade'
+            self._same_address_space = shares_address_space(resample_pool)
         self._waiting_jobs = set()
         self._working_jobs = set()
 
@@ -290,7 +285,11 @@ class Wait(ProductionJobWaiting):
         self.sample_fp = sample_fp
         self.resample_fp = resample_fp
         self.subsample_array = subsample_array
-        super().__init__(actor.address, qi, prod_idx, 0, self.resample_fp)
+        super().__init__(
+            actor.address, qi, prod_idx, 0, self.resample_fp,
+            array_nbytes(resample_fp, len(qi.unique_channel_ids), actor._raster.dtype) +
+            subsample_array.nbytes,
+        )
 
 class Work(PoolJobWorking):
     def __init__(self, actor, qi, prod_idx, sample_fp, resample_fp, subsample_array, dst_array):
@@ -302,6 +301,7 @@ class Work(PoolJobWorking):
         dst_array_slice = dst_array[resample_fp.slice_in(produce_fp)]
 
         if actor._raster.resample_pool is None or actor._same_address_space:
+            segments = None
             func = functools.partial(
                 _resample_subsample_array,
                 sample_fp, resample_fp, subsample_array,
@@ -310,15 +310,18 @@ class Work(PoolJobWorking):
             )
         else:
             self.dst_array_slice = dst_array_slice
+            segments = JobSegments()
             func = functools.partial(
+                share_result,
                 _resample_subsample_array,
-                sample_fp, resample_fp, subsample_array,
+                sample_fp, resample_fp, segments.share_array(subsample_array),
                 actor._raster.nodata, qi.dst_nodata,
                 qi.interpolation, None,
+                result_name=segments.result_name,
             )
         actor._raster.debug_mngr.event('object_allocated', func)
 
-        super().__init__(actor.address, func)
+        super().__init__(actor.address, func, segments)
 
 def _resample_subsample_array(sample_fp, resample_fp, subsample_array, src_nodata, dst_nodata, interpolation, dst_opt):
     """
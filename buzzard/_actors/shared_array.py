@@ -0,0 +1,292 @@
+"""Transport of ndarrays between the scheduler's process and the processes of a `multiprocessing.Pool`
+(or of a `concurrent.futures.ProcessPoolExecutor`) through `multiprocessing.shared_memory` instead
+of pickling their content.
+
+An array to send is replaced by a `_SharedArrayTicket`, a small picklable object that only contains
+the name of a shared memory segment and the layout of the array in that segment. Once unpickled on
+the other side the ticket becomes an ndarray that directly wraps the segment, the job functions are
+unaware of this mechanism.
+
+The arrays sent to a job are read-only in the job's process, as a write to a segment would be seen
+by the scheduler.
+
+Lifetimes
+---------
+A segment is unlinked when the last ndarray wrapping it is garbage collected in the process that
+owns it, i.e. when the scheduler drops the tile or the query that references it.
+- A segment allocated by the scheduler to send an array to a job is owned by the scheduler. The job
+  holds a reference to the array until the pool's result comes back, so the segment outlives the
+  job's execution.
+- A segment allocated by a job to return its result is owned by the scheduler as soon as the result
+  is unpickled in the scheduler's process (even if the job was cancelled in the meantime).
+
+The segments of a job are also listed in its `JobSegments`, to unlink them right away when the job
+is cancelled or when its pool fails, in which case the result would never come back.
+
+When `multiprocessing.shared_memory` is not available (python<3.8), for arrays smaller than
+`MIN_SHARED_NBYTES` or for empty arrays, arrays are pickled as usual.
+"""
+
+import collections
+import inspect
+import secrets
+import weakref
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError: # pragma: no cover
+    shared_memory = None
+
+SHARED_MEMORY_AVAILABLE = shared_memory is not None
+
+# Since python 3.13 a segment can be opened without registering it in the `resource_tracker`
+_HAS_TRACK_PARAMETER = (
+    SHARED_MEMORY_AVAILABLE and
+    'track' in inspect.signature(shared_memory.SharedMemory.__init__).parameters
+)
+
+# Below this size, allocating a segment and mapping it in both processes costs more than pickling
+MIN_SHARED_NBYTES = 64 * 1024
+
+# id of root ndarray -> (weakref of root ndarray, segment)
+# Only contains the arrays that wrap a segment in this process
+_SEGMENT_OF_ROOT_ID = {}
+_ROOT_ID_OF_NAME = {}
+
+# Number of the jobs in flight that use a segment owned by this process
+_JOB_COUNT_OF_NAME = collections.Counter()
+
+def share_array(arr, segments=None):
+    """Prepare an ndarray to be sent to another process.
+
+    Parameters
+    ----------
+    arr: np.ndarray
+    segments: None or JobSegments
+        The segments of the job that `arr` is sent to
+
+    Returns
+    -------
+    _SharedArrayTicket or _PickledArrayTicket or np.ndarray
+        A ticket that is unpickled as a read-only ndarray (or `arr` itself if empty)
+        If `arr` already wraps a segment, no copy is performed.
+    """
+    if not isinstance(arr, np.ndarray) or arr.nbytes == 0 or arr.dtype.hasobject:
+        return arr
+
+    root = arr
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    infos = _SEGMENT_OF_ROOT_ID.get(id(root))
+    if infos is not None and infos[0]() is root:
+        name = infos[1].name
+        offset = arr.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+        ticket = _SharedArrayTicket(name, arr.shape, arr.dtype, arr.strides, offset, False, root)
+    elif not SHARED_MEMORY_AVAILABLE or arr.nbytes < MIN_SHARED_NBYTES:
+        return _PickledArrayTicket(arr)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+        root = _wrap(shm, arr.shape, arr.dtype, None, 0)
+        root[...] = arr
+        _track_ownership(shm, root)
+        ticket = _SharedArrayTicket(shm.name, arr.shape, arr.dtype, None, 0, False, root)
+
+    if segments is not None:
+        segments.borrowed_names.append(ticket.name)
+        _JOB_COUNT_OF_NAME[ticket.name] += 1
+    return ticket
+
+def share_result(func, *args, result_name=None):
+    """Call `func` and prepare its result to be sent to the process that launched the job.
+    Meant to be called inside a `multiprocessing.Pool` through `functools.partial`.
+
+    The ownership of the segment is transferred to the process that unpickles the result.
+    `result_name` is the name of the segment to create, see `JobSegments`.
+    """
+    res = func(*args)
+    if not SHARED_MEMORY_AVAILABLE or not isinstance(res, np.ndarray) or res.dtype.hasobject:
+        return res
+    if res.nbytes == 0 or res.nbytes < MIN_SHARED_NBYTES:
+        return res
+
+    shm = _open_in_pool_process(result_name, True, res.nbytes)
+    dst = np.ndarray(res.shape, res.dtype, buffer=shm.buf)
+    dst[...] = res
+    del dst
+    return _SharedArrayTicket(shm.name, res.shape, res.dtype, None, 0, True, shm)
+
+class JobSegments:
+    """Segments used by a job launched on a process pool, to unlink them as soon as the job is
+    cancelled or its pool fails.
+
+    - The segments of the arrays sent to the job are unlinked once no other job in flight uses
+      them. The arrays of the scheduler that wrap them stay valid, the next jobs that need them get
+      a new segment.
+    - The name of the segment of the result is chosen before launching the job, so that it can be
+      unlinked even if the result never comes back.
+    """
+    __slots__ = ['borrowed_names', 'result_name']
+
+    def __init__(self):
+        self.borrowed_names = []
+        self.result_name = 'buzz_' + secrets.token_hex(8) if SHARED_MEMORY_AVAILABLE else None
+
+    def share_array(self, arr):
+        return share_array(arr, self)
+
+    def done(self):
+        """The job returned, its segments are left to the garbage collection"""
+        for name in self.borrowed_names:
+            _release_name(name, False)
+        self.borrowed_names.clear()
+
+    def release(self):
+        """The job was cancelled or its pool failed, unlink its segments"""
+        for name in self.borrowed_names:
+            _release_name(name, True)
+        self.borrowed_names.clear()
+        if self.result_name is not None:
+            try:
+                shm = shared_memory.SharedMemory(self.result_name)
+            except FileNotFoundError:
+                # The job did not allocate its result (yet)
+                pass
+            else:
+                _close(shm)
+                _unlink_quietly(shm)
+
+class _PickledArrayTicket:
+    """Picklable wrapper of a small ndarray, unpickled as a read-only copy"""
+    __slots__ = ['arr']
+
+    def __init__(self, arr):
+        self.arr = arr
+
+    def __reduce__(self):
+        return (_read_only, (self.arr,))
+
+def _read_only(arr):
+    """Unpickling function of a `_PickledArrayTicket`"""
+    arr.flags.writeable = False
+    return arr
+
+class _SharedArrayTicket:
+    """Picklable reference to an ndarray stored in a shared memory segment. Unpickled as an ndarray.
+
+    The `keepalive` attribute keeps the segment alive in the sending process as long as the ticket
+    lives (i.e. until the job that references it is done), it is not pickled.
+    """
+    __slots__ = ['name', 'shape', 'dtype', 'strides', 'offset', 'transfer', 'keepalive']
+
+    def __init__(self, name, shape, dtype, strides, offset, transfer, keepalive):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.strides = strides
+        self.offset = offset
+        self.transfer = transfer
+        self.keepalive = keepalive
+
+    def __reduce__(self):
+        return (
+            _attach_array,
+            (self.name, self.shape, self.dtype, self.strides, self.offset, self.transfer),
+        )
+
+def _attach_array(name, shape, dtype, strides, offset, transfer):
+    """Unpickling function of a `_SharedArrayTicket`
+
+    Returns None if the segment was unlinked by `JobSegments.release`, the job was cancelled and
+    its result is ignored. Raising would kill the pool's process, or the pool's result handler
+    thread.
+    """
+    try:
+        if transfer:
+            # This process becomes the owner of the segment
+            shm = shared_memory.SharedMemory(name)
+        else:
+            # This process only borrows the segment
+            shm = _open_in_pool_process(name, False, 0)
+    except FileNotFoundError:
+        return None
+    arr = _wrap(shm, shape, dtype, strides, offset)
+    if transfer:
+        _track_ownership(shm, arr)
+    else:
+        arr.flags.writeable = False
+        weakref.finalize(arr, _close, shm)
+    return arr
+
+def _open_in_pool_process(name, create, size):
+    """Open a segment without registering it in the `resource_tracker` of a pool's process.
+
+    The `resource_tracker` of a pool's process is not always the one of the scheduler's process
+    (e.g. when the pool was forked before the scheduler's process used any shared memory). In that
+    case, when the pool's process exits, its tracker would unlink the segments that are still in
+    use by the scheduler's process.
+    """
+    if _HAS_TRACK_PARAMETER:
+        return shared_memory.SharedMemory(name, create, size, track=False)
+
+    # Quick hack for python<3.13, the pool's processes are single threaded
+    register = resource_tracker.register
+    resource_tracker.register = _no_op
+    try:
+        return shared_memory.SharedMemory(name, create, size)
+    finally:
+        resource_tracker.register = register
+
+def _no_op(*_):
+    pass
+
+def _wrap(shm, shape, dtype, strides, offset):
+    return np.ndarray(shape, dtype, buffer=shm.buf, offset=offset, strides=strides)
+
+def _track_ownership(shm, root):
+    """Register `root`, an ndarray that wraps `shm`, and unlink `shm` when `root` is garbage
+    collected.
+    """
+    root_id = id(root)
+    _SEGMENT_OF_ROOT_ID[root_id] = (weakref.ref(root), shm)
+    _ROOT_ID_OF_NAME[shm.name] = root_id
+    weakref.finalize(root, _unlink, shm, root_id)
+
+def _release_name(name, unlink):
+    """A job in flight stopped using the segment `name`, unlink it if `unlink` and no other job
+    uses it.
+    """
+    _JOB_COUNT_OF_NAME[name] -= 1
+    if _JOB_COUNT_OF_NAME[name] > 0:
+        return
+    del _JOB_COUNT_OF_NAME[name]
+    if not unlink:
+        return
+    root_id = _ROOT_ID_OF_NAME.pop(name, None)
+    if root_id is None: # pragma: no cover
+        return
+    # The arrays that wrap the segment stay valid, but it won't be sent to the next jobs
+    _, shm = _SEGMENT_OF_ROOT_ID.pop(root_id)
+    _unlink_quietly(shm)
+
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError: # pragma: no cover
+        # A memoryview of the segment is still alive, the mapping will be released with it
+        pass
+
+def _unlink(shm, root_id):
+    if _SEGMENT_OF_ROOT_ID.pop(root_id, None) is not None:
+        del _ROOT_ID_OF_NAME[shm.name]
+    _close(shm)
+    _unlink_quietly(shm)
+
+def _unlink_quietly(shm):
+    try:
+        shm.unlink()
+    except FileNotFoundError: # pragma: no cover
+        # The `resource_tracker` of a pool's process, or `JobSegments.release`, already unlinked
+        # the segment
+        pass
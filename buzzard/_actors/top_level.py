@@ -1,7 +1,7 @@
 import collections
 
 from buzzard._actors.message import Msg
-from buzzard._actors.pool_waiting_room import ActorPoolWaitingRoom
+from buzzard._actors.pool_waiting_room import ActorPoolWaitingRoom, ByteBudget
 from buzzard._actors.pool_working_room import ActorPoolWorkingRoom
 from buzzard._actors.global_priorities_watcher import ActorGlobalPrioritiesWatcher
 
@@ -15,7 +15,21 @@ class ActorTopLevel:
     as stopping the scheduler's loop. If a destruction is ever needed, call a die method from
     the scheduler using the `top_level_actor` variable.
     """
-    def __init__(self):
+    def __init__(self, wakeup_scheduler, debug_mngr, pools_container):
+        """
+        Parameter
+        ---------
+        wakeup_scheduler: callable
+            Thread-safe function that interrupts the scheduler's sleep
+        debug_mngr: DebugObserversManager
+            Dataset's debug observers
+        pools_container: PoolsContainer
+            Dataset's pools, used to configure the pools' actors
+        """
+        self._wakeup_scheduler = wakeup_scheduler
+        self._debug_mngr = debug_mngr
+        self._pools_container = pools_container
+        self._dataset_budget = None
         self._rasters = set()
         self._rasters_per_pool = collections.defaultdict(list)
 
@@ -73,11 +87,26 @@ class ActorTopLevel:
             for pool in [getattr(raster, attr)]
             if pool is not None
         }
+        if pools and self._dataset_budget is None:
+            self._dataset_budget = ByteBudget(self._pools_container.total_memory_budget())
         for pool_id, pool in pools.items():
             if pool_id not in self._rasters_per_pool:
+                adaptive = self._pools_container.adaptive_token_count(pool)
+                batch_size, batch_latency = self._pools_container.job_batching(pool)
                 actors = [
-                    ActorPoolWaitingRoom(pool),
-                    ActorPoolWorkingRoom(pool),
+                    ActorPoolWaitingRoom(
+                        pool,
+                        self._pools_container.worker_count(pool),
+                        batch_size,
+                        ByteBudget(self._pools_container.memory_budget(pool)),
+                        self._dataset_budget,
+                        adaptive,
+                        self._debug_mngr,
+                    ),
+                    ActorPoolWorkingRoom(
+                        pool, self._wakeup_scheduler, self._debug_mngr, adaptive,
+                        batch_size, batch_latency,
+                    ),
                 ]
                 msgs += actors
 
@@ -1,21 +1,29 @@
 import collections
-import weakref
-import glob
+import hashlib
+import numbers
 import os
+import re
+import weakref
 
 import numpy as np
 import rtree.index
+import shapely.geometry as sg
 
 from buzzard._actors.message import Msg
+from buzzard._footprint import Footprint
+from buzzard.utils import concat_arrays
 from buzzard._a_raster_recipe import ARasterRecipe, ABackRasterRecipe
 
 from buzzard._actors.cached.cache_extractor import ActorCacheExtractor
+from buzzard._actors.cached.cache_manifest import CacheManifest, fname_prefix_of_path
 from buzzard._actors.cached.cache_supervisor import ActorCacheSupervisor
+from buzzard._actors.cached import fill_marker
 from buzzard._actors.cached.file_checker import ActorFileChecker
 from buzzard._actors.cached.merger import ActorMerger
 from buzzard._actors.cached.producer import ActorProducer
 from buzzard._actors.cached.queries_handler import ActorQueriesHandler
 from buzzard._actors.cached.reader import ActorReader
+from buzzard._actors.cached.warm_up import WarmUpProgress
 from buzzard._actors.cached.writer import ActorWriter
 from buzzard._actors.computation_accumulator import ActorComputationAccumulator
 from buzzard._actors.computation_gate1 import ActorComputationGate1
@@ -35,7 +43,8 @@ class CachedRasterRecipe(ARasterRecipe):
         self, ds,
         fp, dtype, channel_count, channels_schema, sr,
         compute_array, merge_arrays,
-        cache_dir, overwrite,
+        cache_dir, overwrite, cache_format, cache_verification,
+        cache_max_bytes, cache_eviction, cache_key, cache_overviews,
         primitives_back, primitives_kwargs, convert_footprint_per_primitive,
         computation_pool, merge_pool, io_pool, resample_pool,
         cache_tiles, computation_tiles,
@@ -47,7 +56,8 @@ class CachedRasterRecipe(ARasterRecipe):
             weakref.proxy(self),
             fp, dtype, channel_count, channels_schema, sr,
             compute_array, merge_arrays,
-            cache_dir, overwrite,
+            cache_dir, overwrite, cache_format, cache_verification,
+            cache_max_bytes, cache_eviction, cache_key, cache_overviews,
             primitives_back, primitives_kwargs, convert_footprint_per_primitive,
             computation_pool, merge_pool, io_pool, resample_pool,
             cache_tiles, computation_tiles,
@@ -63,9 +73,114 @@ class CachedRasterRecipe(ARasterRecipe):
 
     @property
     def cache_dir(self):
-        """Cache directory path provided at construction"""
+        """Directory of the cache files. It is the `cache_dir` provided at construction, or a
+        sub-directory of it if a `cache_key` was provided.
+        """
         return self._back.cache_dir
 
+    @property
+    def cache_overviews(self):
+        """Downsampling factors of the overviews provided at construction, an empty tuple if
+        none
+        """
+        return self._back.cache_overviews
+
+    @property
+    def cache_key(self):
+        """Provenance hash of the cache files (a str), derived from the `cache_key` provided at
+        construction and from the `cache_key` of the primitives. None if no `cache_key` was
+        provided.
+        """
+        return self._back.cache_key
+
+    def invalidate(self, fp_or_geometry):
+        """Mark the cache tiles intersecting `fp_or_geometry` as outdated, their cache files are
+        removed and they will be computed again when needed.
+
+        Useful when the inputs of `compute_array` changed in an area, to avoid recomputing the
+        whole raster with `ow=True`.
+
+        This method returns right away, the invalidation is performed by the Dataset's scheduler.
+        The queries issued afterward compute the invalidated cache tiles again. The queries
+        already ongoing still read the old cache files, those files are removed once they are not
+        used anymore.
+
+        Parameters
+        ----------
+        fp_or_geometry: Footprint or shapely.geometry.base.BaseGeometry
+            Area to invalidate, in the same spatial reference as the raster's `fp`. The cache
+            tiles only touching its boundary are not invalidated.
+
+        Returns
+        -------
+        list of Footprint
+            The cache tiles invalidated
+
+        Example
+        -------
+        >>> r.invalidate(ds.new_roads.fp)
+        ... r.invalidate(shapely.geometry.Point(x, y).buffer(100))
+
+        """
+        if isinstance(fp_or_geometry, Footprint):
+            geom = fp_or_geometry.poly
+        elif isinstance(fp_or_geometry, sg.base.BaseGeometry):
+            geom = fp_or_geometry
+        else:
+            raise TypeError('`fp_or_geometry` should be a Footprint or a shapely geometry')
+        return self._back.invalidate(geom)
+
+    def warm(self, fp_or_fps, priority=0, max_queue_size=5):
+        """Fill the cache tiles intersecting `fp_or_fps` without producing any array.
+
+        The missing cache tiles are computed, merged and written to the cache directory, but
+        nothing is read back from the cache files nor resampled. Useful to precompute a raster in
+        batch, before serving it.
+
+        This method returns right away, the warm-up is performed by the Dataset's scheduler. Its
+        jobs are scheduled on the pools alongside the ones of the queries, according to
+        `priority`.
+
+        Parameters
+        ----------
+        fp_or_fps: Footprint or sequence of Footprint
+            Areas to warm-up, the first ones are computed with a higher priority than the later
+            ones. The cache tiles only touching their boundary are not computed.
+        priority: int
+            The cache tile `i` of the warm-up is as urgent as the array `priority + i` of a
+            query. With a large value the ongoing and future queries go first.
+        max_queue_size: int
+            Maximum number of cache tiles computed in advance, in addition to the ones already
+            available.
+
+        Returns
+        -------
+        WarmUpProgress
+            Thread-safe handle with
+            - `total`, `done_count`, `done` and `cancelled` attributes,
+            - a `wait(timeout=None)` method that blocks until the warm-up is over,
+            - a `cancel()` method.
+            The warm-up continues if the handle is lost.
+
+        Example
+        -------
+        >>> r.warm(r.fp).wait()
+        ... progress = r.warm(fps_of_tomorrow, priority=100)
+
+        """
+        if isinstance(fp_or_fps, Footprint):
+            fps = [fp_or_fps]
+        else:
+            fps = list(fp_or_fps)
+        for fp in fps:
+            if not isinstance(fp, Footprint):
+                raise TypeError(f'`fp_or_fps` should be a Footprint or a sequence of Footprint (not {fp})')
+        priority = int(priority)
+        max_queue_size = int(max_queue_size)
+        if max_queue_size <= 0:
+            raise ValueError('`max_queue_size` should be >0')
+        return self._back.warm(fps, priority, max_queue_size)
+
 class BackCachedRasterRecipe(ABackRasterRecipe):
     """Implementation of CachedRasterRecipe's specifications"""
 
@@ -73,7 +188,8 @@ class BackCachedRasterRecipe(ABackRasterRecipe):
         self, back_ds, facade_proxy,
         fp, dtype, channel_count, channels_schema, sr,
         compute_array, merge_arrays,
-        cache_dir, overwrite,
+        cache_dir, overwrite, cache_format, cache_verification,
+        cache_max_bytes, cache_eviction, cache_key, cache_overviews,
         primitives_back, primitives_kwargs, convert_footprint_per_primitive,
         computation_pool, merge_pool, io_pool, resample_pool,
         cache_tiles, computation_tiles,
@@ -108,8 +224,21 @@ class BackCachedRasterRecipe(ABackRasterRecipe):
         )
         self.io_pool = io_pool
         self.cache_fps = cache_tiles
+        if cache_key is not None:
+            # Each version of the recipe gets its own sub-directory
+            cache_key = _provenance_digest(
+                cache_key, self.fp, self.dtype, len(self), primitives_back, primitives_kwargs,
+            )
+            cache_dir = os.path.join(cache_dir, 'key_' + cache_key)
+        self.cache_key = cache_key
         self.cache_dir = cache_dir
         self.overwrite = overwrite
+        self.cache_format = cache_format
+        self.cache_verification = cache_verification
+        self.cache_max_bytes = _quota_of_level(cache_max_bytes, cache_overviews, 1)
+        self.cache_eviction = cache_eviction
+        self.cache_manifest = CacheManifest(cache_dir)
+        self.cache_overviews = cache_overviews
 
         # Tilings shortcuts ****************************************************
         self._cache_footprint_index = self._build_cache_fps_index(
@@ -133,6 +262,41 @@ class BackCachedRasterRecipe(ABackRasterRecipe):
             '/Global/TopLevel', 'new_raster', self,
         ))
 
+        # Overviews ************************************************************
+        # Each overview is a cached raster recipe that resamples the previous one. It only contains
+        # the pixels entirely inside of the previous one, so that they are never averaged with
+        # the nodata outside of it.
+        self.overviews = []
+        prev = self
+        tile_rsize = tuple(cache_tiles.flat[0].rsize)
+        for factor in cache_overviews:
+            overview_fp = Footprint(
+                gt=np.asarray(fp.gt) * [1, factor, factor, 1, factor, factor],
+                rsize=fp.rsize // factor,
+            )
+            overview_tiles = overview_fp.tile(tile_rsize, 0, 0, boundary_effect='shrink')
+            prev = BackCachedRasterRecipe(
+                back_ds, facade_proxy,
+                overview_fp, dtype, channel_count, channels_schema, sr,
+                _overview_compute_array, concat_arrays,
+                os.path.join(self.cache_dir, 'overview_x{}'.format(factor)), overwrite,
+                cache_format, cache_verification,
+                _quota_of_level(cache_max_bytes, cache_overviews, factor), cache_eviction, None, (),
+                {'base': prev}, {'base': dict(
+                    channel_ids=tuple(range(channel_count)),
+                    dst_nodata=self.nodata if self.nodata is not None else self.dtype.type(0),
+                    interpolation='cv_area',
+                    max_queue_size=5,
+                    is_flat=False,
+                )}, {'base': lambda fp: fp},
+                None, None, io_pool, resample_pool,
+                overview_tiles, overview_tiles,
+                max_resampling_size,
+                debug_observers,
+            )
+            self.overviews.append(prev)
+        self._overview_uids = {overview.uid for overview in self.overviews}
+
     # ******************************************************************************************* **
     def cache_fps_of_fp(self, fp):
         assert fp.same_grid(self.fp)
@@ -143,6 +307,94 @@ class BackCachedRasterRecipe(ABackRasterRecipe):
             for i in list(self._cache_footprint_index.intersection(bounds))
         ]
 
+    def _put_query(self, q, fps, channel_ids, dst_nodata, interpolation, is_flat, ordered,
+                   parent_uid, key_in_parent):
+        raster = self._raster_of_query(fps, interpolation, parent_uid)
+        if raster is not self:
+            raster._put_query(q, fps, channel_ids, dst_nodata, interpolation, is_flat, ordered,
+                              parent_uid, key_in_parent)
+        else:
+            super()._put_query(q, fps, channel_ids, dst_nodata, interpolation, is_flat, ordered,
+                               parent_uid, key_in_parent)
+
+    def _raster_of_query(self, fps, interpolation, parent_uid):
+        """Select the raster that serves a query, the coarsest overview that is not coarser than
+        the footprints queried and that contains them, or `self`
+        """
+        if not self.overviews or interpolation != 'cv_area' or parent_uid in self._overview_uids:
+            # The overviews can only replace a `cv_area` downsampling. The queries that build
+            # the first overview are served by `self`.
+            return self
+        max_factor = np.inf
+        max_rxy = np.zeros(2)
+        for fp in fps:
+            if fp.share_area(self.fp):
+                max_factor = min(
+                    max_factor, fp.pxsizex / self.fp.pxsizex, fp.pxsizey / self.fp.pxsizey,
+                )
+                rxy = self.fp.spatial_to_raster(fp.coords, dtype=float)
+                max_rxy = np.maximum(max_rxy, np.clip(rxy, 0, self.fp.rsize).max(axis=0))
+        raster = self
+        for factor, overview in zip(self.cache_overviews, self.overviews):
+            if factor > max_factor * (1 + 1e-6):
+                break
+            if np.any(max_rxy > overview.fp.rsize * factor + 1e-6):
+                # The query reaches the pixels at the right or bottom edge of `self` that are not
+                # in this overview
+                break
+            raster = overview
+        return raster
+
+    def cache_fps_of_geometry(self, geom):
+        """List the cache tiles whose interior intersects `geom`"""
+        if geom.is_empty:
+            return []
+        minx, miny, maxx, maxy = geom.bounds
+        corners = self.fp.spatial_to_raster(
+            [[minx, miny], [minx, maxy], [maxx, miny], [maxx, maxy]], dtype=float,
+        )
+        bounds = np.r_[corners.min(axis=0), corners.max(axis=0)]
+        cache_fps = [
+            self.cache_fps.flat[i]
+            for i in list(self._cache_footprint_index.intersection(bounds))
+        ]
+        return [
+            cache_fp
+            for cache_fp in cache_fps
+            if geom.intersects(cache_fp.poly) and not geom.touches(cache_fp.poly)
+        ]
+
+    def invalidate(self, geom):
+        cache_fps = self.cache_fps_of_geometry(geom)
+        if cache_fps:
+            self.back_ds.put_message(Msg(
+                f'/Raster{self.uid}/CacheSupervisor', 'invalidate_cache_files', cache_fps,
+            ))
+            for overview in self.overviews:
+                overview.invalidate(geom)
+        return cache_fps
+
+    def warm(self, fps, priority, max_queue_size):
+        cache_fps = []
+        seen = set()
+        for fp in fps:
+            # Same order as the other cache tiles scheduling
+            l = sorted(self.cache_fps_of_geometry(fp.poly), key=lambda fp: (-fp.cy, +fp.cx))
+            for cache_fp in l:
+                if cache_fp not in seen:
+                    seen.add(cache_fp)
+                    cache_fps.append(cache_fp)
+
+        progress = WarmUpProgress(self, len(cache_fps))
+        if cache_fps:
+            self.back_ds.put_message(Msg(
+                f'/Raster{self.uid}/QueriesHandler', 'new_warm_query',
+                cache_fps, priority, max_queue_size, progress,
+            ))
+        else:
+            progress._update(0)
+        return progress
+
     def fname_prefix_of_cache_fp(self, cache_fp):
         y, x = self.indices_of_cache_fp[cache_fp]
         params = np.r_[
@@ -152,18 +404,33 @@ class BackCachedRasterRecipe(ABackRasterRecipe):
         ]
         return "buzz_x{:03d}-y{:03d}_x{:05d}-y{:05d}".format(*params)
 
+    def cache_fp_of_path(self, path):
+        """Inverse of `fname_prefix_of_cache_fp`, returns None if `path` is not the path to a cache
+        file of this raster.
+        """
+        prefix = fname_prefix_of_path(path)
+        if prefix is None:
+            return None
+        x, y = map(int, re.match(r'^buzz_x(\d+)-y(\d+)_', prefix).groups())
+        if y >= self.cache_fps.shape[0] or x >= self.cache_fps.shape[1]:
+            return None
+        cache_fp = self.cache_fps[y, x]
+        if self.fname_prefix_of_cache_fp(cache_fp) != prefix:
+            return None
+        return cache_fp
+
     def list_cache_path_candidates(self, cache_fp=None):
+        """List the cache files of `cache_fp`, or all the cache files if None, according to the
+        cache manifest. Should only be called from the scheduler once the manifest is loaded.
+        """
         if cache_fp is not None:
             prefix = self.fname_prefix_of_cache_fp(cache_fp)
-            s = os.path.join(self.cache_dir, prefix + '_[0123456789abcdef]*.tif') # TODO: Use regex
-            return glob.glob(s)
         else:
-            s = os.path.join(
-                self.cache_dir,
-                 # TODO: Use regex
-                'buzz_x[0-9]*-y[0-9]*_x[0-9]*-y[0-9]*_[0123456789abcdef]*.tif',
-            )
-            return glob.glob(s)
+            prefix = None
+        return (
+            self.cache_manifest.paths(prefix, self.cache_format.suffix) +
+            self.cache_manifest.paths(prefix, fill_marker.SUFFIX)
+        )
 
     def create_actors(self):
         actors = [
@@ -186,6 +453,12 @@ class BackCachedRasterRecipe(ABackRasterRecipe):
             self.debug_mngr.event('object_allocated', a)
         return actors
 
+    def close(self):
+        # Each overview is a primitive of the next one
+        for overview in reversed(self.overviews):
+            overview.close()
+        super().close()
+
     # ******************************************************************************************* **
     def _build_cache_fps_index(self, cache_fps):
         idx = rtree.index.Index()
@@ -200,3 +473,98 @@ class BackCachedRasterRecipe(ABackRasterRecipe):
             bounds = np.r_[rtl, rtl + fp.rsize] + bounds_inset
             idx.insert(i, bounds)
         return idx
+
+def _quota_of_level(cache_max_bytes, cache_overviews, factor):
+    """Share of `cache_max_bytes` of the level of the pyramid of overviews downsampled by `factor`,
+    in proportion to its number of pixels
+    """
+    if cache_max_bytes is None:
+        return None
+    weight = 1 + sum(1 / overview_factor ** 2 for overview_factor in cache_overviews)
+    return max(1, int(cache_max_bytes / (weight * factor ** 2)))
+
+def _overview_compute_array(fp, primitive_fps, primitive_arrays, raster):
+    """`compute_array` of the overviews, the downsampling is performed by the previous level"""
+    return primitive_arrays['base']
+
+def check_cache_key(cache_key, primitives_kwargs):
+    """Raise a TypeError if `cache_key`, or the names and parameters of the primitives, can't be
+    hashed by `_provenance_digest`
+    """
+    _canonical_bytes(cache_key, True)
+    try:
+        _canonical_bytes(primitives_kwargs, False)
+    except TypeError as e:
+        raise TypeError(
+            'The names and parameters of the primitives should be hashable when `cache_key` is '
+            'provided: {}'.format(e)
+        ) from None
+
+def _provenance_digest(cache_key, fp, dtype, channel_count, primitives_back, primitives_kwargs):
+    """Hash of what determines the content of the cache tiles of a recipe: the user-supplied
+    `cache_key`, the raster's attributes, and the provenance of its primitives.
+    """
+    parts = [
+        cache_key,
+        tuple(fp.gt),
+        tuple(fp.rsize),
+        np.dtype(dtype).str,
+        channel_count,
+    ]
+    primitives = {}
+    for name, prim in primitives_back.items():
+        if isinstance(prim, BackCachedRasterRecipe):
+            prim_key = prim.cache_key
+        else:
+            prim_key = None
+        primitives[name] = (prim_key, primitives_kwargs[name])
+    parts.append(primitives)
+    hasher = hashlib.blake2b(digest_size=12)
+    hasher.update(_canonical_bytes(tuple(parts), False))
+    return hasher.hexdigest()
+
+def _canonical_bytes(obj, strict):
+    """Encode `obj` to bytes that only depend on its value, unlike `repr` that may depend on the
+    versions of python and numpy, on numpy's print options or on the memory addresses.
+
+    If `strict`, only str, bytes, int, float and nested tuples of those are accepted. Otherwise
+    None, lists, dicts, slices and ndarrays are accepted too.
+    """
+    if isinstance(obj, str):
+        tag, data = b's', obj.encode('utf-8')
+    elif isinstance(obj, bytes):
+        tag, data = b'b', obj
+    elif isinstance(obj, numbers.Integral):
+        tag, data = b'i', str(int(obj)).encode('ascii')
+    elif isinstance(obj, numbers.Real):
+        tag, data = b'f', float(obj).hex().encode('ascii')
+    elif isinstance(obj, tuple) or (not strict and isinstance(obj, list)):
+        tag, data = b't', b''.join(_canonical_bytes(elt, strict) for elt in obj)
+    elif strict:
+        raise TypeError(
+            '`cache_key` should be a str, a bytes or nested tuples of int, float and str, not {}'.format(
+                type(obj).__name__,
+            )
+        )
+    elif obj is None:
+        tag, data = b'n', b''
+    elif isinstance(obj, np.bool_):
+        tag, data = b'i', str(int(obj)).encode('ascii')
+    elif isinstance(obj, dict):
+        # Sorted by encoded key, the keys may not be comparable
+        items = sorted(
+            (_canonical_bytes(k, False), _canonical_bytes(v, False))
+            for k, v in obj.items()
+        )
+        tag, data = b'd', b''.join(k + v for k, v in items)
+    elif isinstance(obj, slice):
+        tag, data = b'S', _canonical_bytes((obj.start, obj.stop, obj.step), False)
+    elif isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+        tag = b'a'
+        data = (
+            _canonical_bytes((obj.dtype.str, obj.shape), False) +
+            np.ascontiguousarray(obj).tobytes()
+        )
+    else:
+        raise TypeError("Can't hash an object of type {}".format(type(obj).__name__))
+    return tag + len(data).to_bytes(8, 'little') + data
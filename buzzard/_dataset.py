@@ -23,7 +23,8 @@ from buzzard._gdal_mem_raster import GDALMemRaster
 from buzzard._gdal_memory_vector import GDALMemoryVector
 from buzzard._dataset_register import DatasetRegisterMixin
 from buzzard._numpy_raster import NumpyRaster
-from buzzard._cached_raster_recipe import CachedRasterRecipe
+from buzzard._cached_raster_recipe import CachedRasterRecipe, check_cache_key
+from buzzard._actors.cached.cache_format import create_cache_format
 from buzzard._a_pooled_emissary import APooledEmissary
 import buzzard.utils
 
@@ -90,6 +91,12 @@ class Dataset(DatasetRegisterMixin):
         (see :ref:`Sources activation / deactivation` below)
     debug_observers: sequence of object
         Entry points to observe what is happening in the Dataset's sheduler.
+        (see `buzzard.utils.SchedulerProfiler`, `Dataset.scheduler_stats` and
+        `buzzard.utils.ChromeTraceRecorder`)
+    tile_cache_budget: int >= 0
+        Size in bytes of the in-memory LRU cache of the cache tiles of the cached raster recipes.
+        It sits in front of the cache files, the tiles freshly computed or read from disk are
+        kept in memory until the least recently used are evicted. `0` disables it.
 
     Examples
     --------
@@ -302,6 +309,7 @@ class Dataset(DatasetRegisterMixin):
                  allow_interpolation=False,
                  max_active=np.inf,
                  debug_observers=(),
+                 tile_cache_budget=0,
                  **kwargs):
         sr_fallback, kwargs = deprecation_pool.handle_param_renaming_with_kwargs(
             new_name='sr_fallback', old_names={'sr_implicit': '0.4.4'}, context='Dataset.__init__',
@@ -369,6 +377,9 @@ class Dataset(DatasetRegisterMixin):
 
         if max_active < 1: # pragma: no cover
             raise ValueError('`max_active` should be greater than 1')
+        tile_cache_budget = int(tile_cache_budget)
+        if tile_cache_budget < 0: # pragma: no cover
+            raise ValueError('`tile_cache_budget` should be greater than or equal to 0')
 
         allow_interpolation = bool(allow_interpolation)
         allow_none_geometry = bool(allow_none_geometry)
@@ -384,6 +395,7 @@ class Dataset(DatasetRegisterMixin):
             max_active=max_active,
             ds_id=id(self),
             debug_observers=debug_observers,
+            tile_cache_budget=tile_cache_budget,
         )
         super().__init__()
 
@@ -886,7 +898,8 @@ class Dataset(DatasetRegisterMixin):
             ..
 
         If `computation_pool` points to a process pool, the `compute_array` function must be
-        picklable and the `raster` parameter will be None.
+        picklable, the `raster` parameter will be None and the `primitive_arrays` will be
+        read-only.
 
         .. _Computation Tiling:
         Computation Tiling
@@ -939,8 +952,8 @@ class Dataset(DatasetRegisterMixin):
         - a single ndarray of shape (Y, X, C) if one or more channels were computed
             ..
 
-        If `merge_pool` points to a process pool, the `merge_array` function must be picklable and
-        the `raster` parameter will be None.
+        If `merge_pool` points to a process pool, the `merge_array` function must be picklable, the
+        `raster` parameter will be None and the `array_per_fp` will be read-only.
 
         .. _Automatic Remapping:
         Automatic Remapping
@@ -997,6 +1010,10 @@ class Dataset(DatasetRegisterMixin):
         - A *multiprocessing.pool.ThreadPool*, should be the default choice.
         - A *multiprocessing.pool.Pool*, a process pool. Useful for computations that requires the
           GIL or that leaks memory.
+        - A *concurrent.futures.ThreadPoolExecutor* or a *concurrent.futures.ProcessPoolExecutor*,
+          behave like the two above. Useful to share an executor with the rest of an application
+          or to use the `initializer` / `max_tasks_per_child` parameters of the executors. Their
+          number of workers must be given beforehand with `Dataset.pools.set_worker_count`.
         - `None`, to request the scheduler thread to perform the tasks itself. Should be used when
           the computation is very light.
         - A *hashable* (like a *string*), that will map to a pool registered in the *Dataset*. If
@@ -1004,6 +1021,13 @@ class Dataset(DatasetRegisterMixin):
           `multiprocessing.cpu_count()` workers will be automatically instanciated. When the
           Dataset is closed, the pools instanciated that way will be joined.
 
+        The number of jobs launched concurrently by the scheduler on a pool is its number of
+        workers, it can be lowered with `Dataset.pools.set_worker_count`.
+
+        The memory used by the jobs running on a pool can be bounded with
+        `Dataset.pools.set_memory_budget`, and the memory used by the jobs running on all the pools
+        with `Dataset.pools.set_total_memory_budget`.
+
         See Also
         --------
         - :py:meth:`Dataset.create_raster_recipe`: For results `caching`
@@ -1022,7 +1046,9 @@ class Dataset(DatasetRegisterMixin):
             compute_array=None, merge_arrays=buzzard.utils.concat_arrays,
 
             # filesystem
-            cache_dir=None, ow=False,
+            cache_dir=None, ow=False, cache_driver='GTiff', cache_options=None,
+            cache_verification='full', cache_max_bytes=None, cache_eviction='lru', cache_key=None,
+            cache_overviews=None, cache_checksum='blake2b',
 
             # primitives
             queue_data_per_primitive=MappingProxyType({}), convert_footprint_per_primitive=None,
@@ -1076,6 +1102,86 @@ class Dataset(DatasetRegisterMixin):
                 not only the tiles needed (hence computed) but all buzzard cache files in
                 `cache_dir` will be deleted.
 
+        cache_driver: str
+            Format of the cache files, either:
+
+            - The name of a GDAL raster driver that can create files (e.g. `'GTiff'`, the default)
+            - `'npy'`: Raw numpy arrays, memory mapped when read. Fastest to read, but larger on
+              disk and not readable by GIS software. When a production array is exactly one cache
+              tile, it is a copy-on-write memory map of the cache file.
+        cache_options: None or sequence of str
+            Creation options of the cache files for the GDAL driver
+            (e.g. `['TILED=YES', 'COMPRESS=ZSTD', 'PREDICTOR=2']`).
+            If None and `cache_driver` is `'GTiff'`, the cache files are created with
+            `['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'SPARSE_OK=TRUE']`.
+            Should be None or empty with the `'npy'` driver.
+        cache_verification: str
+            How the cache files found in `cache_dir` are checked before being used, one of:
+
+            - `'full'`: The checksum and the header of each file are checked before it is first
+              read. The default.
+            - `'metadata'`: Only the size and the header of each file are checked. Much faster
+              to open a large cache, but corruptions of the pixels go unnoticed.
+            - `'lazy'`: The files are served right away, their checksum and header are checked
+              later by background jobs when the `io_pool` (or the scheduler if there is no
+              `io_pool`) has nothing else to do. A corrupted file is then evicted, the
+              queries that were already reading it may receive corrupted pixels.
+        cache_max_bytes: None or int
+            Maximum size in bytes of the cache files of this recipe in `cache_dir`. When a new
+            cache file makes them exceed it, the coldest ones are removed (according to
+            `cache_eviction`). The cache files needed by the ongoing queries are never removed,
+            so they may temporarily exceed this size. The files of the other recipes sharing
+            `cache_dir`, and the ones that can't be verified in this environment, are neither
+            counted nor removed. If None, the cache files are never removed.
+        cache_eviction: str
+            Order in which the cache files are removed when `cache_max_bytes` is exceeded, one of:
+
+            - `'lru'`: The least recently used first. The default.
+            - `'lfu'`: The least frequently used first, the least recently used first in case of
+              tie.
+
+            The cache files not used since the recipe was created are removed first, the oldest
+            first.
+        cache_key: None or str or bytes or nested tuple of int, float and str
+            Version of the recipe (e.g. `'v2'` or `('my_model', 3, threshold)`), it should change
+            when the code or the parameters of `compute_array` change.
+
+            If provided, the cache files are stored in a sub-directory of `cache_dir` named after
+            a hash of `cache_key`, of the raster's footprint, dtype and channel count, and of the
+            `cache_key` of the primitives that are cached raster recipes. Several versions of a
+            recipe can then share the same `cache_dir` without reading each other's cache files,
+            and `ow=True` only removes the cache files of this version.
+            (see `CachedRasterRecipe.cache_key` and `CachedRasterRecipe.cache_dir`)
+
+        cache_overviews: None or sequence of int
+            Downsampling factors of a pyramid of overviews (e.g. `(2, 4, 8, 16)`), each factor
+            should be a multiple of the previous one. Requires `allow_interpolation=True`.
+
+            Each overview is a cache of the raster at a coarser resolution, stored in a
+            `overview_x<factor>` sub-directory of `cache_dir`. It is built lazily with a
+            `'cv_area'` downsampling of the previous level, and updated by
+            `CachedRasterRecipe.invalidate`.
+
+            A query with `interpolation='cv_area'` (the default) is served from the coarsest
+            overview that is not coarser than the footprints queried, instead of downsampling the
+            full resolution cache tiles. The results are then slightly different at the
+            boundaries of the overviews' pixels.
+
+            An overview only contains the pixels entirely inside of the raster, the queries that
+            reach its last partial row or column of pixels are served by a finer level.
+
+            If `cache_max_bytes` is provided, it is shared between the raster and its overviews in
+            proportion to their number of pixels.
+        cache_checksum: str
+            Algorithm of the checksums stored in the names of the new cache files, one of:
+
+            - `'blake2b'`: From the standard library. The default.
+            - `'xxh3'`: Much faster, requires the `xxhash` package in all the environments that
+              use `cache_dir`.
+
+            The cache files written with another algorithm are still read. A cache file whose
+            checksum can't be computed in this environment is neither read nor removed, its cache
+            tile is computed again.
         queue_data_per_primitive:
             see :py:meth:`Dataset.create_raster_recipe` method
         convert_footprint_per_primitive:
@@ -1227,13 +1333,42 @@ class Dataset(DatasetRegisterMixin):
         cache_dir = str(cache_dir)
         overwrite = bool(ow)
         del ow
+        if cache_options is not None:
+            cache_options = [str(arg) for arg in cache_options]
+        cache_format = create_cache_format(str(cache_driver), cache_options, str(cache_checksum))
+        if cache_verification not in {'full', 'metadata', 'lazy'}:
+            raise ValueError('`cache_verification` should be one of `full`, `metadata` or `lazy`')
+        if cache_max_bytes is not None:
+            cache_max_bytes = int(cache_max_bytes)
+            if cache_max_bytes <= 0:
+                raise ValueError('`cache_max_bytes` should be >0')
+        if cache_eviction not in {'lru', 'lfu'}:
+            raise ValueError('`cache_eviction` should be one of `lru` or `lfu`')
+        if cache_key is not None:
+            check_cache_key(cache_key, primitives_kwargs)
+        if cache_overviews is None:
+            cache_overviews = ()
+        cache_overviews = tuple(int(factor) for factor in cache_overviews)
+        prev_factor = 1
+        for factor in cache_overviews:
+            if factor <= prev_factor or factor % prev_factor != 0:
+                raise ValueError(
+                    '`cache_overviews` should be increasing factors >1, each one a multiple of the '
+                    'previous one'
+                )
+            prev_factor = factor
+        if cache_overviews and cache_overviews[-1] > min(fp.rsize):
+            raise ValueError('`cache_overviews` should not be greater than the size of `fp`')
+        if cache_overviews and not self._back.allow_interpolation:
+            raise ValueError('`cache_overviews` requires `allow_interpolation=True`')
 
         # Construction *********************************************************
         prox = CachedRasterRecipe(
             self,
             fp, dtype, channel_count, channels_schema, wkt,
             compute_array, merge_arrays,
-            cache_dir, overwrite,
+            cache_dir, overwrite, cache_format, cache_verification,
+            cache_max_bytes, cache_eviction, cache_key, cache_overviews,
             primitives_back, primitives_kwargs, convert_footprint_per_primitive,
             computation_pool, merge_pool, io_pool, resample_pool,
             cache_tiles, computation_tiles,
@@ -1258,7 +1393,9 @@ class Dataset(DatasetRegisterMixin):
             compute_array=None, merge_arrays=buzzard.utils.concat_arrays,
 
             # filesystem
-            cache_dir=None, ow=False,
+            cache_dir=None, ow=False, cache_driver='GTiff', cache_options=None,
+            cache_verification='full', cache_max_bytes=None, cache_eviction='lru', cache_key=None,
+            cache_overviews=None, cache_checksum='blake2b',
 
             # primitives
             queue_data_per_primitive=MappingProxyType({}), convert_footprint_per_primitive=None,
@@ -1284,7 +1421,8 @@ class Dataset(DatasetRegisterMixin):
             _AnonymousSentry(),
             fp, dtype, channel_count, channels_schema, sr,
             compute_array, merge_arrays,
-            cache_dir, ow,
+            cache_dir, ow, cache_driver, cache_options, cache_verification,
+            cache_max_bytes, cache_eviction, cache_key, cache_overviews, cache_checksum,
             queue_data_per_primitive, convert_footprint_per_primitive,
             computation_pool, merge_pool, io_pool, resample_pool,
             cache_tiles, computation_tiles, max_resampling_size,
@@ -1722,6 +1860,27 @@ class Dataset(DatasetRegisterMixin):
         """
         return self._back.pools_container
 
+    # Scheduler infos *************************************************************************** **
+    def scheduler_stats(self):
+        """Get a snapshot of the time spent by the Dataset's scheduler in each actor.
+
+        Requires a `buzzard.utils.SchedulerProfiler` in the `debug_observers` parameter of the
+        Dataset, the scheduler does not time the messages otherwise.
+
+        Returns
+        -------
+        dict of (str, str) to buzzard.utils.MessageStats
+            Mapping from `(actor class name, message title)` to statistics
+
+        Example
+        -------
+        >>> ds = buzz.Dataset(debug_observers=[buzz.utils.SchedulerProfiler()])
+        ... # code...
+        ... stats = ds.scheduler_stats()
+
+        """
+        return self._back.scheduler_stats()
+
     # Deprecation ******************************************************************************* **
     open_araster = deprecation_pool.wrap_method(
         aopen_raster,
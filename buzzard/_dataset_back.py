@@ -1,11 +1,13 @@
 from buzzard._dataset_back_conversions import BackDatasetConversionsMixin
 from buzzard._dataset_back_activation_pool import BackDatasetActivationPoolMixin
 from buzzard._dataset_back_scheduler import BackDatasetSchedulerMixin
+from buzzard._dataset_back_tile_cache import BackDatasetTileCacheMixin
 from buzzard._dataset_pools_container import PoolsContainer
 
 class BackDataset(BackDatasetConversionsMixin,
                      BackDatasetActivationPoolMixin,
-                     BackDatasetSchedulerMixin):
+                     BackDatasetSchedulerMixin,
+                     BackDatasetTileCacheMixin):
     """Backend of the Dataset, referenced by backend proxies
     Implements activation (pooling) and conversion methods"""
 
@@ -1,21 +1,31 @@
 import collections
-import time
+import itertools
 import threading
-import datetime
+import time
+import weakref
 
 from buzzard._actors.top_level import ActorTopLevel
 from buzzard._actors.message import Msg, DroppableMsg, AgingMsg
 from buzzard._debug_observers_manager import DebugObserversManager
+from buzzard.utils._scheduler_profiler import SchedulerProfiler, perf_counter_ns
 
 VERBOSE = 0
 
+# Upper bound on the time the scheduler stays asleep when nothing notified it. Everything that can
+# unblock the scheduler (new external message, pool job completion, output queue consumption,
+# output queue collection) wakes it up explicitly, this is only a safety net.
+MAX_IDLE_DURATION = 1
+
 class BackDatasetSchedulerMixin:
     """TODO: docstring"""
 
     def __init__(self, ds_id, debug_observers, **kwargs):
-        self._ext_message_to_scheduler_queue = []
+        self._ext_message_to_scheduler_queue = collections.deque()
+        self._wakeup_event = threading.Event()
         self._thread = None
         self._thread_exn = None
+        self._thread_exited = False
+        self._exit_listeners = weakref.WeakSet()
         self._ds_id = ds_id
         self._stop = False
         self._debug_mngr = DebugObserversManager(debug_observers)
@@ -35,7 +45,7 @@ class BackDatasetSchedulerMixin:
             self.ensure_scheduler_still_alive()
 
     def ensure_scheduler_still_alive(self):
-        if not self._thread.is_alive():
+        if self._thread_exited or not self._thread.is_alive():
             if isinstance(self._thread_exn, Exception):
                 raise self._thread_exn
             else:
@@ -43,15 +53,43 @@ class BackDatasetSchedulerMixin:
                     "Dataset's scheduler crashed without exception. Did you call `exit()`?"
                 )
 
+    def notify_on_scheduler_exit(self, listener):
+        """Call `listener.scheduler_exited()` from the scheduler's thread when it exits, for those
+        who wait for the scheduler without polling `ensure_scheduler_still_alive`. Only a weak
+        reference to `listener` is kept.
+        """
+        self._exit_listeners.add(listener)
+
     def put_message(self, msg, check_scheduler_status=True):
         if check_scheduler_status:
             self.ensure_scheduler_living()
 
-        # a list is thread-safe: https://stackoverflow.com/a/6319267/4952173
+        # a deque is thread-safe: https://docs.python.org/3/library/collections.html#collections.deque
         self._ext_message_to_scheduler_queue.append(msg)
+        self._wakeup_event.set()
+
+    def wakeup_scheduler(self, *_):
+        """Notify the scheduler that something happened outside of its thread (e.g. a pool job
+        finished or an output queue was consumed). Thread-safe, can be called from anywhere.
+
+        Extra positional parameters are ignored, this allows this method to be used as a
+        `weakref.ref` callback or as a pool callback.
+        """
+        self._wakeup_event.set()
+
+    def scheduler_stats(self):
+        """Snapshot of the first `SchedulerProfiler` among the debug observers"""
+        profilers = self._debug_mngr.find_observers(SchedulerProfiler)
+        if not profilers:
+            raise RuntimeError(
+                'No scheduler statistics available, pass a `buzzard.utils.SchedulerProfiler` '
+                'in the `debug_observers` parameter of the Dataset'
+            )
+        return profilers[0].snapshot()
 
     def stop_scheduler(self):
         self._stop = True
+        self._wakeup_event.set()
         if self._thread is not None:
             self._thread.join()
 
@@ -66,6 +104,10 @@ class BackDatasetSchedulerMixin:
         except Exception as e:
             self._thread_exn = e
             raise
+        finally:
+            self._thread_exited = True
+            for listener in list(self._exit_listeners):
+                listener.scheduler_exited()
 
     def _scheduler_loop_until_dataset_close(self):
         """This is the entry point of a Dataset's scheduler.
@@ -77,141 +119,225 @@ class BackDatasetSchedulerMixin:
         def _register_actor(a):
             if hasattr(a, 'ext_receive_nothing'):
                 keep_alive_actors.append(a)
+            if getattr(a, 'batching', False):
+                batching_actors.append(a)
 
             address = a.address
-
             _, grp_name, name = address.split('/')
-            assert name not in actors[grp_name]
-            actors[grp_name][name] = a
-
-        def _find_actors(address, relative_actor):
-            names = address.split('/')
-            if len(names) == 3:
-                if names[1] == 'Pool*':
-                    return [
-                        v[names[2]]
-                        for k, v in actors.items()
-                        if k.startswith('Pool')
-                    ]
-                else:
-                    return [actors[names[1]].get(names[2])]
-            elif len(names) == 1:
-                grp_name = relative_actor.address.split('/')[1]
-                return [actors[grp_name].get(names[0])]
-            else: # pragma: no cover
-                assert False
+            group_routes = routes_of_group[grp_name]
+            assert name not in group_routes
+            route = (a,)
+            group_routes[name] = route
+            route_of_address[address] = route
+            relative_routes_of_actor[a] = group_routes
+            if grp_name.startswith('Pool'):
+                broadcast_address = '/Pool*/' + name
+                route_of_broadcast_address[broadcast_address] = (
+                    route_of_broadcast_address.get(broadcast_address, ()) + route
+                )
+
+        def _find_actors(address, relative_routes):
+            """Resolve an address to a tuple of actors, a missing actor is represented by `None`
+
+            Parameters
+            ----------
+            address: str
+                Absolute address (e.g. `/Global/TopLevel`, `/Pool*/WaitingRoom`) or relative
+                address (e.g. `Producer`)
+            relative_routes: None or dict of str to tuple of Actor
+                Routes of the group of the actor that sent the message
+            """
+            if address[0] == '/':
+                route = route_of_address.get(address)
+                if route is not None:
+                    return route
+                if address.startswith('/Pool*/'):
+                    return route_of_broadcast_address.get(address, ())
+                return _MISSING_ROUTE
+            return relative_routes.get(address, _MISSING_ROUTE)
 
         def _unregister_actor(a):
             address = a.address
             _, grp_name, name = address.split('/')
-            del actors[grp_name][name]
-            if not actors[grp_name]:
-                del actors[grp_name]
+            group_routes = routes_of_group[grp_name]
+            del group_routes[name]
+            if not group_routes:
+                del routes_of_group[grp_name]
+            del route_of_address[address]
+            del relative_routes_of_actor[a]
+            if grp_name.startswith('Pool'):
+                broadcast_address = '/Pool*/' + name
+                route_of_broadcast_address[broadcast_address] = tuple(
+                    b
+                    for b in route_of_broadcast_address[broadcast_address]
+                    if b is not a
+                )
             if hasattr(a, 'ext_receive_nothing'):
                 keep_alive_actors.remove(a)
-
-        # Dicts of actors
-        actors = collections.defaultdict(dict) # type: Mapping[str, Mapping[str, Actor]]
+            if getattr(a, 'batching', False):
+                batching_actors.remove(a)
+
+        # Routing tables, updated on actor registration/unregistration so that resolving an address
+        # is a single dict lookup. The values are tuples of actors that can be iterated upon even if
+        # the tables are updated in the meantime.
+        # - Absolute address to actor
+        route_of_address = {} # type: Mapping[str, Tuple[Actor]]
+        # - Group name (e.g. `Raster<uid>`, `Pool<id>`) to actor name to actor
+        routes_of_group = collections.defaultdict(dict) # type: Mapping[str, Mapping[str, Tuple[Actor]]]
+        # - Actor to the routes of its group, to resolve relative addresses
+        relative_routes_of_actor = {} # type: Mapping[Actor, Mapping[str, Tuple[Actor]]]
+        # - `/Pool*/<name>` address to all the actors called `<name>` in the `Pool*` groups
+        route_of_broadcast_address = {} # type: Mapping[str, Tuple[Actor, ...]]
 
         # List of actors that need to be kept alive with calls to `ext_receive_nothing`
         # `keep_alive_iterator` should never be iterated if `keep_alive_actors` is empty
         keep_alive_actors = []
         keep_alive_iterator = _cycle_list(keep_alive_actors)
 
-        # Stack of pending messages
-        piles_of_msgs = [] # type: List[Tuple[Actor, List[Union[Msg, Actor]]]]
+        # List of actors that launch jobs by batches, whose `batch_deadline` is checked on each
+        # iteration
+        batching_actors = []
+
+        def _push_pile(routes, title_prefix, msgs):
+            """Stack a pile of messages emitted by an actor of the group that owns `routes`"""
+            for msg in msgs:
+                if isinstance(msg, AgingMsg):
+                    key = (
+                        _find_actors(msg.address, routes), title_prefix + msg.title, msg.id_args,
+                    )
+                    stamp_of_aging_msg[msg] = (key, next(generation_counter))
+                    if key in aging_msgs_of_key:
+                        aging_msgs_of_key[key][1] += 1
+                    else:
+                        aging_msgs_of_key[key] = [-1, 1]
+            piles_of_msgs.append((routes, title_prefix, collections.deque(msgs)))
+
+        def _is_stale(msg):
+            """Pop the stamp of an `AgingMsg`, it is stale if a more recent one was already
+            delivered to the same method with the same `id_args`.
+            """
+            key, generation = stamp_of_aging_msg.pop(msg)
+            state = aging_msgs_of_key[key]
+            stale = generation < state[0]
+            if not stale:
+                state[0] = generation
+            state[1] -= 1
+            if state[1] == 0:
+                # No message with this key is pending, the next ones will all be more recent
+                del aging_msgs_of_key[key]
+            return stale
+
+        # Stack of pending messages, along with the routes of their sender's group
+        piles_of_msgs = [] # type: List[Tuple[Mapping[str, Tuple[Actor]], str, Deque[Union[Msg, Actor]]]]
+
+        # Structures that track stale messages, updated incrementally
+        # - Generation of each `AgingMsg` pending, along with its key
+        #   `(destination, title_prefix + title, id_args)`
+        stamp_of_aging_msg = {} # type: Mapping[AgingMsg, Tuple[Tuple, int]]
+        # - Latest generation delivered and number of messages pending, per key
+        aging_msgs_of_key = {} # type: Mapping[Tuple, List[int]]
+        generation_counter = itertools.count()
+
+        # Timing each message is only worth it if someone is listening
+        message_passed_observed = self._debug_mngr.is_observed('message_passed')
+        message_passed_ns_observed = self._debug_mngr.is_observed('message_passed_ns')
+        message_timed = message_passed_observed or message_passed_ns_observed
+
+        def _message_passed(actor_class_name, title, delta_ns):
+            if message_passed_ns_observed:
+                self._debug_mngr.event('message_passed_ns', actor_class_name, title, delta_ns)
+            if message_passed_observed:
+                self._debug_mngr.event('message_passed', actor_class_name, title, delta_ns / 1e9)
 
         # Instantiate and register the top level actor
-        top_level_actor = ActorTopLevel()
+        top_level_actor = ActorTopLevel(
+            self.wakeup_scheduler, self._debug_mngr, self.pools_container,
+        )
         _register_actor(top_level_actor)
-        piles_of_msgs.append(
-            (top_level_actor, 'ext_receive_', top_level_actor.ext_receive_prime()),
+        _push_pile(
+            relative_routes_of_actor[top_level_actor],
+            'ext_receive_',
+            top_level_actor.ext_receive_prime(),
         )
 
         while True:
-            # Step 0: Init stuctures that track stale messages
-            idx_per_msg = {}
-            msgidx_of_prev_methodcall = {}
-            for _, _, msgs in piles_of_msgs:
-                for msg in msgs:
-                    if isinstance(msg, AgingMsg):
-                        idx_per_msg[msg] = len(idx_per_msg)
-
             # Step 1: Process all messages on flight
             while piles_of_msgs:
-                src_actor, title_prefix, msgs = piles_of_msgs[-1]
+                src_routes, title_prefix, msgs = piles_of_msgs[-1]
                 if not msgs:
                     del piles_of_msgs[-1]
                     continue
-                msg = msgs.pop(0)
+                msg = msgs.popleft()
                 if isinstance(msg, Msg):
-                    is_aging = isinstance(msg, AgingMsg)
                     if VERBOSE:
                         print('{} {}'.format(
                             ' '.join(['|'] * (len(piles_of_msgs))),
                             msg,
                         ))
 
-                    for dst_actor in _find_actors(msg.address, src_actor):
+                    # Check if stale message
+                    if isinstance(msg, AgingMsg) and _is_stale(msg):
+                        if VERBOSE:
+                            print('    Skipping stale message')
+                        continue
+
+                    for dst_actor in _find_actors(msg.address, src_routes):
                         if dst_actor is None:
                             # This message may be discadted if DroppableMsg
                             assert isinstance(msg, DroppableMsg), f'\ndst_actor: {dst_actor}\n      msg: {msg}\n'
                         else:
-                            a = datetime.datetime.now()
                             met = getattr(dst_actor, title_prefix + msg.title)
 
-                            # Check if stale message
-                            if is_aging:
-                                msg_idx = idx_per_msg[msg]
-                                if (met, msg.id_args) in msgidx_of_prev_methodcall:
-                                    prev_msg_idx = msgidx_of_prev_methodcall[(met, msg.id_args)]
-                                    if prev_msg_idx > msg_idx:
-                                        if VERBOSE:
-                                            print('    Skipping stale message')
-                                        continue
-                                msgidx_of_prev_methodcall[(met, msg.id_args)] = msg_idx
-
                             # Dispatch message and retrieve new ones
-                            new_msgs = met(*msg.args)
-                            b = datetime.datetime.now()
-                            delta = (b - a).total_seconds()
-                            self._debug_mngr.event('message_passed', dst_actor.__class__.__name__, msg.title, delta)
+                            if message_timed:
+                                a = perf_counter_ns()
+                                new_msgs = met(*msg.args)
+                                _message_passed(dst_actor.__class__.__name__, msg.title, perf_counter_ns() - a)
+                            else:
+                                new_msgs = met(*msg.args)
                             if self._stop:
-                                # Dataset is closing. This is the same as `step 5`. (optimisation purposes)
+                                # Dataset is closing. This is the same as `step 6`. (optimisation purposes)
                                 return
+                            dst_routes = relative_routes_of_actor[dst_actor]
                             if not dst_actor.alive:
                                 # Actor is closing
                                 _unregister_actor(dst_actor)
                             if new_msgs:
-                                # Update stale messages index
-                                for new_msg in new_msgs:
-                                    if isinstance(new_msg, AgingMsg):
-                                        idx_per_msg[new_msg] = len(idx_per_msg)
-
                                 # Message need to be sent
-                                piles_of_msgs.append((
-                                    dst_actor, 'receive_', new_msgs
-                                ))
+                                _push_pile(dst_routes, 'receive_', new_msgs)
                 else:
                     _register_actor(msg)
                 del msg
-            src_actor = None
+            src_routes = None
+            dst_routes = None
             msgs = None
             msg = None
             dst_actor = None
             new_msgs = None
 
             # Step 2: Receive external messages
-            # a list is thread-safe: https://stackoverflow.com/a/6319267/4952173
+            # a deque is thread-safe: https://docs.python.org/3/library/collections.html#collections.deque
             if self._ext_message_to_scheduler_queue:
-                msg = self._ext_message_to_scheduler_queue.pop(0)
+                msg = self._ext_message_to_scheduler_queue.popleft()
                 dst_actor, = _find_actors(msg.address, None)
-                piles_of_msgs.append((
-                    dst_actor, 'ext_receive_', [msg]
-                ))
+                _push_pile(relative_routes_of_actor.get(dst_actor), 'ext_receive_', [msg])
                 msg = None
+                dst_actor = None
+
+            # Step 3: Launch the batches of jobs whose first job waited long enough, even if the
+            #   scheduler is too busy to reach step 4
+            if batching_actors:
+                now = time.monotonic()
+                for actor in batching_actors:
+                    deadline = actor.batch_deadline
+                    if deadline is not None and now >= deadline:
+                        new_msgs = actor.ext_receive_batch_deadline_passed()
+                        if new_msgs:
+                            _push_pile(relative_routes_of_actor[actor], 'receive_', new_msgs)
+                actor = None
+                new_msgs = None
 
-            # Step 3: If no messages from phase 2 and some `keep_alive_actors`
+            # Step 4: If no messages from phases 2 and 3 and some `keep_alive_actors`
             #   Find "keep alive" actors that need to be closed
             #   Find a "keep alive" actor that has messages to send
             if keep_alive_actors and not piles_of_msgs:
@@ -219,14 +345,15 @@ class BackDatasetSchedulerMixin:
                 for actor, _ in zip(keep_alive_iterator, range(len(keep_alive_actors))):
                     # Iter at most once on each "keep alive" actor
 
-                    a = datetime.datetime.now()
-                    new_msgs = actor.ext_receive_nothing()
-                    b = datetime.datetime.now()
-                    delta = (b - a).total_seconds()
-                    self._debug_mngr.event('message_passed', actor.__class__.__name__, 'nothing', delta)
+                    if message_timed:
+                        a = perf_counter_ns()
+                        new_msgs = actor.ext_receive_nothing()
+                        _message_passed(actor.__class__.__name__, 'nothing', perf_counter_ns() - a)
+                    else:
+                        new_msgs = actor.ext_receive_nothing()
 
                     if self._stop:
-                        # Dataset is closing. This is the same as `step 5`. (optimisation purposes)
+                        # Dataset is closing. This is the same as `step 6`. (optimisation purposes)
                         return
                     if not actor.alive:
                         # Actor is closing
@@ -236,9 +363,7 @@ class BackDatasetSchedulerMixin:
                         if VERBOSE:
                             print(Msg(actor.address, 'receive_nothing'))
 
-                        piles_of_msgs.append((
-                            actor, 'receive_', new_msgs
-                        ))
+                        _push_pile(relative_routes_of_actor[actor], 'receive_', new_msgs)
                         break
                 for actor in actors_to_remove:
                     _unregister_actor(actor)
@@ -246,17 +371,22 @@ class BackDatasetSchedulerMixin:
                 new_msgs = None
                 actor = None
 
-            # Step 4: If no messages from phase 2 nor from phase 3
-            #   Sleep
+            # Step 5: If no messages from phases 2, 3 nor 4
+            #   Sleep until something happens outside of the scheduler.
+            #   The event is cleared before steps 2 to 4 of the next iteration, so that a
+            #   notification received while polling is never lost.
             if not piles_of_msgs:
                 self._debug_mngr.event('scheduler_activity_update', False)
-                time.sleep(1 / 20) # TODO: Set a better sleep time / make it parameterizable
+                self._wakeup_event.wait(MAX_IDLE_DURATION)
+                self._wakeup_event.clear()
                 self._debug_mngr.event('scheduler_activity_update', True)
 
-            # Step 5: Check if Dataset was collected
+            # Step 6: Check if Dataset was collected
             if self._stop:
                 return
 
+_MISSING_ROUTE = (None,)
+
 def _cycle_list(l):
     """Loop in a list forever, even if its size changes. Error if empty."""
     i = -1
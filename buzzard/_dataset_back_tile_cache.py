@@ -0,0 +1,86 @@
+import collections
+import threading
+
+class BackDatasetTileCacheMixin:
+    """Private mixin for the Dataset class containing the in-memory LRU cache of the cache tiles of
+    the cached raster recipes.
+
+    It sits in front of the cache files, the tiles are keyed by `(raster uid, cache_fp)`:
+    - the `Writer` actors insert the tiles they just computed,
+    - the `Reader` actors insert the tiles they read from disk,
+    - the `CacheExtractor` actors look it up before scheduling a read.
+
+    The arrays stored are read-only, the least recently used ones are dropped when the sum of their
+    sizes exceeds `tile_cache_budget`. A budget of 0 disables this cache.
+    """
+
+    def __init__(self, tile_cache_budget, **kwargs):
+        self.tile_cache_budget = tile_cache_budget
+        self._tc_lock = threading.Lock()
+        self._tc_arrays = collections.OrderedDict() # type: Mapping[Tuple[uuid.UUID, Footprint], np.ndarray]
+        self._tc_nbytes = 0
+        super().__init__(**kwargs)
+
+    def tile_cache_accepts(self, nbytes):
+        """Would a tile of `nbytes` bytes fit in the tile cache"""
+        return 0 < nbytes <= self.tile_cache_budget
+
+    def tile_cache_get(self, raster_uid, cache_fp):
+        """Retrieve a cache tile and mark it as the most recently used, or None if absent"""
+        key = (raster_uid, cache_fp)
+        with self._tc_lock:
+            arr = self._tc_arrays.get(key)
+            if arr is not None:
+                self._tc_arrays.move_to_end(key)
+            return arr
+
+    def tile_cache_put(self, raster_uid, cache_fp, arr, copy=False):
+        """Insert a cache tile, evict the least recently used tiles if necessary
+
+        Parameters
+        ----------
+        raster_uid: uuid.UUID
+        cache_fp: Footprint
+        arr: np.ndarray
+            Should be the full cache tile, with all the channels of the raster
+        copy: bool
+            Whether or not to store a copy of `arr`, should be True if `arr` might be modified
+            afterward
+        """
+        if not self.tile_cache_accepts(arr.nbytes):
+            return
+        arr = arr.copy() if copy else arr.view()
+        arr.flags.writeable = False
+        key = (raster_uid, cache_fp)
+        with self._tc_lock:
+            old = self._tc_arrays.pop(key, None)
+            if old is not None:
+                self._tc_nbytes -= old.nbytes
+            self._tc_arrays[key] = arr
+            self._tc_nbytes += arr.nbytes
+            while self._tc_nbytes > self.tile_cache_budget:
+                _, old = self._tc_arrays.popitem(last=False)
+                self._tc_nbytes -= old.nbytes
+
+    def tile_cache_discard(self, raster_uid, cache_fp):
+        """Drop a cache tile if present"""
+        with self._tc_lock:
+            old = self._tc_arrays.pop((raster_uid, cache_fp), None)
+            if old is not None:
+                self._tc_nbytes -= old.nbytes
+
+    def tile_cache_discard_raster(self, raster_uid):
+        """Drop all the cache tiles of a raster"""
+        with self._tc_lock:
+            keys = [
+                key
+                for key in self._tc_arrays.keys()
+                if key[0] == raster_uid
+            ]
+            for key in keys:
+                self._tc_nbytes -= self._tc_arrays.pop(key).nbytes
+
+    def tile_cache_nbytes(self):
+        """Sum of the sizes of the cache tiles in the tile cache"""
+        with self._tc_lock:
+            return self._tc_nbytes
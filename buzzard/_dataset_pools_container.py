@@ -1,7 +1,11 @@
+import sys
 import threading
 import collections
 import multiprocessing as mp
 import multiprocessing.pool
+import concurrent.futures as cf
+
+POOL_TYPES = (mp.pool.Pool, cf.ThreadPoolExecutor, cf.ProcessPoolExecutor)
 
 class PoolsContainer:
     """Manages thread/process pools and aliases for a Dataset"""
@@ -10,6 +14,11 @@ class PoolsContainer:
         self._aliases_per_pool = collections.defaultdict(set)
         self._aliases = {}
         self._managed_pools = set()
+        self._worker_count_of_pool = {}
+        self._memory_budget_of_pool = {}
+        self._adaptive_pools = set()
+        self._job_batching_of_pool = {}
+        self._total_memory_budget = None
         self._lock = threading.Lock()
 
     def alias(self, key, pool_or_none):
@@ -20,7 +29,7 @@ class PoolsContainer:
         ----------
         key: hashable (like a string)
             ..
-        pool_or_none: multiprocessing.pool.Pool or multiprocessing.pool.ThreadPool or None
+        pool_or_none: multiprocessing.pool.Pool or multiprocessing.pool.ThreadPool or concurrent.futures.ThreadPoolExecutor or concurrent.futures.ProcessPoolExecutor or None
             ..
         """
         with self._lock:
@@ -36,15 +45,203 @@ class PoolsContainer:
 
         Parameters
         ----------
-        pool: multiprocessing.pool.Pool or multiprocessing.pool.ThreadPool
+        pool: multiprocessing.pool.Pool or multiprocessing.pool.ThreadPool or concurrent.futures.ThreadPoolExecutor or concurrent.futures.ProcessPoolExecutor
             ..
 
         """
-        if not isinstance(pool, (mp.pool.Pool, mp.pool.ThreadPool)): # pragma: no cover
+        if not isinstance(pool, POOL_TYPES): # pragma: no cover
             raise TypeError('Can only manage pools')
         with self._lock:
             self._managed_pools.add(pool)
 
+    def set_worker_count(self, pool, worker_count):
+        """Set the number of workers of the given pool, i.e. the number of jobs that the
+        scheduler runs concurrently on that pool. Should be called before creating the first
+        raster that uses the pool.
+
+        Required for the `concurrent.futures` executors, they do not expose their number of
+        workers publicly. It may also be lower than the actual number of workers when an executor
+        is shared with other components of an application. If not set, the number of workers of a
+        `multiprocessing.pool.Pool` is read from its `processes` parameter.
+
+        Parameters
+        ----------
+        pool: multiprocessing.pool.Pool or multiprocessing.pool.ThreadPool or concurrent.futures.ThreadPoolExecutor or concurrent.futures.ProcessPoolExecutor
+            ..
+        worker_count: int
+            ..
+
+        """
+        if not isinstance(pool, POOL_TYPES): # pragma: no cover
+            raise TypeError('Can only size pools')
+        worker_count = int(worker_count)
+        if worker_count <= 0: # pragma: no cover
+            raise ValueError('`worker_count` should be >0')
+        with self._lock:
+            self._worker_count_of_pool[pool] = worker_count
+
+    def worker_count(self, pool):
+        """Get the number of workers of the given pool, see `set_worker_count`
+
+        Parameters
+        ----------
+        pool: multiprocessing.pool.Pool or multiprocessing.pool.ThreadPool or concurrent.futures.ThreadPoolExecutor or concurrent.futures.ProcessPoolExecutor
+            ..
+
+        Returns
+        -------
+        int
+        """
+        with self._lock:
+            if pool in self._worker_count_of_pool:
+                return self._worker_count_of_pool[pool]
+        if isinstance(pool, mp.pool.Pool):
+            return pool._processes
+        raise ValueError('The number of workers of {} is unknown'.format(pool)) # pragma: no cover
+
+    def set_adaptive_token_count(self, pool, adaptive=True):
+        """Let the scheduler choose how many jobs to launch on the given pool, in excess of its
+        number of workers, from the measured timings of the jobs. Should be called before creating
+        the first raster that uses the pool.
+
+        By default a fixed number of jobs in excess are launched to hide the latency of the
+        scheduler between the end of a job and the launch of the next one. This may not be enough
+        for a pool that runs a lot of short IO bound jobs, or too much for a pool that runs long
+        CPU bound jobs (the jobs waiting in the pool's internal queue can't be reprioritized).
+
+        The values chosen are reported to the `on_pool_token_count_update` method of the debug
+        observers of the Dataset, with the following parameters: the pool, the number of jobs
+        launched concurrently, the ratio of idle time of the workers, the mean time spent by a job
+        in the pool's queue and the mean duration of a job.
+
+        Parameters
+        ----------
+        pool: multiprocessing.pool.Pool or multiprocessing.pool.ThreadPool or concurrent.futures.ThreadPoolExecutor or concurrent.futures.ProcessPoolExecutor
+            ..
+        adaptive: bool
+            ..
+
+        """
+        if not isinstance(pool, POOL_TYPES): # pragma: no cover
+            raise TypeError('Can only configure pools')
+        with self._lock:
+            if adaptive:
+                self._adaptive_pools.add(pool)
+            else:
+                self._adaptive_pools.discard(pool)
+
+    def adaptive_token_count(self, pool):
+        """Is the number of jobs launched on the given pool adaptive, see `set_adaptive_token_count`
+
+        Returns
+        -------
+        bool
+        """
+        with self._lock:
+            return pool in self._adaptive_pools
+
+    def set_job_batching(self, pool, batch_size, max_latency=0.005):
+        """Let the scheduler launch up to `batch_size` jobs in a single task of the given pool.
+        Should be called before creating the first raster that uses the pool.
+
+        Useful when the jobs are short compared to the cost of dispatching a task to the pool, like
+        reading, checking or resampling small tiles on a process pool.
+
+        A batch is launched when it is full, when its first job waited for `max_latency` seconds,
+        or as soon as the scheduler has nothing else to do. The number of jobs launched
+        concurrently on the pool is multiplied by `batch_size`, so that all the workers are kept
+        busy.
+
+        Parameters
+        ----------
+        pool: multiprocessing.pool.Pool or multiprocessing.pool.ThreadPool or concurrent.futures.ThreadPoolExecutor or concurrent.futures.ProcessPoolExecutor
+            ..
+        batch_size: int
+            1 to disable batching (the default)
+        max_latency: float
+            In seconds
+
+        """
+        if not isinstance(pool, POOL_TYPES): # pragma: no cover
+            raise TypeError('Can only configure pools')
+        batch_size = int(batch_size)
+        if batch_size <= 0: # pragma: no cover
+            raise ValueError('`batch_size` should be >0')
+        max_latency = float(max_latency)
+        if max_latency < 0: # pragma: no cover
+            raise ValueError('`max_latency` should be >=0')
+        with self._lock:
+            self._job_batching_of_pool[pool] = (batch_size, max_latency)
+
+    def job_batching(self, pool):
+        """Get the batch size and the max latency of the given pool, see `set_job_batching`
+
+        Returns
+        -------
+        (int, float)
+        """
+        with self._lock:
+            return self._job_batching_of_pool.get(pool, (1, 0.))
+
+    def set_memory_budget(self, pool, nbytes):
+        """Set the memory budget of the given pool. The scheduler only launches a job on that pool
+        if the estimated number of bytes allocated by the jobs running on that pool, this one
+        included, does not exceed `nbytes`. Should be called before creating the first raster that
+        uses the pool.
+
+        The number of bytes of a job is estimated from the Footprint, the number of channels and
+        the dtype of the array it produces (e.g. a computation of 1000x1000 pixels on a raster of 3
+        channels of float32 is estimated to 12MB).
+
+        Parameters
+        ----------
+        pool: multiprocessing.pool.Pool or multiprocessing.pool.ThreadPool or concurrent.futures.ThreadPoolExecutor or concurrent.futures.ProcessPoolExecutor
+            ..
+        nbytes: None or int
+            None for no budget (the default)
+
+        """
+        if not isinstance(pool, POOL_TYPES): # pragma: no cover
+            raise TypeError('Can only set the budget of pools')
+        nbytes = _normalize_memory_budget(nbytes)
+        with self._lock:
+            self._memory_budget_of_pool[pool] = nbytes
+
+    def memory_budget(self, pool):
+        """Get the memory budget of the given pool, see `set_memory_budget`
+
+        Returns
+        -------
+        None or int
+        """
+        with self._lock:
+            return self._memory_budget_of_pool.get(pool)
+
+    def set_total_memory_budget(self, nbytes):
+        """Set the memory budget shared by all the pools of this Dataset. Works the same way as
+        `set_memory_budget`. Should be called before creating the first async raster.
+
+        Parameters
+        ----------
+        nbytes: None or int
+            None for no budget (the default)
+
+        """
+        nbytes = _normalize_memory_budget(nbytes)
+        with self._lock:
+            self._total_memory_budget = nbytes
+
+    def total_memory_budget(self):
+        """Get the memory budget shared by all the pools of this Dataset, see
+        `set_total_memory_budget`
+
+        Returns
+        -------
+        None or int
+        """
+        with self._lock:
+            return self._total_memory_budget
+
     def __len__(self):
         """Number of pools registered in this Dataset"""
         with self._lock:
@@ -76,16 +273,23 @@ class PoolsContainer:
             if isinstance(pool, mp.pool.ThreadPool):
                 pool.terminate()
                 things_to_join.append(pool)
-            else:
+            elif isinstance(pool, mp.pool.Pool):
                 things_to_join.append(_create_process_pool_killer(pool))
+            else:
+                things_to_join.append(_create_executor_killer(pool))
         for joinable in things_to_join:
             joinable.join()
         self._aliases.clear()
         self._aliases_per_pool.clear()
         self._managed_pools.clear()
+        self._worker_count_of_pool.clear()
+        self._memory_budget_of_pool.clear()
+        self._adaptive_pools.clear()
+        self._job_batching_of_pool.clear()
 
     def _normalize_pool_parameter(self, pool_param, param_name):
-        if isinstance(pool_param, (mp.pool.Pool, mp.pool.ThreadPool)):
+        if isinstance(pool_param, POOL_TYPES):
+            self._check_worker_count(pool_param, param_name)
             return pool_param
         if pool_param is None:
             return None
@@ -93,6 +297,8 @@ class PoolsContainer:
             types = [
                 'multiprocessing.pool.Pool',
                 'multiprocessing.pool.ThreadPool',
+                'concurrent.futures.ThreadPoolExecutor',
+                'concurrent.futures.ProcessPoolExecutor',
                 'None', 'hashable',
             ]
             raise TypeError('`{}` parameter should be one of {}'.format(
@@ -104,7 +310,24 @@ class PoolsContainer:
                 self._aliases[pool_param] = p
                 self._aliases_per_pool[p] = [pool_param]
                 self._managed_pools.add(p)
-        return self._aliases[pool_param]
+                self._worker_count_of_pool[p] = mp.cpu_count()
+        pool = self._aliases[pool_param]
+        if pool is not None:
+            self._check_worker_count(pool, param_name)
+        return pool
+
+    def _check_worker_count(self, pool, param_name):
+        if isinstance(pool, mp.pool.Pool):
+            return
+        with self._lock:
+            if pool in self._worker_count_of_pool:
+                return
+        raise ValueError(
+            'The number of workers of the executor given in `{}` is unknown, call '
+            '`Dataset.pools.set_worker_count(pool, worker_count)` before using it'.format(
+                param_name
+            )
+        )
 
 def _create_process_pool_killer(pp):
     """
@@ -117,3 +340,32 @@ def _create_process_pool_killer(pp):
     t = threading.Thread(target=kill_process_pool_from_thread)
     t.start()
     return t
+
+def _normalize_memory_budget(nbytes):
+    if nbytes is None:
+        return None
+    nbytes = int(nbytes)
+    if nbytes <= 0: # pragma: no cover
+        raise ValueError('A memory budget should be >0')
+    return nbytes
+
+def _create_executor_killer(executor):
+    """Shutdown a `concurrent.futures` executor from a thread, the jobs that did not start yet are
+    cancelled (python>=3.9), the running ones can't be interrupted.
+    """
+    def kill_executor_from_thread():
+        if sys.version_info >= (3, 9):
+            executor.shutdown(wait=True, cancel_futures=True)
+        else: # pragma: no cover
+            executor.shutdown(wait=True)
+    t = threading.Thread(target=kill_executor_from_thread)
+    t.start()
+    return t
+
+def shares_address_space(pool):
+    """Do the jobs launched on `pool` run in the scheduler's process"""
+    if isinstance(pool, (mp.pool.ThreadPool, cf.ThreadPoolExecutor)):
+        return True
+    if isinstance(pool, (mp.pool.Pool, cf.ProcessPoolExecutor)):
+        return False
+    assert False, 'Type should be checked in facade' # pragma: no cover
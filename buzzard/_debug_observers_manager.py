@@ -9,14 +9,26 @@ class DebugObserversManager:
         for method in self._to_call_per_ename[ename]:
             method(*args)
 
+    def is_observed(self, ename):
+        """Is there at least one observer of the `ename` event. Allows the caller to skip the
+        computation of the event's arguments.
+        """
+        return bool(self._to_call_per_ename[ename])
+
+    def find_observers(self, cls):
+        """Retrieve the observers that are instances of `cls`"""
+        return [o for o in self._obs if isinstance(o, cls)]
+
 class _ToCallPerEventName(dict):
     def __init__(self, debug_observers):
         self._obs = debug_observers
 
     def __missing__(self, ename):
         method_name = f'on_{ename}'
-        return [
+        to_call = [
             getattr(o, method_name)
             for o in self._obs
             if hasattr(o, method_name)
         ]
+        self[ename] = to_call
+        return to_call
@@ -0,0 +1,195 @@
+"""Tests of the checksums of the cache files of the cached raster recipes"""
+
+import glob
+import os
+import tempfile
+import shutil
+import uuid
+
+import numpy as np
+import pytest
+
+import buzzard as buzz
+from buzzard._actors.cached import checksum
+
+@pytest.fixture
+def test_prefix():
+    path = os.path.join(tempfile.gettempdir(), 'buzz_' + str(uuid.uuid4()))
+    os.makedirs(path)
+    yield path
+    shutil.rmtree(path)
+
+@pytest.mark.parametrize('algorithm,digest_length', [('blake2b', 24), ('xxh3', 32)])
+def test_hashing_writer(test_prefix, algorithm, digest_length):
+    if algorithm == 'xxh3' and not checksum.XXHASH_AVAILABLE:
+        pytest.skip('requires xxhash')
+    path = os.path.join(test_prefix, 'a.bin')
+    data = np.random.RandomState(42).bytes(2 * 1024 * 1024 + 3)
+
+    with open(path, 'wb') as stream:
+        writer = checksum.HashingWriter(stream, checksum.new_hasher(algorithm))
+        for i in range(0, len(data), 100000):
+            writer.write(data[i:i + 100000])
+    digest = writer.hexdigest()
+
+    assert len(digest) == digest_length
+    assert checksum.checksum_of_file(path, len(digest)) == digest
+    assert checksum.checksum_of_file(path, len(digest), buffer_size=4096) == digest
+
+def test_legacy_checksum(test_prefix):
+    path = os.path.join(test_prefix, 'a.bin')
+    words = np.arange(1000, dtype='uint64') * 0x0123456789abcdef
+    with open(path, 'wb') as stream:
+        stream.write(words.tobytes() + b'\x01\x02')
+    acc = int(np.add.reduce(words, dtype='uint64')) + 0x0201
+    assert checksum.checksum_of_file(path, 16) == f'{acc % 2 ** 64:016x}'
+
+    # Unknown algorithm
+    assert checksum.checksum_of_file(path, 17) is None
+
+@pytest.mark.parametrize('cache_driver', ['GTiff', 'npy'])
+def test_legacy_cache_files_are_still_valid(test_prefix, cache_driver):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    arr = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+
+    with buzz.Dataset().close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=lambda cache_fp, *_: arr[cache_fp.slice_in(fp)],
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            cache_driver=cache_driver,
+        )
+        assert np.all(r.get_data() == arr)
+        r.close()
+
+        # Rename the cache files as the older versions of buzzard would have
+        paths = glob.glob(os.path.join(test_prefix, 'buzz_*'))
+        assert len(paths) == 4
+        for path in paths:
+            prefix, suffix = path.rsplit('_', 1)
+            suffix = '.' + suffix.split('.', 1)[1]
+            os.rename(path, prefix + '_' + checksum.checksum_of_file(path, 16) + suffix)
+        # Older versions of buzzard did not write a cache manifest
+        os.remove(os.path.join(test_prefix, 'buzz_manifest.log'))
+
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=_should_not_be_called,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            cache_driver=cache_driver,
+        )
+        assert np.all(r.get_data() == arr)
+
+def test_cache_checksum_parameter(test_prefix, monkeypatch):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    arr = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+
+    def _checksum_lengths():
+        return {
+            len(path.rsplit('_', 1)[1]) - len('.npy')
+            for path in glob.glob(os.path.join(test_prefix, 'buzz_*.npy'))
+        }
+
+    def _create_recipe(ds, **kwargs):
+        return ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=lambda cache_fp, *_: arr[cache_fp.slice_in(fp)],
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            cache_driver='npy',
+            ow=True,
+            **kwargs
+        )
+
+    with buzz.Dataset().close as ds:
+        # The default does not depend on the environment
+        r = _create_recipe(ds)
+        assert np.all(r.get_data() == arr)
+        r.close()
+        assert _checksum_lengths() == {24}
+
+        if checksum.XXHASH_AVAILABLE:
+            r = _create_recipe(ds, cache_checksum='xxh3')
+            assert np.all(r.get_data() == arr)
+            r.close()
+            assert _checksum_lengths() == {32}
+
+        with pytest.raises(ValueError, match='cache_checksum'):
+            _create_recipe(ds, cache_checksum='md5')
+        monkeypatch.setattr(checksum, 'XXHASH_AVAILABLE', False)
+        with pytest.raises(ValueError, match='xxhash'):
+            _create_recipe(ds, cache_checksum='xxh3')
+
+@pytest.mark.parametrize('cache_verification', ['full', 'lazy'])
+def test_xxhash_unavailable(test_prefix, monkeypatch, cache_verification):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    arr = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+    computed = []
+
+    def _compute(cache_fp, *_):
+        computed.append(cache_fp)
+        return arr[cache_fp.slice_in(fp)]
+
+    def _create_recipe(ds):
+        return ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=_compute,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            cache_driver='npy',
+            cache_verification=cache_verification,
+        )
+
+    with buzz.Dataset().close as ds:
+        r = _create_recipe(ds)
+        assert np.all(r.get_data() == arr)
+        r.close()
+
+        # Rename the cache files as if they were written with xxh3
+        paths = glob.glob(os.path.join(test_prefix, 'buzz_*.npy'))
+        assert len(paths) == 4
+        xxh3_paths = set()
+        for path in paths:
+            prefix = path.rsplit('_', 1)[0]
+            xxh3_paths.add(prefix + '_' + '0' * 32 + '.npy')
+            os.rename(path, prefix + '_' + '0' * 32 + '.npy')
+        os.remove(os.path.join(test_prefix, 'buzz_manifest.log'))
+        del computed[:]
+
+        # Without `xxhash` those files can't be verified, they are computed again with blake2b
+        # and left untouched for the environments that have `xxhash`
+        monkeypatch.setattr(checksum, 'XXHASH_AVAILABLE', False)
+        r = _create_recipe(ds)
+        assert np.all(r.get_data() == arr)
+        assert len(computed) == 4
+        r.close()
+
+        # The new cache files are used next to the old ones
+        del computed[:]
+        r = _create_recipe(ds)
+        assert np.all(r.get_data() == arr)
+        assert len(computed) == 0
+        r.close()
+
+    paths = set(glob.glob(os.path.join(test_prefix, 'buzz_*.npy')))
+    assert len(paths) == 8
+    assert xxh3_paths <= paths
+    for path in paths - xxh3_paths:
+        assert len(path.rsplit('_', 1)[1]) == len('.npy') + 24
+
+def _should_not_be_called(*args):
+    assert False, _should_not_be_called
@@ -0,0 +1,126 @@
+"""Tests of the index of the cache files of the cached raster recipes"""
+
+import os
+import tempfile
+import shutil
+import uuid
+
+import numpy as np
+import pytest
+
+import buzzard as buzz
+from buzzard._actors.cached.cache_manifest import CacheManifest
+
+@pytest.fixture
+def test_prefix():
+    path = os.path.join(tempfile.gettempdir(), 'buzz_' + str(uuid.uuid4()))
+    os.makedirs(path)
+    yield path
+    shutil.rmtree(path)
+
+def _fname(x, y, checksum, suffix='.tif'):
+    return 'buzz_x{:03d}-y{:03d}_x{:05d}-y{:05d}_{}{}'.format(x, y, x * 10, y * 10, checksum, suffix)
+
+def test_log(test_prefix):
+    m = CacheManifest(test_prefix)
+    m.load()
+    assert m.paths() == []
+
+    a = os.path.join(test_prefix, _fname(0, 0, 'aaaa'))
+    b = os.path.join(test_prefix, _fname(1, 0, 'bbbb'))
+    c = os.path.join(test_prefix, _fname(1, 0, 'cccc', '.npy'))
+    m.add(a, 10, 100)
+    m.add(b, 20, 200)
+    m.add(c, 30, 300)
+    m.remove(b)
+    m.remove(b)
+    assert m.paths('buzz_x001-y000_x00010-y00000') == [c]
+    assert m.paths('buzz_x001-y000_x00010-y00000', '.tif') == []
+    assert m.paths('buzz_x000-y000_x00000-y00000', '.tif') == [a]
+
+    m.flush()
+
+    # A process crashed while appending a line
+    with open(os.path.join(test_prefix, CacheManifest.FNAME), 'a') as stream:
+        stream.write('+ ' + _fname(2, 0, 'dd'))
+
+    m = CacheManifest(test_prefix)
+    m.load()
+    assert sorted(m.paths()) == sorted([a, c])
+    assert m.stat_of_path(a) == (10, 100)
+    assert m.stat_of_path(b) is None
+
+def test_compaction(test_prefix):
+    m = CacheManifest(test_prefix)
+    m.load()
+    a = os.path.join(test_prefix, _fname(0, 0, 'aaaa'))
+    for i in range(100):
+        m.add(a, i, i)
+        m.remove(a)
+    m.add(a, 42, 43)
+
+    m = CacheManifest(test_prefix)
+    m.load()
+    with open(os.path.join(test_prefix, CacheManifest.FNAME)) as stream:
+        assert len(stream.readlines()) == 1
+    assert m.paths() == [a]
+    assert m.stat_of_path(a) == (42, 43)
+
+    # The lines appended by another process while compacting are preserved
+    log_path = os.path.join(test_prefix, CacheManifest.FNAME)
+    read_size = os.path.getsize(log_path)
+    b = os.path.join(test_prefix, _fname(1, 0, 'bbbb'))
+    with open(log_path, 'a') as stream:
+        stream.write('+ {} 44 45\n'.format(os.path.basename(b)))
+    m._dump(read_size)
+
+    m = CacheManifest(test_prefix)
+    m.load()
+    assert sorted(m.paths()) == sorted([a, b])
+    assert m.stat_of_path(b) == (44, 45)
+
+def test_rebuild(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    arr = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+
+    with buzz.Dataset().close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=lambda cache_fp, *_: arr[cache_fp.slice_in(fp)],
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+        )
+        assert np.all(r.get_data() == arr)
+        r.close()
+
+        m = CacheManifest(test_prefix)
+        m.load()
+        paths = m.paths()
+        assert len(paths) == 4
+        for path in paths:
+            stat = os.stat(path)
+            assert m.stat_of_path(path) == (stat.st_size, stat.st_mtime_ns)
+
+        # Rebuilt from the content of the directory
+        os.remove(os.path.join(test_prefix, CacheManifest.FNAME))
+        with open(os.path.join(test_prefix, 'not_a_cache_file.tif'), 'w') as stream:
+            stream.write('42')
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=_should_not_be_called,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+        )
+        assert np.all(r.get_data() == arr)
+        r.close()
+
+        m = CacheManifest(test_prefix)
+        m.load()
+        assert sorted(m.paths()) == sorted(paths)
+
+def _should_not_be_called(*args):
+    assert False, _should_not_be_called
@@ -1,3 +1,4 @@
+import sys
 import multiprocessing as mp
 import multiprocessing.pool
 import shutil
@@ -10,9 +11,12 @@ import time
 import gc
 import threading
 import itertools
+import asyncio
+import concurrent.futures as cf
 
 import numpy as np
 import pytest
+from osgeo import gdal
 
 import buzzard as buzz
 
@@ -24,6 +28,8 @@ def pytest_generate_tests(metafunc):
                 'lol',
                 mp.pool.ThreadPool(2),
                 mp.pool.Pool(2),
+                cf.ThreadPoolExecutor(2),
+                cf.ProcessPoolExecutor(2),
         ]:
             # TODO: test with different pools
             # TODO: test with spawn/forks
@@ -71,6 +77,9 @@ def test_(pools, test_prefix, cache_tiles, test_prefix2):
             ))
         )
         d.update(kwargs)
+        pool = pools['computation']['computation_pool']
+        if isinstance(pool, cf.Executor):
+            ds.pools.set_worker_count(pool, 2)
         return ds.acreate_cached_raster_recipe(**d)
 
     def _test_get():
@@ -366,6 +375,497 @@ def test_(pools, test_prefix, cache_tiles, test_prefix2):
         with pytest.raises(NecessaryCrash):
             r.get_data()
 
+def test_asyncio(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    tiles = fp.tile((30, 30), boundary_effect='shrink').flatten().tolist()
+
+    async def _main(r):
+        # aget_data
+        arr = await r.aget_data(channels=0)
+        assert np.all(arr == fp.meshgrid_raster[0])
+
+        # aiter_data
+        i = 0
+        async for arr in r.aiter_data(tiles, max_queue_size=2):
+            assert np.all(arr == np.stack(tiles[i].meshgrid_raster_in(fp), axis=2))
+            i += 1
+        assert i == len(tiles)
+
+        # Cancellation of the task iterating cancels the query
+        async def _consume_all():
+            async for _ in r.aiter_data(tiles, max_queue_size=1):
+                await asyncio.sleep(1)
+        task = asyncio.ensure_future(_consume_all())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # The raster is still usable
+        arr = await r.aget_data(fp=tiles[-1])
+        assert arr.shape == tuple(np.r_[tiles[-1].shape, 2])
+
+    with buzz.Dataset().close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=functools.partial(_meshgrid_raster_in, reffp=fp),
+            cache_dir=test_prefix,
+            cache_tiles=(25, 25),
+        )
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(_main(r))
+        finally:
+            loop.close()
+
+def test_asyncio_scheduler_crash(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+
+    async def _main(r):
+        # The scheduler's exit wakes up the waiting consumer
+        with pytest.raises(NecessaryCrash):
+            await asyncio.wait_for(r.aget_data(), 10)
+
+    with buzz.Dataset().close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 1,
+            compute_array=_please_crash,
+            cache_dir=test_prefix,
+        )
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(_main(r))
+        finally:
+            loop.close()
+
+def test_unordered(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    tiles = fp.tile((25, 25)).flatten().tolist()
+
+    def _compute(cfp, *args):
+        if cfp == tiles[0]:
+            # The first tile is slow, it should not delay the others
+            time.sleep(1)
+        return _meshgrid_raster_in(cfp, *args, reffp=fp)
+
+    pool = mp.pool.ThreadPool(4)
+    try:
+        with buzz.Dataset().close as ds:
+            r = ds.acreate_cached_raster_recipe(
+                fp, 'float32', 2,
+                compute_array=_compute,
+                cache_dir=test_prefix,
+                cache_tiles=(25, 25),
+                computation_pool=pool,
+            )
+            indices = []
+            for i, tile, arr in r.iter_data(tiles, max_queue_size=3, ordered=False):
+                assert tile == tiles[i]
+                assert np.all(arr == np.stack(tile.meshgrid_raster_in(fp), axis=2))
+                indices.append(i)
+            assert sorted(indices) == list(range(len(tiles)))
+            assert indices[0] != 0
+
+            # Once cached, still correct
+            res = dict((i, arr) for i, _, arr in r.iter_data(tiles, ordered=False))
+            for i, arr in enumerate(r.iter_data(tiles)):
+                assert np.all(res[i] == arr)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def test_pool_without_worker_count(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    pool = cf.ThreadPoolExecutor(2)
+    with buzz.Dataset().close as ds:
+        with pytest.raises(ValueError, match='set_worker_count'):
+            ds.acreate_cached_raster_recipe(
+                fp, 'float32', 2,
+                compute_array=_should_not_be_called,
+                cache_dir=test_prefix,
+                computation_pool=pool,
+            )
+        ds.pools.alias('shared', pool)
+        with pytest.raises(ValueError, match='set_worker_count'):
+            ds.acreate_cached_raster_recipe(
+                fp, 'float32', 2,
+                compute_array=_should_not_be_called,
+                cache_dir=test_prefix,
+                computation_pool='shared',
+            )
+    pool.shutdown()
+
+@pytest.mark.skipif(sys.version_info < (3, 9), reason='requires Executor.shutdown(cancel_futures)')
+def test_executor_shutdown(test_prefix, test_prefix2):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    event = threading.Event()
+
+    def _compute(cfp, *_):
+        event.wait(10)
+        return np.zeros((*cfp.shape, 1), 'float32')
+
+    pool = cf.ThreadPoolExecutor(1)
+    with buzz.Dataset().close as ds:
+        ds.pools.set_worker_count(pool, 1)
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 1,
+            compute_array=_compute,
+            cache_dir=test_prefix,
+            cache_tiles=(10, 10),
+            computation_pool=pool,
+        )
+        it = r.iter_data(r.cache_tiles.flatten().tolist(), max_queue_size=4)
+
+        # The owner of the executor shuts it down while jobs are pending
+        time.sleep(0.2)
+        pool.shutdown(wait=False, cancel_futures=True)
+        event.set()
+        with pytest.raises(RuntimeError, match='shut down'):
+            list(it)
+        with pytest.raises(RuntimeError, match='shut down'):
+            r.get_data()
+
+        # The other rasters are still usable
+        r2 = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 1,
+            compute_array=_compute,
+            cache_dir=test_prefix2,
+        )
+        assert r2.get_data().shape == fp.shape
+
+def test_memory_budget(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    tiles = fp.tile((25, 25)).flatten().tolist()
+    lock = threading.Lock()
+    running = [0, 0] # current, max
+
+    def _compute(cfp, *args):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return _meshgrid_raster_in(cfp, *args, reffp=fp)
+
+    pool = cf.ThreadPoolExecutor(4)
+    with buzz.Dataset().close as ds:
+        ds.pools.set_worker_count(pool, 4)
+        # The computation of a 25x25 tile of 2 float32 channels weights 5000 bytes
+        ds.pools.set_memory_budget(pool, 12000)
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=_compute,
+            cache_dir=test_prefix,
+            cache_tiles=(25, 25),
+            computation_pool=pool,
+        )
+        for tile, arr in zip(tiles, r.iter_data(tiles, max_queue_size=16)):
+            assert np.all(arr == np.stack(tile.meshgrid_raster_in(fp), axis=2))
+    pool.shutdown()
+    assert running[1] <= 2
+
+def test_memory_budget_reservation():
+    from buzzard._actors.pool_waiting_room import ActorPoolWaitingRoom, ByteBudget
+    from buzzard._actors.pool_job import MaxPrioJobWaiting
+    from buzzard._debug_observers_manager import DebugObserversManager
+
+    dataset_budget = ByteBudget(10)
+    a, b = [
+        ActorPoolWaitingRoom(
+            object(), 4, 1, ByteBudget(None), dataset_budget, False, DebugObserversManager([]),
+        )
+        for _ in range(2)
+    ]
+
+    msgs = a.receive_schedule_job(MaxPrioJobWaiting('/a', 5))
+    assert [msg.title for msg in msgs] == ['token_to_working_room']
+    token = msgs[0].args[1]
+
+    # A big job that does not fit reserves the Dataset's budget...
+    big_job = MaxPrioJobWaiting('/b', 8)
+    assert b.receive_schedule_job(big_job) == []
+    assert dataset_budget.reserved_by is b
+
+    # ...so that the small jobs of the other waiting rooms don't keep it waiting
+    small_job = MaxPrioJobWaiting('/a', 2)
+    assert a.receive_schedule_job(small_job) == []
+
+    msgs = a.receive_salvage_token(token)
+    assert [msg.title for msg in msgs] == ['dataset_budget_released']
+    assert a.receive_dataset_budget_released() == []
+    msgs = b.receive_dataset_budget_released()
+    assert [msg.address for msg in msgs] == ['/b', '/Pool*/WaitingRoom']
+    assert msgs[0].args[0] is big_job
+    assert dataset_budget.reserved_by is None
+
+    msgs = a.receive_dataset_budget_released()
+    assert [msg.args[0] for msg in msgs] == [small_job]
+    assert dataset_budget.in_flight == 10
+
+def test_adaptive_token_count(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    tiles = fp.tile((10, 10)).flatten().tolist()
+
+    class _Observer:
+        def __init__(self):
+            self.updates = []
+
+        def on_pool_token_count_update(self, pool, token_count, idle_ratio, queue_wait, duration):
+            self.updates.append((pool, token_count))
+
+    obs = _Observer()
+    pool = cf.ThreadPoolExecutor(2)
+    with buzz.Dataset(debug_observers=[obs]).close as ds:
+        ds.pools.set_worker_count(pool, 2)
+        ds.pools.set_adaptive_token_count(pool)
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=functools.partial(_meshgrid_raster_in, reffp=fp),
+            cache_dir=test_prefix,
+            cache_tiles=(10, 10),
+            computation_pool=pool,
+        )
+        for tile, arr in zip(tiles, r.iter_data(tiles)):
+            assert np.all(arr == np.stack(tile.meshgrid_raster_in(fp), axis=2))
+    pool.shutdown()
+    assert obs.updates
+    assert all(p is pool and 2 < token_count <= 2 + 2 * 4 for p, token_count in obs.updates)
+
+def test_job_batching(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    tiles = fp.tile((10, 10)).flatten().tolist()
+
+    pool = mp.pool.Pool(2)
+    try:
+        with buzz.Dataset().close as ds:
+            ds.pools.set_job_batching(pool, 4)
+            r = ds.acreate_cached_raster_recipe(
+                fp, 'float32', 2,
+                compute_array=functools.partial(_meshgrid_raster_in, reffp=fp),
+                cache_dir=test_prefix,
+                cache_tiles=(10, 10),
+                computation_pool=pool,
+                io_pool=pool,
+                resample_pool=pool,
+            )
+            for _ in range(2):
+                # Computation, then read from cache
+                for tile, arr in zip(tiles, r.iter_data(tiles, max_queue_size=20)):
+                    assert np.all(arr == np.stack(tile.meshgrid_raster_in(fp), axis=2))
+
+            # Resampling
+            dst_fp = fp.intersection(fp, scale=fp.scale / 2)
+            arr = r.get_data(fp=dst_fp, interpolation='nearest')
+            assert arr.shape == tuple(np.r_[dst_fp.shape, 2])
+    finally:
+        pool.terminate()
+        pool.join()
+
+def test_npy_cache_driver(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    tiles = fp.tile((25, 25)).flatten().tolist()
+
+    with buzz.Dataset().close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=functools.partial(_meshgrid_raster_in, reffp=fp),
+            cache_dir=test_prefix,
+            cache_tiles=(25, 25),
+            cache_driver='npy',
+        )
+        for _ in range(2):
+            # Computation, then read from cache. The arrays of the cache tiles are copy-on-write
+            # views of the cache files, writing to them should not alter the cache.
+            for tile, arr in zip(tiles, r.iter_data(tiles)):
+                assert np.all(arr == np.stack(tile.meshgrid_raster_in(fp), axis=2))
+                arr[:] = -1
+        assert len(glob.glob(os.path.join(test_prefix, '*.npy'))) == len(tiles)
+        assert len(glob.glob(os.path.join(test_prefix, '*.tif'))) == 0
+
+        # Reads overlapping several cache tiles, and of a subset of the channels
+        dst_fp = fp.erode(10)
+        arr = r.get_data(fp=dst_fp, channels=1)
+        assert np.all(arr == dst_fp.meshgrid_raster_in(fp)[1])
+        r.close()
+
+        # Reopen the cache
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=_should_not_be_called,
+            cache_dir=test_prefix,
+            cache_tiles=(25, 25),
+            cache_driver='npy',
+        )
+        assert np.all(r.get_data() == np.stack(fp.meshgrid_raster_in(fp), axis=2))
+
+@pytest.mark.parametrize('cache_driver,cache_options,suffix', [
+    ('GTiff', ['TILED=YES', 'COMPRESS=LZW', 'PREDICTOR=2'], '.tif'),
+    ('GTiff', ['TILED=YES', 'COMPRESS=DEFLATE', 'PREDICTOR=3'], '.tif'),
+    ('HFA', None, '.img'),
+])
+def test_cache_driver_and_options(test_prefix, cache_driver, cache_options, suffix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    tiles = fp.tile((25, 25)).flatten().tolist()
+
+    with buzz.Dataset().close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=functools.partial(_meshgrid_raster_in, reffp=fp),
+            cache_dir=test_prefix,
+            cache_tiles=(30, 30),
+            cache_driver=cache_driver,
+            cache_options=cache_options,
+        )
+        for _ in range(2):
+            for tile, arr in zip(tiles, r.iter_data(tiles)):
+                assert np.all(arr == np.stack(tile.meshgrid_raster_in(fp), axis=2))
+        paths = glob.glob(os.path.join(test_prefix, '*' + suffix))
+        assert len(paths) == r.cache_tiles.size
+        assert sorted(os.listdir(test_prefix)) == sorted(
+            [os.path.basename(path) for path in paths] + ['buzz_manifest.log']
+        )
+        r.close()
+
+    for path in paths:
+        gdal_ds = gdal.OpenEx(path, gdal.OF_RASTER)
+        assert gdal_ds.GetDriver().ShortName == cache_driver
+        if cache_options is not None:
+            compression = cache_options[1].split('=')[1]
+            assert gdal_ds.GetMetadata('IMAGE_STRUCTURE')['COMPRESSION'] == compression
+        del gdal_ds
+
+def test_invalid_cache_driver(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    with buzz.Dataset().close as ds:
+        for cache_driver, cache_options in [
+                ('not a driver', None),
+                ('MEM', None),
+                ('npy', ['COMPRESS=LZW']),
+                # Multi-file drivers, their side-car files would be lost
+                ('ENVI', None),
+                ('EHdr', None),
+        ]:
+            with pytest.raises(ValueError):
+                ds.acreate_cached_raster_recipe(
+                    fp, 'float32', 2,
+                    compute_array=_should_not_be_called,
+                    cache_dir=test_prefix,
+                    cache_driver=cache_driver,
+                    cache_options=cache_options,
+                )
+
+@pytest.mark.parametrize('cache_verification', ['full', 'metadata', 'lazy'])
+@pytest.mark.parametrize('io_pool', [None, 'thread'])
+def test_cache_verification(test_prefix, cache_verification, io_pool):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    expected = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+    computed = []
+
+    def _compute(cfp, *args):
+        computed.append(cfp)
+        return _meshgrid_raster_in(cfp, *args, reffp=fp)
+
+    def _create_recipe(ds):
+        if io_pool is not None:
+            ds.pools.set_worker_count(io_pool, 2)
+        return ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=_compute,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            cache_driver='npy',
+            cache_verification=cache_verification,
+            io_pool=io_pool,
+        )
+
+    if io_pool == 'thread':
+        io_pool = cf.ThreadPoolExecutor(2)
+    with buzz.Dataset().close as ds:
+        r = _create_recipe(ds)
+        assert np.all(r.get_data() == expected)
+        r.close()
+        assert len(computed) == 4
+
+        # Corrupt the pixels of a cache file without changing its size
+        path = sorted(glob.glob(os.path.join(test_prefix, '*.npy')))[0]
+        with open(path, 'r+b') as stream:
+            stream.seek(-8, os.SEEK_END)
+            stream.write(b'\xff' * 8)
+        del computed[:]
+
+        r = _create_recipe(ds)
+        if cache_verification == 'full':
+            assert np.all(r.get_data() == expected)
+            assert len(computed) == 1
+        elif cache_verification == 'metadata':
+            assert np.any(r.get_data() != expected)
+            assert len(computed) == 0
+        else:
+            # Served right away, then evicted by a background check and computed again
+            r.get_data()
+            for _ in range(100):
+                if np.all(r.get_data() == expected):
+                    break
+                time.sleep(0.05)
+            assert np.all(r.get_data() == expected)
+            assert len(computed) == 1
+        r.close()
+    if io_pool is not None:
+        io_pool.shutdown()
+
+    if cache_verification == 'full':
+        # The corrupted file was removed
+        assert not os.path.exists(path)
+
 # Tools ***************************************************************************************** **
 class _AreaCounter:
     def __init__(self, fp):
@@ -383,6 +883,574 @@ class _AreaCounter:
     def check_done(self):
         assert np.all(self._mask == 1)
 
+@pytest.mark.parametrize('io_pool', [None, 'thread'])
+def test_tile_cache(test_prefix, io_pool):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    expected = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+    tile_nbytes = 50 * 50 * 2 * 4
+    computed = []
+
+    def _compute(cfp, *args):
+        computed.append(cfp)
+        return _meshgrid_raster_in(cfp, *args, reffp=fp)
+
+    def _create_recipe(ds):
+        if io_pool is not None:
+            ds.pools.set_worker_count(io_pool, 2)
+        return ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=_compute,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            io_pool=io_pool,
+        )
+
+    def _remove_cache_files():
+        paths = glob.glob(os.path.join(test_prefix, '*.tif'))
+        assert len(paths) == 4
+        for path in paths:
+            os.remove(path)
+
+    if io_pool == 'thread':
+        io_pool = cf.ThreadPoolExecutor(2)
+
+    # The tiles written are kept in memory
+    with buzz.Dataset(tile_cache_budget=4 * tile_nbytes).close as ds:
+        r = _create_recipe(ds)
+        assert np.all(r.get_data() == expected)
+        assert len(computed) == 4
+        assert ds._back.tile_cache_nbytes() == 4 * tile_nbytes
+
+        shutil.copytree(test_prefix, test_prefix + '_bak')
+        _remove_cache_files()
+        subfp = fp.erode(10)
+        assert np.all(r.get_data(fp=subfp, channels=[1, 0]) == expected[subfp.slice_in(fp)][..., [1, 0]])
+        assert len(computed) == 4
+        r.close()
+    shutil.rmtree(test_prefix)
+    shutil.move(test_prefix + '_bak', test_prefix)
+
+    # The tiles read are kept in memory, the least recently used are evicted
+    with buzz.Dataset(tile_cache_budget=tile_nbytes).close as ds:
+        r = _create_recipe(ds)
+        subfp = fp.clip(0, 0, 30, 30)
+        assert np.all(r.get_data(fp=subfp) == expected[subfp.slice_in(fp)])
+        assert ds._back.tile_cache_nbytes() == tile_nbytes
+
+        _remove_cache_files()
+        subfp = fp.clip(10, 10, 40, 40)
+        assert np.all(r.get_data(fp=subfp, channels=1) == expected[subfp.slice_in(fp)][..., 1])
+        assert len(computed) == 4
+        r.close()
+
+    if io_pool is not None:
+        io_pool.shutdown()
+
+@pytest.mark.parametrize('cache_eviction', ['lru', 'lfu'])
+def test_cache_max_bytes(test_prefix, cache_eviction):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    expected = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+    file_size = 128 + 50 * 50 * 2 * 4
+    computed = []
+
+    def _compute(cfp, *args):
+        computed.append(cfp)
+        return _meshgrid_raster_in(cfp, *args, reffp=fp)
+
+    def _list_tiles():
+        return sorted(
+            os.path.basename(path)[:len('buzz_x000-y000')]
+            for path in glob.glob(os.path.join(test_prefix, 'buzz_x*.npy'))
+        )
+
+    with buzz.Dataset().close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=_compute,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            cache_driver='npy',
+            cache_max_bytes=2 * file_size + 1,
+            cache_eviction=cache_eviction,
+            io_pool=None,
+        )
+        t0, t1, t2, _ = r.cache_tiles.flat
+        for tile in [t0, t0, t1]:
+            assert np.all(r.get_data(fp=tile) == expected[tile.slice_in(fp)])
+        assert _list_tiles() == ['buzz_x000-y000', 'buzz_x001-y000']
+        assert len(computed) == 2
+
+        # A third cache file exceeds the quota
+        assert np.all(r.get_data(fp=t2) == expected[t2.slice_in(fp)])
+        if cache_eviction == 'lru':
+            assert _list_tiles() == ['buzz_x000-y001', 'buzz_x001-y000']
+        else:
+            assert _list_tiles() == ['buzz_x000-y000', 'buzz_x000-y001']
+
+        # The tiles of a query are never removed, even if the query exceeds the quota
+        assert np.all(r.get_data() == expected)
+        assert len(computed) == 5
+        assert len(_list_tiles()) == 4
+        r.close()
+
+def test_cache_max_bytes_file_in_use(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    expected = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+    file_size = 128 + 50 * 50 * 2 * 4
+
+    def _list_tiles():
+        return sorted(
+            os.path.basename(path)[:len('buzz_x000-y000')]
+            for path in glob.glob(os.path.join(test_prefix, 'buzz_x*.npy'))
+        )
+
+    with buzz.Dataset().close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=functools.partial(_meshgrid_raster_in, reffp=fp),
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            cache_driver='npy',
+            cache_max_bytes=2 * file_size + 1,
+            io_pool=None,
+        )
+        t0, t1, t2, t3 = r.cache_tiles.flat
+        for tile in [t0, t1]:
+            assert np.all(r.get_data(fp=tile) == expected[tile.slice_in(fp)])
+        path0, = glob.glob(os.path.join(test_prefix, 'buzz_x000-y000*.npy'))
+
+        # The coldest cache file is in use (e.g. by a job of a cancelled query), it is skipped
+        allocator = lambda: np.load(path0, mmap_mode='r')
+        with ds._back.acquire_driver_object(path0, allocator):
+            assert np.all(r.get_data(fp=t2) == expected[t2.slice_in(fp)])
+            assert _list_tiles() == ['buzz_x000-y000', 'buzz_x000-y001']
+
+        # Once released, it is removed by the next eviction
+        assert np.all(r.get_data(fp=t3) == expected[t3.slice_in(fp)])
+        assert _list_tiles() == ['buzz_x000-y001', 'buzz_x001-y001']
+        assert np.all(r.get_data(fp=t0) == expected[t0.slice_in(fp)])
+        r.close()
+
+def test_cache_max_bytes_shared_cache_dir(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    expected = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+    file_size = 128 + 50 * 50 * 2 * 4
+
+    def _create_recipe(ds, cache_tiles, cache_max_bytes):
+        return ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=functools.partial(_meshgrid_raster_in, reffp=fp),
+            cache_dir=test_prefix,
+            cache_tiles=cache_tiles,
+            cache_driver='npy',
+            cache_max_bytes=cache_max_bytes,
+            io_pool=None,
+        )
+
+    with buzz.Dataset().close as ds:
+        # The cache files of another recipe
+        r = _create_recipe(ds, (25, 25), None)
+        assert np.all(r.get_data() == expected)
+        r.close()
+        other_paths = set(glob.glob(os.path.join(test_prefix, 'buzz_x*.npy')))
+        assert len(other_paths) == 16
+
+        # They are neither counted in the quota nor removed
+        r = _create_recipe(ds, (50, 50), 2 * file_size + 1)
+        t0, t1, t2, _ = r.cache_tiles.flat
+        for tile in [t0, t1, t2]:
+            assert np.all(r.get_data(fp=tile) == expected[tile.slice_in(fp)])
+        paths = set(glob.glob(os.path.join(test_prefix, 'buzz_x*.npy')))
+        assert other_paths <= paths
+        assert len(paths - other_paths) == 2
+        r.close()
+
+@pytest.mark.parametrize('cache_driver', ['GTiff', 'npy'])
+def test_uniform_cache_tiles(test_prefix, cache_driver):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    expected = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+    expected[:50, 50:] = -1
+    expected[50:, :50] = np.nan
+
+    def _compute(cfp, *_):
+        return expected[cfp.slice_in(fp)]
+
+    def _create_recipe(ds, compute_array):
+        return ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            channels_schema={'nodata': -1},
+            compute_array=compute_array,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            cache_driver=cache_driver,
+        )
+
+    def _assert_data(r):
+        subfp = fp.erode(10)
+        assert np.array_equal(r.get_data(), expected, equal_nan=True)
+        assert np.array_equal(
+            r.get_data(fp=subfp, channels=1), expected[subfp.slice_in(fp)][..., 1], equal_nan=True,
+        )
+
+    with buzz.Dataset().close as ds:
+        r = _create_recipe(ds, _compute)
+        _assert_data(r)
+        r.close()
+
+        # The uniform tiles are recorded as empty files
+        paths = sorted(glob.glob(os.path.join(test_prefix, 'buzz_x*')))
+        assert len(paths) == 4
+        fill_paths = [path for path in paths if path.endswith('.fill')]
+        assert [os.path.basename(path)[:len('buzz_x000-y000')] for path in fill_paths] == [
+            'buzz_x000-y001', 'buzz_x001-y000',
+        ]
+        assert all(os.stat(path).st_size == 0 for path in fill_paths)
+
+        r = _create_recipe(ds, _should_not_be_called)
+        _assert_data(r)
+        r.close()
+
+def test_invalidate(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    expected = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+    computed = []
+
+    def _compute(cfp, *_):
+        computed.append(cfp)
+        return expected[cfp.slice_in(fp)]
+
+    with buzz.Dataset().close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=_compute,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+        )
+        t0, t1, t2, t3 = r.cache_tiles.flat
+        assert np.all(r.get_data() == expected)
+        assert len(computed) == 4
+
+        # The inputs changed in an area
+        expected[:] += 1
+        assert r.invalidate(t0.poly.exterior) == []
+        assert r.invalidate(t3) == [t3]
+        assert r.invalidate(t1.poly.centroid.buffer(20)) == [t1]
+        arr = r.get_data()
+        assert np.all(arr[t0.slice_in(fp)] == expected[t0.slice_in(fp)] - 1)
+        assert np.all(arr[t1.slice_in(fp)] == expected[t1.slice_in(fp)])
+        assert np.all(arr[t2.slice_in(fp)] == expected[t2.slice_in(fp)] - 1)
+        assert np.all(arr[t3.slice_in(fp)] == expected[t3.slice_in(fp)])
+        assert len(computed) == 6
+
+        # The old cache files were removed
+        assert len(glob.glob(os.path.join(test_prefix, '*.tif'))) == 4
+        r.close()
+
+    # A cache tile read to the tile cache while being invalidated is not served afterward
+    tile_nbytes = 50 * 50 * 2 * 4
+    io_pool = mp.pool.Pool(1)
+    try:
+        with buzz.Dataset(tile_cache_budget=4 * tile_nbytes).close as ds:
+            r = ds.acreate_cached_raster_recipe(
+                fp, 'float32', 2,
+                compute_array=_compute,
+                cache_dir=test_prefix,
+                cache_tiles=(50, 50),
+                cache_verification='lazy',
+                io_pool=io_pool,
+            )
+            # The reads wait behind this task in the pool
+            io_pool.apply_async(time.sleep, (1,))
+            it = r.iter_data([t0])
+            time.sleep(0.2)
+            expected[:] += 1
+            assert r.invalidate(t0) == [t0]
+            next(it)
+            assert np.all(r.get_data(fp=t0) == expected[t0.slice_in(fp)])
+            r.close()
+    finally:
+        io_pool.terminate()
+        io_pool.join()
+
+@pytest.mark.parametrize('computation_pool', [None, 'thread'])
+def test_warm(test_prefix, computation_pool):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    expected = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+    computed = []
+
+    def _compute(cfp, *_):
+        computed.append(cfp)
+        return expected[cfp.slice_in(fp)]
+
+    def _create_recipe(ds, compute_array):
+        if computation_pool is not None:
+            ds.pools.set_worker_count(computation_pool, 2)
+        return ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=compute_array,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            computation_pool=computation_pool,
+        )
+
+    if computation_pool == 'thread':
+        computation_pool = cf.ThreadPoolExecutor(2)
+
+    with buzz.Dataset().close as ds:
+        r = _create_recipe(ds, _compute)
+        t0, t1, t2, t3 = r.cache_tiles.flat
+
+        progress = r.warm([t1, t0.erode(10)], max_queue_size=1)
+        assert progress.wait(10)
+        assert progress.done
+        assert (progress.done_count, progress.total) == (2, 2)
+        assert computed == [t1, t0]
+        assert len(glob.glob(os.path.join(test_prefix, '*.tif'))) == 2
+
+        # Warming-up available cache tiles is a no-op
+        assert r.warm(t0).wait(10)
+        assert len(computed) == 2
+
+        # The whole raster
+        progress = r.warm(r.fp, priority=100)
+        assert progress.wait(10)
+        assert progress.total == 4
+        assert sorted(computed, key=lambda cfp: (-cfp.cy, cfp.cx)) == [t0, t1, t2, t3]
+        assert len(glob.glob(os.path.join(test_prefix, '*.tif'))) == 4
+
+        empty = r.warm([])
+        assert empty.done and empty.total == 0
+        with pytest.raises(TypeError):
+            r.warm([t0, 42])
+        with pytest.raises(ValueError):
+            r.warm(t0, max_queue_size=0)
+        r.close()
+
+        r = _create_recipe(ds, _should_not_be_called)
+        assert np.all(r.get_data() == expected)
+        r.close()
+
+def test_warm_cancel(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    event = threading.Event()
+
+    def _compute(cfp, *_):
+        event.wait(10)
+        return np.zeros((*cfp.shape, 1), 'float32')
+
+    pool = cf.ThreadPoolExecutor(1)
+    with buzz.Dataset().close as ds:
+        ds.pools.set_worker_count(pool, 1)
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 1,
+            compute_array=_compute,
+            cache_dir=test_prefix,
+            cache_tiles=(10, 10),
+            computation_pool=pool,
+        )
+        progress = r.warm(r.fp, max_queue_size=1)
+        assert not progress.wait(0.2)
+        assert progress.total == 100
+        progress.cancel()
+        event.set()
+        assert not progress.wait(10)
+        assert progress.cancelled
+        assert progress.done_count < 100
+
+        progress = r.warm(r.fp)
+        r.close()
+        assert not progress.wait(10)
+        assert progress.cancelled
+
+def test_cache_key(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    expected = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+
+    def _create_recipes(ds, base_key, derived_key, factor, derived_compute=None):
+        base = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=lambda cfp, *_: expected[cfp.slice_in(fp)] * factor,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            cache_key=base_key,
+        )
+        if derived_compute is None:
+            derived_compute = lambda cfp, _, arrs, *__: arrs['base'] + 1
+        derived = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=derived_compute,
+            queue_data_per_primitive={'base': base.queue_data},
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            cache_key=derived_key,
+        )
+        return base, derived
+
+    with buzz.Dataset().close as ds:
+        base, derived = _create_recipes(ds, 'v1', 'v1', 1)
+        assert np.all(derived.get_data() == expected + 1)
+        assert base.cache_dir == os.path.join(test_prefix, 'key_' + base.cache_key)
+        assert derived.cache_dir != base.cache_dir
+        keys1 = base.cache_key, derived.cache_key
+        base.close()
+        derived.close()
+
+        # A new version of the base recipe also changes the provenance of the derived one
+        base, derived = _create_recipes(ds, 'v2', 'v1', 2)
+        assert base.cache_key != keys1[0]
+        assert derived.cache_key != keys1[1]
+        assert np.all(derived.get_data() == expected * 2 + 1)
+        base.close()
+        derived.close()
+
+        # The first version is still there
+        base, derived = _create_recipes(ds, 'v1', 'v1', 1, _should_not_be_called)
+        assert (base.cache_key, derived.cache_key) == keys1
+        assert np.all(derived.get_data() == expected + 1)
+        base.close()
+        derived.close()
+
+        # Only the values that can be hashed deterministically are accepted
+        for key in [['v1'], {'v': 1}, object(), ('v1', None)]:
+            with pytest.raises(TypeError, match='cache_key'):
+                _create_recipes(ds, key, 'v1', 1)
+
+        # The parameters of the primitives are hashed by value
+        base, _ = _create_recipes(ds, 'v1', 'v1', 1)
+        def _derived_key(channels):
+            derived = ds.acreate_cached_raster_recipe(
+                fp, 'float32', 2,
+                compute_array=_should_not_be_called,
+                queue_data_per_primitive={
+                    'base': functools.partial(base.queue_data, channels=channels),
+                },
+                cache_dir=test_prefix,
+                cache_tiles=(50, 50),
+                cache_key='v1',
+            )
+            derived.close()
+            return derived.cache_key
+        assert _derived_key(np.asarray([1, 0])) == _derived_key(np.asarray([1, 0]))
+        assert _derived_key(np.asarray([1, 0])) != _derived_key(np.asarray([0, 1]))
+        base.close()
+
+    assert len(glob.glob(os.path.join(test_prefix, 'key_*', '*.tif'))) == 4 * 4
+
+def test_cache_overviews(test_prefix):
+    fp = buzz.Footprint(
+        rsize=(100, 100),
+        size=(100, 100),
+        tl=(1000, 1100),
+    )
+    expected = np.stack(fp.meshgrid_raster_in(fp), axis=2).astype('float32')
+    coarse_fp = buzz.Footprint(
+        gt=np.asarray(fp.gt) * [1, 4, 4, 1, 4, 4],
+        rsize=(25, 25),
+    )
+
+    def _create_recipe(ds, compute_array, **kwargs):
+        return ds.acreate_cached_raster_recipe(
+            fp, 'float32', 2,
+            compute_array=compute_array,
+            cache_dir=test_prefix,
+            cache_tiles=(50, 50),
+            **kwargs
+        )
+
+    with buzz.Dataset(allow_interpolation=True).close as ds:
+        # Downsampling a linear ramp in one or several steps gives the same result
+        coarse_expected = ds.awrap_numpy_raster(fp, expected).get_data(fp=coarse_fp)
+        r = _create_recipe(
+            ds, lambda cfp, *_: expected[cfp.slice_in(fp)], cache_overviews=[2, 4],
+        )
+        assert r.cache_overviews == (2, 4)
+        assert np.allclose(r.get_data(fp=coarse_fp), coarse_expected)
+        assert len(glob.glob(os.path.join(test_prefix, '*.tif'))) == 4
+        assert len(glob.glob(os.path.join(test_prefix, 'overview_x2', '*.tif'))) == 1
+        assert len(glob.glob(os.path.join(test_prefix, 'overview_x4', '*.tif'))) == 1
+        r.close()
+
+        # The coarse queries are served from the overviews, the fine ones from the cache tiles
+        r = _create_recipe(ds, _should_not_be_called, cache_overviews=[2, 4])
+        assert np.allclose(r.get_data(fp=coarse_fp), coarse_expected)
+        assert np.all(r.get_data() == expected)
+
+        # The overviews are invalidated too
+        r.invalidate(r.cache_tiles[0, 0])
+        r.get_data(fp=r.cache_tiles[1, 1])
+        assert len(glob.glob(os.path.join(test_prefix, '*.tif'))) == 3
+        assert len(glob.glob(os.path.join(test_prefix, 'overview_x2', '*.tif'))) == 0
+        assert len(glob.glob(os.path.join(test_prefix, 'overview_x4', '*.tif'))) == 0
+        r.close()
+
+        with pytest.raises(ValueError):
+            _create_recipe(ds, _should_not_be_called, cache_overviews=[4, 6])
+        with pytest.raises(ValueError):
+            _create_recipe(ds, _should_not_be_called, cache_overviews=[128])
+
+        # The quota is shared between the levels
+        r = _create_recipe(
+            ds, _should_not_be_called, cache_overviews=[2, 4], cache_max_bytes=21000, ow=True,
+        )
+        assert r._back.cache_max_bytes == 16000
+        assert [overview.cache_max_bytes for overview in r._back.overviews] == [4000, 1000]
+        r.close()
+
+        # The partial pixels at the edges of the raster are not in the overviews
+        r = _create_recipe(
+            ds, lambda cfp, *_: np.ones(tuple(cfp.shape) + (2,), 'float32'), cache_overviews=[3],
+            ow=True,
+        )
+        overview = r._back.overviews[0]
+        assert tuple(overview.fp.rsize) == (33, 33)
+        inner_fp = buzz.Footprint(gt=overview.fp.gt, rsize=(33, 33))
+        outer_fp = buzz.Footprint(gt=overview.fp.gt, rsize=(34, 34))
+        assert r._back._raster_of_query([inner_fp], 'cv_area', None) is overview
+        assert r._back._raster_of_query([outer_fp], 'cv_area', None) is r._back
+        assert np.all(r.get_data(fp=inner_fp) == 1)
+        assert len(glob.glob(os.path.join(test_prefix, 'overview_x3', '*.tif'))) == 1
+        r.close()
+
+    with buzz.Dataset().close as ds:
+        with pytest.raises(ValueError):
+            _create_recipe(ds, _should_not_be_called, cache_overviews=[2])
+
 def _base_computation(fp, primitive_fps, primtive_arrays, raster, reffp, area_counter=None):
     if area_counter is not None:
         area_counter.increment(fp)
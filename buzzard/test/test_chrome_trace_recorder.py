@@ -0,0 +1,68 @@
+import os
+import json
+
+import numpy as np
+
+import buzzard as buzz
+from buzzard._actors.pool_job import PoolJobWorking
+
+def test_trace(tmpdir):
+    path = os.path.join(str(tmpdir), 'trace.json')
+    fp = buzz.Footprint(tl=(0, 10), size=(10, 10), rsize=(10, 10))
+    rec = buzz.utils.ChromeTraceRecorder(path)
+
+    with buzz.Dataset(debug_observers=[rec]).close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 1,
+            compute_array=lambda fp, *_: np.zeros(fp.shape, 'float32'),
+            cache_dir=os.path.join(str(tmpdir), 'cache'),
+            cache_tiles=(5, 5),
+            debug_observers=[rec],
+        )
+        r.get_data()
+        assert not os.path.exists(path)
+
+    with open(path) as stream:
+        events = json.load(stream)['traceEvents']
+    job_names = {e['name'] for e in events if e.get('cat') == 'pool_job'}
+    assert {'Computer', 'Writer', 'Reader'} <= job_names
+    assert all(e['success'] for e in (e['args'] for e in events if e.get('cat') == 'pool_job'))
+    assert [e['ph'] for e in events if e.get('cat') == 'query'] == ['b', 'e']
+    assert any(e.get('cat') == 'scheduler' for e in events)
+
+def test_trace_batched_jobs():
+    rec = buzz.utils.ChromeTraceRecorder()
+    pool = object()
+    jobs = [PoolJobWorking('/Raster0/Computer', None) for _ in range(6)]
+
+    # Two tasks of 3 jobs, then one task of 3 jobs once the first one is done
+    for job in jobs[:3]:
+        rec.on_pool_job_started(pool, job, 0)
+    for job in jobs[3:]:
+        rec.on_pool_job_started(pool, job, 1)
+    for job in jobs[:3]:
+        rec.on_pool_job_stopped(pool, job, True, 0)
+    for job in jobs[:3]:
+        rec.on_pool_job_started(pool, job, 2)
+    for job in jobs:
+        rec.on_pool_job_stopped(pool, job, True, 1 if job in jobs[3:] else 2)
+
+    events = rec.trace()['traceEvents']
+    spans = [e for e in events if e.get('cat') == 'pool_job']
+    assert len(spans) == 9
+    assert {e['tid'] for e in events if e['name'] == 'thread_name'} == {0, 1}
+
+def test_trace_query_ids():
+    class _QueryInfos:
+        produce_count = 1
+
+    rec = buzz.utils.ChromeTraceRecorder()
+    for _ in range(2):
+        qi = _QueryInfos()
+        rec.on_query_started('raster', qi)
+        rec.on_query_stopped('raster', qi, 'done')
+        del qi
+
+    events = [e for e in rec.trace()['traceEvents'] if e.get('cat') == 'query']
+    assert [e['ph'] for e in events] == ['b', 'e', 'b', 'e']
+    assert events[0]['id'] == events[1]['id'] != events[2]['id'] == events[3]['id']
@@ -0,0 +1,40 @@
+from buzzard._actors.pool_token_controller import PoolTokenController, MIN_OVERLOAD
+
+def _run_window(ctrl, queue_wait, duration, idle, starving=True):
+    """Feed a window of jobs running back to back on each worker with `idle` seconds between
+    them"""
+    res = None
+    t = 0.
+    while res is None:
+        for _ in range(ctrl.worker_count):
+            res = ctrl.job_done(t - queue_wait, t, t + duration, starving)
+            if res is not None:
+                break
+        t += duration + idle
+    return res
+
+def test_short_jobs_with_idle_workers():
+    ctrl = PoolTokenController(4, 2)
+    idle_ratio, queue_wait, duration = _run_window(ctrl, 0., 0.001, 0.001)
+    assert 0.3 < idle_ratio < 0.6
+    assert ctrl.token_count == 4 + 4
+    _run_window(ctrl, 0., 0.001, 0.001)
+    assert ctrl.token_count == 4 + 8
+
+    # Idle workers but no job waiting: the pool has enough tokens
+    _run_window(ctrl, 0., 0.001, 0.001, starving=False)
+    assert ctrl.token_count == 4 + 8
+
+def test_long_jobs_waiting_in_queue():
+    ctrl = PoolTokenController(1, 2)
+    idle_ratio, queue_wait, duration = _run_window(ctrl, 1., 1., 0.)
+    assert (idle_ratio, queue_wait, duration) == (0., 1., 1.)
+    assert ctrl.token_count == 1 + 1
+    _run_window(ctrl, 1., 1., 0.)
+    assert ctrl.token_count == 1 + MIN_OVERLOAD
+
+def test_bounds():
+    ctrl = PoolTokenController(2, 2)
+    for _ in range(10):
+        _run_window(ctrl, 0., 0.001, 0.01)
+    assert ctrl.token_count == 2 + 2 * 4
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import buzzard as buzz
+
+def test_profiler_aggregation():
+    prof = buzz.utils.SchedulerProfiler()
+    assert prof.snapshot() == {}
+
+    prof.on_message_passed_ns('ActorA', 'title', 1000)
+    prof.on_message_passed_ns('ActorA', 'title', 3000)
+    prof.on_message_passed_ns('ActorB', 'title', 10 ** 12)
+    stats = prof.snapshot()
+    assert set(stats.keys()) == {('ActorA', 'title'), ('ActorB', 'title')}
+
+    a = stats['ActorA', 'title']
+    assert a.count == 2
+    assert a.total_ns == 4000
+    assert a.max_ns == 3000
+    assert sum(a.histogram) == 2
+    assert a.histogram[(1000).bit_length()] == 1
+    assert a.histogram[(3000).bit_length()] == 1
+
+    b = stats['ActorB', 'title']
+    assert b.count == 1
+    assert b.histogram[-1] == 1
+
+    # Exact bucket boundaries
+    prof.reset()
+    prof.on_message_passed_ns('ActorA', 'title', 2 ** 20 - 1)
+    prof.on_message_passed_ns('ActorA', 'title', 2 ** 20)
+    a = prof.snapshot()['ActorA', 'title']
+    assert a.histogram[20] == 1
+    assert a.histogram[21] == 1
+    assert a.total_ns == 2 ** 21 - 1
+
+    prof.reset()
+    assert prof.snapshot() == {}
+    assert a.count == 2
+
+def test_dataset_scheduler_stats(tmpdir):
+    fp = buzz.Footprint(tl=(0, 10), size=(10, 10), rsize=(10, 10))
+
+    with buzz.Dataset().close as ds:
+        with pytest.raises(RuntimeError):
+            ds.scheduler_stats()
+
+    with buzz.Dataset(debug_observers=[buzz.utils.SchedulerProfiler()]).close as ds:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', 1,
+            compute_array=lambda fp, *_: np.zeros(fp.shape, 'float32'),
+            cache_dir=str(tmpdir),
+        )
+        r.get_data()
+        stats = ds.scheduler_stats()
+        assert stats[('ActorTopLevel', 'new_raster')].count == 1
+        assert all(s.count == sum(s.histogram) for s in stats.values())
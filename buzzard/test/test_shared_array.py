@@ -0,0 +1,145 @@
+import os
+import gc
+import functools
+import multiprocessing as mp
+import multiprocessing.pool
+
+import numpy as np
+import pytest
+
+from buzzard._actors import shared_array
+
+if shared_array.SHARED_MEMORY_AVAILABLE:
+    from multiprocessing import shared_memory
+
+pytestmark = pytest.mark.skipif(
+    not shared_array.SHARED_MEMORY_AVAILABLE, reason='requires multiprocessing.shared_memory',
+)
+
+def _segment_count():
+    return len(shared_array._SEGMENT_OF_ROOT_ID)
+
+def _job(arr, arr_per_name):
+    assert isinstance(arr, np.ndarray)
+    return arr * 2 + arr_per_name['x'].sum()
+
+def _is_writeable(arr):
+    return arr.flags.writeable
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = mp.pool.Pool(2)
+    yield pool
+    pool.terminate()
+    pool.join()
+
+def test_round_trip(pool):
+    count0 = _segment_count()
+    a = np.arange(96 * 256, dtype='float32').reshape(96, 256)
+    x = np.ones((100, 100, 2))
+
+    func = functools.partial(
+        shared_array.share_result, _job, shared_array.share_array(a),
+        {'x': shared_array.share_array(x)},
+    )
+    res = pool.apply(func)
+    assert type(res) is np.ndarray
+    assert np.all(res == a * 2 + 20000)
+
+    # Segments of the inputs are released with the job
+    del func
+    gc.collect()
+    assert _segment_count() == count0 + 1
+
+    # Sharing a view of an array that wraps a segment does not allocate a new segment
+    view = res[1:, ::2]
+    ticket = shared_array.share_array(view)
+    assert _segment_count() == count0 + 1
+    assert np.all(pool.apply(functools.partial(shared_array.share_result, np.copy, ticket)) == view)
+
+    # Segment of the result is released with the result
+    del ticket, view, res
+    gc.collect()
+    assert _segment_count() == count0
+
+def test_fallbacks(pool):
+    empty = np.zeros((0, 3))
+    assert shared_array.share_array(empty) is empty
+    assert shared_array.share_array(None) is None
+    assert pool.apply(functools.partial(shared_array.share_result, np.copy, empty)).shape == (0, 3)
+    assert pool.apply(functools.partial(shared_array.share_result, str, 42)) == '42'
+
+    # Small arrays are pickled
+    count0 = _segment_count()
+    small = np.arange(10.)
+    ticket = shared_array.share_array(small)
+    assert _segment_count() == count0
+    assert np.all(pool.apply(functools.partial(shared_array.share_result, np.copy, ticket)) == small)
+
+def test_read_only(pool):
+    # The arrays sent to a job can't be modified by the job, whether they are shared or pickled
+    for arr in [np.ones(10), np.ones(100000)]:
+        ticket = shared_array.share_array(arr)
+        assert not pool.apply(functools.partial(_is_writeable, ticket))
+        assert arr.flags.writeable
+
+    # The results are owned by the process that receives them
+    res = pool.apply(functools.partial(shared_array.share_result, np.ones, 100000))
+    assert res.flags.writeable
+
+def test_job_segments(pool):
+    count0 = _segment_count()
+    arr = np.arange(100000.)
+
+    # A segment used by a job that returned is left to the garbage collection
+    segments = shared_array.JobSegments()
+    ticket = segments.share_array(arr)
+    name = ticket.name
+    res = pool.apply(functools.partial(
+        shared_array.share_result, np.copy, ticket, result_name=segments.result_name,
+    ))
+    segments.done()
+    assert np.all(res == arr)
+    del res
+    gc.collect()
+    assert _segment_count() == count0 + 1
+
+    # A segment used by a cancelled job is unlinked once no other job uses it, the arrays that wrap
+    # it stay valid
+    root = ticket.keepalive
+    segments1 = shared_array.JobSegments()
+    segments2 = shared_array.JobSegments()
+    assert segments1.share_array(root).name == name
+    assert segments2.share_array(root).name == name
+    segments.release()
+    segments1.release()
+    shared_memory.SharedMemory(name).close()
+    segments2.release()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name)
+    assert _segment_count() == count0
+    assert np.all(root == arr)
+
+    # The next jobs get a new segment
+    segments = shared_array.JobSegments()
+    assert segments.share_array(root).name != name
+    segments.release()
+
+    # The result of a job that never returned is unlinked
+    segments = shared_array.JobSegments()
+    shared_array.share_result(np.copy, arr, result_name=segments.result_name)
+    shared_memory.SharedMemory(segments.result_name).close()
+    segments.release()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(segments.result_name)
+
+def test_pool_process_recycling():
+    pool = mp.pool.Pool(1, maxtasksperchild=1)
+    try:
+        ticket = shared_array.share_array(np.arange(10000.))
+        for _ in range(3):
+            # A pool's process exiting should not release the segment
+            assert pool.apply(functools.partial(shared_array.share_result, np.sum, ticket)) == 49995000
+    finally:
+        pool.terminate()
+        pool.join()
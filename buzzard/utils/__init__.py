@@ -1,3 +1,5 @@
 """Utility code for buzzard's users"""
 
 from ._merge_functions import concat_arrays
+from ._scheduler_profiler import SchedulerProfiler, MessageStats
+from ._chrome_trace_recorder import ChromeTraceRecorder
@@ -0,0 +1,209 @@
+import itertools
+import json
+import threading
+
+from buzzard.utils._scheduler_profiler import perf_counter_ns
+
+class ChromeTraceRecorder:
+    """Debug observer that records a timeline of a Dataset's scheduler, of the jobs running on the
+    pools and of the queries to the rasters. The timeline is written in the Chrome trace JSON format
+    (load it in `chrome://tracing` or https://ui.perfetto.dev).
+
+    Pass an instance to the `debug_observers` parameter of the `Dataset` to record the scheduler
+    activity and the pool jobs, and to the `debug_observers` parameter of the rasters to record
+    their queries.
+
+    Recording only appends tuples to lists, the json document is built when calling `dump` or when
+    the Dataset is closed.
+
+    Parameters
+    ----------
+    path: None or str
+        If not None, the trace is written to `path` when the Dataset is closed
+
+    Example
+    -------
+    >>> rec = buzz.utils.ChromeTraceRecorder('trace.json')
+    ... with buzz.Dataset(debug_observers=[rec]).close as ds:
+    ...     r = ds.acreate_cached_raster_recipe(..., debug_observers=[rec])
+    ...     r.get_data()
+
+    Caveat
+    ------
+    The duration of a pool job is measured from the scheduler's point of view, from the submission
+    of the job to the call of the pool's callback. It includes the time spent in the pool's
+    internal queue (see `ActorPoolWaitingRoom` for the number of jobs that may be waiting there).
+    Each row of a pool shows one pool task at a time, the jobs launched as one batch (see
+    `ActorPoolWorkingRoom`) share a row. Since the tasks waiting in the pool's queue also have a
+    row, there may be a bit more rows than workers.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._t0 = perf_counter_ns()
+
+        # Scheduler activity
+        self._scheduler_busy_since = None
+        self._scheduler_spans = [] # type: List[Tuple[int, int]]
+
+        # Pool jobs
+        self._pool_infos = {} # type: Mapping[int, Tuple[str, List[int], int]]
+        self._task_slots = {} # type: Mapping[Tuple[int, int], List[int]]
+        self._job_starts = {} # type: Mapping[PoolJobWorking, Tuple[int, int]]
+        self._job_spans = [] # type: List[Tuple[int, int, str, int, int, bool]]
+        self._token_counts = [] # type: List[Tuple[int, int, int, float]]
+
+        # Queries
+        self._query_ids = itertools.count()
+        self._query_id_of_qi = {} # type: Mapping[CachedQueryInfos, int]
+        self._query_events = [] # type: List[Tuple[str, str, int, int, int, str]]
+
+    # Observer's callbacks ********************************************************************** **
+    def on_scheduler_activity_update(self, busy):
+        now = perf_counter_ns()
+        with self._lock:
+            if busy:
+                self._scheduler_busy_since = now
+            elif self._scheduler_busy_since is not None:
+                self._scheduler_spans.append((self._scheduler_busy_since, now))
+                self._scheduler_busy_since = None
+
+    def on_pool_job_started(self, pool, job, task_id):
+        now = perf_counter_ns()
+        with self._lock:
+            pool_id = self._register_pool(pool)
+            key = (pool_id, task_id)
+            task = self._task_slots.get(key)
+            if task is None:
+                # First job of a pool task, the task takes a free row
+                name, free_slots, slot_count = self._pool_infos[pool_id]
+                if free_slots:
+                    slot = free_slots.pop()
+                else:
+                    slot = slot_count
+                    self._pool_infos[pool_id] = (name, free_slots, slot_count + 1)
+                task = [slot, 0]
+                self._task_slots[key] = task
+            task[1] += 1
+            self._job_starts[job] = (now, task[0])
+
+    def on_pool_job_stopped(self, pool, job, success, task_id):
+        now = perf_counter_ns()
+        with self._lock:
+            pool_id = id(pool)
+            key = (pool_id, task_id)
+            start, slot = self._job_starts.pop(job)
+            task = self._task_slots[key]
+            task[1] -= 1
+            if task[1] == 0:
+                # Last job of the pool task, the row is free
+                del self._task_slots[key]
+                self._pool_infos[pool_id][1].append(slot)
+            self._job_spans.append((start, now, job.sender_address, pool_id, slot, success))
+
+    def on_pool_token_count_update(self, pool, token_count, idle_ratio, queue_wait, duration):
+        now = perf_counter_ns()
+        with self._lock:
+            pool_id = self._register_pool(pool)
+            self._token_counts.append((now, pool_id, token_count, idle_ratio))
+
+    def on_query_started(self, raster, qi):
+        now = perf_counter_ns()
+        with self._lock:
+            # `id(qi)` may be reused by a later query once `qi` is collected
+            qi_id = next(self._query_ids)
+            self._query_id_of_qi[qi] = qi_id
+            self._query_events.append((
+                'b', repr(raster), qi_id, now, qi.produce_count, None,
+            ))
+
+    def on_query_stopped(self, raster, qi, status):
+        now = perf_counter_ns()
+        with self._lock:
+            qi_id = self._query_id_of_qi.pop(qi)
+            self._query_events.append((
+                'e', repr(raster), qi_id, now, qi.produce_count, status,
+            ))
+
+    def on_scheduler_stopping(self):
+        if self._path is not None:
+            self.dump(self._path)
+
+    def _register_pool(self, pool):
+        pool_id = id(pool)
+        if pool_id not in self._pool_infos:
+            self._pool_infos[pool_id] = (f'{type(pool).__name__}{pool_id:#x}', [], 0)
+        return pool_id
+
+    # Export ************************************************************************************ **
+    def dump(self, path):
+        """Write the events recorded so far to `path` in the Chrome trace JSON format"""
+        with open(path, 'w') as stream:
+            json.dump(self.trace(), stream)
+
+    def trace(self):
+        """Build the Chrome trace JSON document of the events recorded so far
+
+        Returns
+        -------
+        dict
+        """
+        def _us(ns):
+            return (ns - self._t0) / 1000
+
+        with self._lock:
+            pool_infos = dict(self._pool_infos)
+            job_spans = list(self._job_spans)
+            token_counts = list(self._token_counts)
+            scheduler_spans = list(self._scheduler_spans)
+            query_events = list(self._query_events)
+
+        events = [
+            _metadata('process_name', 0, 0, 'Scheduler'),
+            _metadata('process_name', 1, 0, 'Queries'),
+        ]
+        for start, stop in scheduler_spans:
+            events.append({
+                'name': 'busy', 'cat': 'scheduler', 'ph': 'X',
+                'ts': _us(start), 'dur': (stop - start) / 1000, 'pid': 0, 'tid': 0,
+            })
+
+        pid_of_pool = {}
+        for pool_id, (name, _, slot_count) in pool_infos.items():
+            pid = 2 + len(pid_of_pool)
+            pid_of_pool[pool_id] = pid
+            events.append(_metadata('process_name', pid, 0, name))
+            for slot in range(slot_count):
+                events.append(_metadata('thread_name', pid, slot, f'slot {slot}'))
+        for start, stop, sender_address, pool_id, slot, success in job_spans:
+            _, raster, actor = sender_address.split('/')
+            events.append({
+                'name': actor, 'cat': 'pool_job', 'ph': 'X',
+                'ts': _us(start), 'dur': (stop - start) / 1000,
+                'pid': pid_of_pool[pool_id], 'tid': slot,
+                'args': {'raster': raster, 'success': success},
+            })
+
+        for ts, pool_id, token_count, idle_ratio in token_counts:
+            events.append({
+                'name': 'tokens', 'cat': 'pool_tokens', 'ph': 'C',
+                'ts': _us(ts), 'pid': pid_of_pool[pool_id],
+                'args': {'token_count': token_count, 'idle_ratio': idle_ratio},
+            })
+
+        for ph, raster, qi_id, ts, produce_count, status in query_events:
+            events.append({
+                'name': raster, 'cat': 'query', 'ph': ph, 'id': qi_id,
+                'ts': _us(ts), 'pid': 1, 'tid': 0,
+                'args': (
+                    {'produce_count': produce_count}
+                    if ph == 'b' else
+                    {'status': status}
+                ),
+            })
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def _metadata(name, pid, tid, value):
+    return {'name': name, 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': value}}
@@ -0,0 +1,90 @@
+import collections
+import sys
+import threading
+import time
+
+# Number of buckets of the latency histograms. Bucket `i` counts the durations `d` in nanoseconds
+# such that `2 ** (i - 1) <= d < 2 ** i`, the last bucket also counts all the longer durations.
+_BUCKET_COUNT = 40
+
+if sys.version_info >= (3, 7):
+    perf_counter_ns = time.perf_counter_ns
+else: # pragma: no cover
+    def perf_counter_ns():
+        """`time.perf_counter_ns` is new in python 3.7"""
+        return int(time.perf_counter() * 1e9)
+
+MessageStats = collections.namedtuple('MessageStats', [
+    'count', 'total_ns', 'max_ns', 'histogram',
+])
+MessageStats.__doc__ = """Statistics of the messages of one title received by one class of actor
+
+Parameters
+----------
+count: int
+    Number of messages received
+total_ns: int
+    Total time spent in the receiving method, in nanoseconds
+max_ns: int
+    Longest time spent in the receiving method, in nanoseconds
+histogram: tuple of int
+    Latency histogram with logarithmic buckets, `histogram[i]` is the number of messages that
+    took between `2 ** (i - 1)` (inclusive) and `2 ** i` (exclusive) nanoseconds.
+"""
+
+class SchedulerProfiler:
+    """Debug observer that aggregates the time spent by a Dataset's scheduler in each actor.
+
+    Pass an instance to the `debug_observers` parameter of `Dataset` and call
+    `Dataset.scheduler_stats()` (or `SchedulerProfiler.snapshot()`) to retrieve the statistics.
+
+    The scheduler only times the messages when a debug observer listens to the `message_passed`
+    or `message_passed_ns` events, a Dataset without profiler does not pay for the timing. The
+    profiler listens to `message_passed_ns`, the durations are integer nanoseconds measured with
+    `time.perf_counter_ns` (`time.perf_counter` before python 3.7).
+
+    Example
+    -------
+    >>> ds = buzz.Dataset(debug_observers=[buzz.utils.SchedulerProfiler()])
+    ... # code...
+    ... for (actor_class, title), stats in ds.scheduler_stats().items():
+    ...     print(actor_class, title, stats.count, stats.total_ns / stats.count)
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def on_message_passed_ns(self, actor_class_name, message_title, delta_ns):
+        bucket = min(delta_ns.bit_length(), _BUCKET_COUNT - 1)
+        key = (actor_class_name, message_title)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = [0, 0, 0, [0] * _BUCKET_COUNT]
+                self._stats[key] = stats
+            stats[0] += 1
+            stats[1] += delta_ns
+            if delta_ns > stats[2]:
+                stats[2] = delta_ns
+            stats[3][bucket] += 1
+
+    def snapshot(self):
+        """Retrieve a copy of the statistics gathered so far. Thread-safe.
+
+        Returns
+        -------
+        dict of (str, str) to MessageStats
+            Mapping from `(actor class name, message title)` to statistics
+        """
+        with self._lock:
+            return {
+                key: MessageStats(count, total_ns, max_ns, tuple(histogram))
+                for key, (count, total_ns, max_ns, histogram) in self._stats.items()
+            }
+
+    def reset(self):
+        """Forget the statistics gathered so far. Thread-safe."""
+        with self._lock:
+            self._stats = {}
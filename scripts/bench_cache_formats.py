@@ -0,0 +1,80 @@
+"""
+Benchmark of the read throughput of the cache file formats of the cached raster recipes.
+
+```sh
+$ python scripts/bench_cache_formats.py
+$ python scripts/bench_cache_formats.py --size 4096 --tile-size 256 --channel-count 3
+```
+
+For each `cache_driver`, a cached raster recipe is created in a temporary directory and its cache
+is filled. The cache tiles are then read back `--repeat` times, either one by one (the arrays of
+the `npy` format are zero-copy views of the cache files) or through windows straddling several
+cache tiles.
+
+"""
+
+import argparse
+import functools
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import buzzard as buzz
+
+def _compute(fp, primitive_fps, primitive_arrays, raster, channel_count):
+    return np.full(np.r_[fp.shape, channel_count], 42, 'float32')
+
+def run(ds, cache_driver, fp, tile_size, channel_count, repeat):
+    """Fill a cache with `cache_driver` and print the read throughput"""
+    cache_dir = tempfile.mkdtemp(prefix='bench_cache_formats_')
+    try:
+        r = ds.acreate_cached_raster_recipe(
+            fp, 'float32', channel_count,
+            compute_array=functools.partial(_compute, channel_count=channel_count),
+            cache_dir=cache_dir,
+            cache_tiles=(tile_size, tile_size),
+            cache_driver=cache_driver,
+        )
+        aligned_tiles = r.cache_tiles.flatten().tolist()
+        shifted_tiles = fp.erode(tile_size // 2).tile((tile_size, tile_size)).flatten().tolist()
+
+        # Fill the cache
+        for _ in r.iter_data(aligned_tiles):
+            pass
+
+        for name, tiles in [('aligned', aligned_tiles), ('shifted', shifted_tiles)]:
+            nbytes = sum(tile.rarea for tile in tiles) * channel_count * 4
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                for _ in r.iter_data(tiles):
+                    pass
+                total = time.perf_counter() - t0
+                print('{:>6} {:>8}: {:5d} tiles in {:7.3f}s ({:8.1f} MB/s)'.format(
+                    cache_driver, name, len(tiles), total, nbytes / total / 2 ** 20,
+                ))
+        r.close()
+    finally:
+        shutil.rmtree(cache_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=int, default=2048)
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--channel-count', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--drivers', nargs='+', default=['GTiff', 'npy'])
+    args = parser.parse_args()
+
+    fp = buzz.Footprint(
+        tl=(0, args.size),
+        size=(args.size, args.size),
+        rsize=(args.size, args.size),
+    )
+    with buzz.Dataset().close as ds:
+        for cache_driver in args.drivers:
+            run(ds, cache_driver, fp, args.tile_size, args.channel_count, args.repeat)
+
+if __name__ == '__main__':
+    main()
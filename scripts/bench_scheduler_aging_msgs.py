@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of the Dataset's scheduler main loop: flood it with `AgingMsg` and measure the
+dispatch throughput. Run it on two revisions of buzzard to compare them.
+
+```sh
+$ python scripts/bench_scheduler_aging_msgs.py
+$ python scripts/bench_scheduler_aging_msgs.py --msg-count 200000 --key-count 1
+```
+
+A fake raster is registered in the scheduler with two actors. On request, the `Flooder` actor
+emits `--msg-count` aging messages to the `Sink` actor, spread over `--key-count` distinct
+`id_args`. They are all emitted in a single pile and delivered in order, none is stale, the
+benchmark measures the cost of the staleness bookkeeping.
+
+"""
+
+import argparse
+import queue
+import time
+import uuid
+
+import buzzard as buzz
+from buzzard._actors.message import Msg, AgingMsg
+from buzzard._debug_observers_manager import DebugObserversManager
+
+class _FakeRaster:
+    def __init__(self):
+        self.uid = uuid.uuid4()
+        self.debug_mngr = DebugObserversManager(())
+        self.facade_proxy = None
+
+    def create_actors(self):
+        return [_ActorFlooder(self), _ActorSink(self)]
+
+class _ActorFlooder:
+    def __init__(self, raster):
+        self.address = f'/Raster{raster.uid}/Flooder'
+        self.alive = True
+
+    def ext_receive_flood(self, msg_count, key_count, done_queue):
+        return [
+            AgingMsg('Sink', 'update', (i % key_count,), (i,))
+            for i in range(msg_count)
+        ] + [
+            Msg('Sink', 'done', done_queue)
+        ]
+
+    def receive_die(self):
+        self.alive = False
+        return []
+
+class _ActorSink:
+    def __init__(self, raster):
+        self.address = f'/Raster{raster.uid}/Sink'
+        self.alive = True
+        self.received = 0
+
+    def receive_update(self, key, i):
+        self.received += 1
+        return []
+
+    def receive_done(self, done_queue):
+        done_queue.put(self.received)
+        self.received = 0
+        return []
+
+    def receive_die(self):
+        self.alive = False
+        return []
+
+def run(back_ds, msg_count, key_count, repeat):
+    """Flood the scheduler of `back_ds` and print the dispatch throughput"""
+    raster = _FakeRaster()
+    back_ds.put_message(Msg('/Global/TopLevel', 'new_raster', raster))
+    for _ in range(repeat):
+        done_queue = queue.Queue()
+        t0 = time.perf_counter()
+        back_ds.put_message(Msg(
+            f'/Raster{raster.uid}/Flooder', 'flood', msg_count, key_count, done_queue,
+        ))
+        received = done_queue.get()
+        total = time.perf_counter() - t0
+        print('{:8d} aging msgs over {:6d} keys in {:7.3f}s ({:10.0f} msgs/s), {:8d} delivered'.format(
+            msg_count, key_count, total, msg_count / total, received,
+        ))
+    back_ds.put_message(Msg('/Global/TopLevel', 'kill_raster', raster))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--msg-count', type=int, default=50000)
+    parser.add_argument('--key-count', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with buzz.Dataset().close as ds:
+        run(ds._back, args.msg_count, args.key_count, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Measure the latency added by the Dataset's scheduler when serving many small tiles from a cached
+raster recipe. Run it on two revisions of buzzard to compare them.
+
+```sh
+$ python scripts/bench_scheduler_latency.py
+$ python scripts/bench_scheduler_latency.py --tile-size 32 --tile-count 2000
+```
+
+Three phases are measured:
+- `compute`: one `iter_data` over all tiles, the cache is empty (compute + write + read),
+- `read`: one `iter_data` over all tiles, the cache is full (read only),
+- `get_data`: one `get_data` per tile, one round-trip through the scheduler per tile.
+
+"""
+
+import argparse
+import tempfile
+import shutil
+import time
+import multiprocessing as mp
+import multiprocessing.pool
+
+import numpy as np
+
+import buzzard as buzz
+
+def _compute_array(fp, *_):
+    return np.zeros(fp.shape, 'float32')
+
+def _percentiles(durations):
+    durations = np.asarray(durations) * 1000
+    return 'median:{:8.3f}ms  p90:{:8.3f}ms  max:{:8.3f}ms'.format(
+        np.median(durations), np.percentile(durations, 90), durations.max(),
+    )
+
+def _run_phase(name, tiles, func):
+    durations = []
+    t0 = time.perf_counter()
+    prev = t0
+    for _ in func(tiles):
+        now = time.perf_counter()
+        durations.append(now - prev)
+        prev = now
+    total = time.perf_counter() - t0
+    print('{:>8}: {:5d} tiles in {:7.3f}s  ({:8.3f} tiles/s)  per tile: {}'.format(
+        name, len(tiles), total, len(tiles) / total, _percentiles(durations),
+    ))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--tile-size', type=int, default=16)
+    parser.add_argument('--tile-count', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    side = int(np.ceil(np.sqrt(args.tile_count))) * args.tile_size
+    fp = buzz.Footprint(tl=(0, side), size=(side, side), rsize=(side, side))
+    tiles = fp.tile((args.tile_size, args.tile_size)).flatten().tolist()[:args.tile_count]
+
+    cache_dir = tempfile.mkdtemp(prefix='buzz-bench-')
+    pool = mp.pool.ThreadPool(args.workers)
+    try:
+        with buzz.Dataset().close as ds:
+            r = ds.acreate_cached_raster_recipe(
+                fp, 'float32', 1,
+                compute_array=_compute_array,
+                cache_dir=cache_dir,
+                cache_tiles=(args.tile_size, args.tile_size),
+                computation_pool=pool, merge_pool=pool, io_pool=pool, resample_pool=pool,
+            )
+            _run_phase('compute', tiles, r.iter_data)
+            _run_phase('read', tiles, r.iter_data)
+            _run_phase('get_data', tiles, lambda tiles: (r.get_data(fp=tile) for tile in tiles))
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(cache_dir)
+
+if __name__ == '__main__':
+    main()